@@ -20,6 +20,7 @@
 # */
 
 import os
+import fnmatch
 
 import xbmcgui
 import xbmcplugin
@@ -29,6 +30,9 @@ from resources.lib.utils import *
 from resources.lib.sync.notify_sync import NotifySyncClient
 from resources.lib.dropbox_file_browser import DropboxFileBrowser
 from resources.lib.dropbox_client import KodiDropboxClient, Downloader
+from resources.lib.network import is_offline
+from resources.lib.streaming_proxy import get_proxy_url
+from resources.lib.media_prefetcher import MediaPrefetcher
 
 
 HANDLE = int(sys.argv[1])
@@ -106,7 +110,7 @@ def run():
                     if renamed:
                         log(f"File renamed: from {path} to {renamed.metadata.path_display}")
                         xbmc.executebuiltin("Container.Refresh")
-                        NotifySyncClient().sync_path(account_settings, path)
+                        NotifySyncClient().sync_paths(account_settings, [path, renamed.metadata.path_lower])
                     else:
                         log_error(f"File rename failed: from {path} to {to_path}")
 
@@ -132,8 +136,7 @@ def run():
                     if moved:
                         log(f"File moved: from {path} to {to_path}")
                         xbmc.executebuiltin("Container.Refresh")
-                        NotifySyncClient().sync_path(account_settings, path)
-                        NotifySyncClient().sync_path(account_settings, to_path)
+                        NotifySyncClient().sync_paths(account_settings, [path, to_path])
                     else:
                         log_error(f"File move failed: from {path} to {to_path}")
 
@@ -166,6 +169,99 @@ def run():
 
                 del dialog
 
+        elif action == "batch":
+
+            if "path" in params:
+                path = params["path"]
+                metadata = client.get_metadata(path, directory=True)
+
+                if not metadata:
+                    return
+
+                entries = list(metadata["folders"].values())
+
+                for files in metadata["files"].values():
+                    entries.extend(files.values())
+                entries.sort(key=lambda entry: entry.name.lower())
+                dialog = xbmcgui.Dialog()
+                selection_type = dialog.select(LANGUAGE_STRING(30071), [LANGUAGE_STRING(30072), LANGUAGE_STRING(30073)])
+
+                if selection_type == 0:
+                    selected = dialog.multiselect(LANGUAGE_STRING(30072), [entry.name for entry in entries]) or []
+                    entries = [entries[i] for i in selected]
+                elif selection_type == 1:
+                    keyboard = xbmc.Keyboard("*", LANGUAGE_STRING(30074))
+                    keyboard.doModal()
+
+                    if not keyboard.isConfirmed():
+                        return
+
+                    pattern = keyboard.getText().lower()
+                    entries = [entry for entry in entries if fnmatch.fnmatch(entry.name.lower(), pattern)]
+                else:
+                    return
+
+                if not entries:
+                    dialog.ok(ADDON_NAME, LANGUAGE_STRING(30075))
+                    return
+
+                paths = [entry.path_display for entry in entries]
+                operation = dialog.select(f"{LANGUAGE_STRING(30071)} ({len(paths)})", [LANGUAGE_STRING(30022), LANGUAGE_STRING(30027), LANGUAGE_STRING(30024)])
+
+                if operation == 0:
+
+                    if not dialog.yesno(ADDON_NAME, f"{LANGUAGE_STRING(30023)} {len(paths)} ({', '.join(os.path.basename(item_path) for item_path in paths[:5])}...)"):
+                        return
+
+                    sync_paths = paths
+                    run_batch = lambda: client.delete_batch(paths)
+                elif operation in (1, 2):
+                    browser = DropboxFileBrowser("FileBrowser.xml", ADDON_PATH)
+                    browser.set_db_client(client)
+                    browser.set_heading(LANGUAGE_STRING(30025) + LANGUAGE_STRING(30028 if operation == 1 else 30026))
+                    browser.doModal()
+                    to_folder = browser.selected_folder
+                    del browser
+
+                    if not to_folder:
+                        return
+
+                    # Dropbox path -> don't use os.path.join()
+                    if to_folder[-1:] != DROPBOX_SEP:
+                        to_folder += DROPBOX_SEP
+
+                    relocations = [(path, to_folder + os.path.basename(path)) for path in paths]
+
+                    if operation == 1:
+                        sync_paths = paths + [to_folder]
+                        run_batch = lambda: client.move_batch(relocations)
+                    else:
+                        sync_paths = [to_folder]
+                        run_batch = lambda: client.copy_batch(relocations)
+
+                else:
+                    return
+
+                # The job runs on Dropbox, its status is polled until it finishes
+                xbmc.executebuiltin("ActivateWindow(busydialognocancel)")
+
+                try:
+                    results = run_batch()
+                finally:
+                    xbmc.executebuiltin("Dialog.Close(busydialognocancel)")
+
+                if results is None:
+                    log_error(f"Batch operation failed in: {path}")
+                    return
+
+                failed = [item_path for item_path, result in zip(paths, results) if not result]
+                log(f"Batch operation done in {path}: {len(results) - len(failed)} items, failed: {failed}")
+                xbmc.executebuiltin("Container.Refresh")
+                NotifySyncClient().sync_paths(account_settings, [path.lower() for path in sync_paths])
+
+                if failed:
+                    dialog.ok(ADDON_NAME, f"{LANGUAGE_STRING(30076)} {len(failed)}")
+
         elif action == "create_folder":
 
             if "path" in params:
@@ -205,6 +301,38 @@ def run():
                     else:
                         log_error(f"File upload failed: {filename} to {to_path}")
 
+        elif action == "upload_folder":
+
+            if "to_path" in params:
+                to_path = params["to_path"]
+                local_path = xbmcgui.Dialog().browse(0, LANGUAGE_STRING(30048), "files")
+
+                if local_path:
+                    uploaded = client.upload_folder(local_path, to_path, dialog=True)
+
+                    if uploaded:
+                        log(f"Folder uploaded: {local_path} to {to_path} ({uploaded.files_uploaded} files)")
+                        xbmc.executebuiltin("Container.Refresh")
+                        NotifySyncClient().sync_path(account_settings, to_path)
+
+                        if uploaded.skipped:
+                            log(f"Folder upload skipped {len(uploaded.skipped)} unchanged files")
+
+                        if uploaded.failed or uploaded.conflicts:
+                            log_error(f"Folder upload failed for: {uploaded.failed}, conflicts: {uploaded.conflicts}")
+                            xbmcgui.Dialog().ok(
+                                ADDON_NAME,
+                                "{} {}\n{} {}".format(
+                                    LANGUAGE_STRING(30209),
+                                    len(uploaded.failed),
+                                    LANGUAGE_STRING(30211),
+                                    len(uploaded.conflicts),
+                                )
+                            )
+
+                    else:
+                        log_error(f"Folder upload failed: {local_path} to {to_path}")
+
         elif action == "download":
 
             if "path" in params:
@@ -234,9 +362,27 @@ def run():
         elif action == "sync_now":
             path = params["path"]
             NotifySyncClient().sync_path(account_settings, path)
+        elif action == "view_original":
+            path = params["path"]
+            location = os.path.normpath(f"{get_cache_path(account_settings.account_name)}/shadow/{path}")
+
+            if not xbmcvfs.exists(location):
+                xbmc.executebuiltin("ActivateWindow(busydialognocancel)")
+
+                try:
+                    client.save_file(path, location, int(params.get("size", 0)))
+                finally:
+                    xbmc.executebuiltin("Dialog.Close(busydialognocancel)")
+
+            if xbmcvfs.exists(location):
+                xbmc.executebuiltin(f"ShowPicture({location})")
+            else:
+                xbmcgui.Dialog().ok(ADDON_NAME, LANGUAGE_STRING(30204))
         else:
             log_error(f"Unknown action received: {action}")
 
+        client.flush_cache()
+
     elif "module" in params:
         # Module chosen, load and execute module
         module = params["module"]
@@ -257,11 +403,29 @@ def run():
                 account_settings.account_name,
             )
             path = params["path"]
-            url = client.get_media_url(path)
+            prefetcher = MediaPrefetcher(client, account_settings.account_name)
+
+            if is_offline():
+                # Only a local copy can be played
+                url = get_local_copy(account_settings, path)
+            else:
+                # Prefer the proxy of the service, it reads ahead and caches
+                url = get_proxy_url(account_settings.account_name, path)
+
+                if not url:
+                    url = client.get_media_url(path)
+
+            if not url:
+                xbmcplugin.setResolvedUrl(HANDLE, False, xbmcgui.ListItem())
+                return
+
             log_debug(f"Media URL: {url}")
             list_item = xbmcgui.ListItem()
             list_item.select(True)
             list_item.setPath(url)
+            # Only subtitles which are downloaded already, the playback doesn't wait for Dropbox
+            subtitles = prefetcher.get_subtitles(path, download=False)
+            list_item.setSubtitles(subtitles)
             filename = params.get("filename")
 
             if filename:
@@ -269,6 +433,9 @@ def run():
                 video_info.setTitle(filename)
 
             xbmcplugin.setResolvedUrl(HANDLE, True, list_item)
+            # The service gets the next items of the folder ready while this one plays
+            NotifySyncClient().prefetch(account_settings.account_name, path, bool(subtitles))
+            client.flush_cache()
         else:
             log_error("Action play: no account name provided")
 
@@ -56,6 +56,9 @@ class AccountBrowser:
         for account_name in account_names:
             self.add_account(account_name)
 
+        if len(account_names) > 1:
+            self.add_search()
+
         self.add_action(LANGUAGE_STRING(30042), "add")
 
     def show(self):
@@ -89,6 +92,12 @@ class AccountBrowser:
         list_item.addContextMenuItems(context_menu_items)
         xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
 
+    def add_search(self):
+        list_item = xbmcgui.ListItem(LANGUAGE_STRING(30062))
+        list_item.setArt({"icon": "DefaultAddonsSearch.png", "thumb": "DefaultAddonsSearch.png"})
+        url = f"{ADDON_URL}?content_type={self._content_type}&module=search_accounts"
+        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
+
     def get_context_url(self, action, account_name):
         return f"RunPlugin({ADDON_URL}?action={action}&module=browse_account&account={account_name})"
 
@@ -195,6 +204,16 @@ def change_synchronization(account_settings):
                         log_debug("Wrong frequency value")
                         dialog.ok(ADDON_NAME, LANGUAGE_STRING(30208))
 
+                # Media which is only linked to (.strm files) instead of downloaded
+                media_types = ["video", "audio"]
+                labels = [LANGUAGE_STRING(30059), LANGUAGE_STRING(30060)]
+                preselect = [media_types.index(media_type) for media_type in account_settings.virtual_types]
+                selected = dialog.multiselect(LANGUAGE_STRING(30058), labels, preselect=preselect)
+
+                if selected is not None:
+                    account_settings.virtual_types = [media_types[index] for index in selected]
+                    log_debug(f"Stream links for media types: {account_settings.virtual_types}")
+
                 sync_settings_valid = True
 
     if sync_settings_valid:
@@ -33,7 +33,13 @@ class FolderBrowser(DropboxViewer):
         super().__init__(params, account_settings)
 
     def build_list(self):
-        super().build_list(self.get_metadata(self._current_path, directory=True))
+        items = self.get_metadata(self._current_path, directory=True)
+
+        # The index views are only at the top of the first page
+        if self._enabled_sync and self._current_path == DROPBOX_SEP and self._page == 0:
+            self.add_index_views()
+
+        super().build_list(items)
 
     def show(self):
         super().show(cache_to_disc=False)
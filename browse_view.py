@@ -0,0 +1,84 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import resources.lib.login as login
+from resources.lib.utils import *
+from resources.lib.dropbox_viewer import *
+from resources.lib.search_index import SearchIndex
+
+
+HANDLE = int(sys.argv[1])
+
+
+class IndexViewer(DropboxViewer):
+    """
+    Shows a view of the files of the account, ordered by the search index
+    (e.g. newest videos first), one page at a time
+    """
+
+    def __init__(self, params, account_settings):
+        super().__init__(params, account_settings)
+        self._view = params.get("view", "")
+        self._index = SearchIndex(self._account_name)
+
+    def build_list(self):
+
+        if self._view not in INDEX_VIEWS or not self._index.is_complete(DROPBOX_SEP):
+            return False
+
+        string_id, order, media_type = INDEX_VIEWS[self._view]
+        start = self._page * INDEX_VIEW_PAGE_SIZE
+        entries, has_more = self._index.get_range(order, media_type, DROPBOX_SEP, start, INDEX_VIEW_PAGE_SIZE)
+        self.create_loader()
+
+        for metadata in entries:
+            file_type = identify_file_type(metadata.name)
+
+            if not self._filter_files or self._content_type in ("executable", file_type):
+                self.add_file(metadata.path_lower, metadata, file_type)
+
+        if has_more:
+            self.add_next_page()
+
+        return True
+
+    def get_url(self, path, module=None):
+        url = super().get_url(path, module)
+        url += f"&view={self._view}"
+        return url
+
+    def show(self, succeeded=True):
+        super().show(cache_to_disc=False, succeeded=succeeded)
+
+
+def run(params):
+    # This is the entry point
+    account_name = params.get("account", "")
+    account_settings = login.get_account(account_name)
+
+    if account_settings:
+        viewer = IndexViewer(params, account_settings)
+
+        if viewer.build_list():
+            viewer.show()
+        else:
+            xbmcgui.Dialog().ok(ADDON_NAME, LANGUAGE_STRING(30068))
+            viewer.show(succeeded=False)
@@ -47,6 +47,7 @@ class AccountSettings:
         self.passcode_timeout = 30
         self.sync_freq = 5
         self.synchronisation = False
+        self.virtual_types = [] # Media types synchronized as .strm files
         self.account_dir = os.path.normpath(f"{DATA_PATH}/accounts/{self.account_name}") + os.sep # Add os seperator because it is a dir
 
         if xbmcvfs.exists(self.account_dir):
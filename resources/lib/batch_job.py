@@ -0,0 +1,77 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import xbmc
+
+import dropbox.exceptions
+
+from .utils import *
+from .network import NETWORK_ERRORS
+
+
+MAX_RETRIES = 3
+
+
+# The steps of a batch (launching a job, checking its status) are retried one
+# by one. Retrying a whole batch would launch the jobs which already ran again.
+def call_with_retries(function, *args):
+    """
+    Calls the API function, waits out rate limits and retries transient
+    failures up to MAX_RETRIES times
+    """
+
+    retries = 0
+
+    while True:
+
+        try:
+            return function(*args)
+        except dropbox.exceptions.RateLimitError as e:
+            xbmc.sleep((e.backoff or 1) * 1000)
+        except (dropbox.exceptions.InternalServerError, *NETWORK_ERRORS) as e:
+            retries += 1
+
+            if retries > MAX_RETRIES:
+                raise
+
+            log_error(f"{function.__name__} failed, retrying: {e!r}")
+            xbmc.sleep(1000 * 2 ** retries)
+
+
+def wait_for_job(launch, check):
+    """
+    Returns the result of a batch job, polling its status with check when
+    it runs asynchronously
+    """
+
+    if launch.is_complete():
+        return launch.get_complete()
+
+    job_id = launch.get_async_job_id()
+
+    while True:
+        xbmc.sleep(BATCH_POLL_INTERVAL)
+        status = call_with_retries(check, job_id)
+
+        if status.is_complete():
+            return status.get_complete()
+        elif not status.is_in_progress():
+            raise Exception(f"Batch job failed: {status!r}")
@@ -0,0 +1,242 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import threading
+import collections
+
+import xbmc
+import xbmcvfs
+
+from .utils import *
+from .network import is_offline
+from .account_settings import AccountSettings
+from .dropbox_client import KodiDropboxClient
+from .dropbox_cache import DropboxCache, get_thumbnail_location
+
+
+class CacheWarmer(threading.Thread):
+    """
+    Fills the browse cache of the accounts in the background, so browsing the
+    warmed folders is quick and works offline.
+    The configured folders and their subfolders are listed breadth first, at
+    most the number of the warmup_max_folders setting per account. Every folder
+    is listed like a folder opened in the plugin, with its own cursor, so a
+    later run only fetches its changes. The plugin lists a warmed folder
+    without asking Dropbox for DropboxCache.WARMED_TIME, after that it checks
+    the changes again. The thumbnails of the media in these folders are
+    downloaded as well.
+    A run only starts when Kodi is idle and nothing plays, and stops at the
+    API call and bandwidth budgets. The next run continues where it stopped.
+    """
+
+    INTERVAL = 300 # Seconds between runs
+    IDLE_TIME = 60 # Seconds without user input before a run
+    THROTTLE = 200 # Milliseconds between calls
+    THUMBNAIL_BATCH = 25 # Maximum number of entries of files_get_thumbnail_batch
+    THUMBNAIL_TYPES = ("image", "video")
+
+    def __init__(self):
+        super().__init__()
+        self.daemon = True
+        self._stop_event = threading.Event()
+        self._passes = {} # account_name: (roots, folders left, folders queued)
+        self._truncated = set() # Accounts of which the pass reached the folder limit
+        self._max_folders = 0
+        self._calls = 0
+        self._max_calls = 0
+        self._bytes = 0
+        self._max_bytes = 0
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def run(self):
+        player = xbmc.Player()
+
+        while not self.stopped():
+            delay = self.IDLE_TIME
+
+            try:
+
+                if ADDON_SETTINGS.getBool("cache_warmup", False) and not player.isPlaying() and xbmc.getGlobalIdleTime() >= self.IDLE_TIME:
+                    self.warm_up()
+                    delay = self.INTERVAL
+
+            except Exception as e:
+                log_error(f"CacheWarmer Exception: {e!r}")
+
+            self._stop_event.wait(delay)
+
+    def _within_budget(self):
+        return not self.stopped() and self._calls < self._max_calls and self._bytes < self._max_bytes
+
+    @staticmethod
+    def get_roots():
+        roots = []
+
+        # The setting is None when it was never set
+        for root in (ADDON_SETTINGS.getString("warmup_paths") or "").split(","):
+            root = root.strip().lower()
+
+            if root:
+                roots.append(DROPBOX_SEP + root.strip(DROPBOX_SEP))
+
+        return roots
+
+    def warm_up(self):
+        accounts_dir = f"{DATA_PATH}/accounts/"
+        roots = self.get_roots()
+
+        if not roots or not xbmcvfs.exists(accounts_dir) or is_offline():
+            return
+
+        self._calls = 0
+        self._max_calls = ADDON_SETTINGS.getInt("warmup_api_calls", 100)
+        self._bytes = 0
+        self._max_bytes = ADDON_SETTINGS.getInt("warmup_bandwidth", 50) * 1024 * 1024
+        # Per account, the cache of an account is stored as a whole
+        self._max_folders = ADDON_SETTINGS.getInt("warmup_max_folders", 200)
+        log_debug(f"CacheWarmer: warming up {roots}")
+
+        for account_name in os.listdir(accounts_dir):
+            account_settings = AccountSettings(account_name)
+
+            if not account_settings.access_token:
+                continue
+
+            # Load the cache of now, the plugin may have changed it
+            cache = DropboxCache(account_name)
+            client = KodiDropboxClient(
+                account_settings.access_token,
+                account_settings.refresh_token,
+                account_settings.app_key,
+                account_settings.app_secret,
+                account_name,
+                cache,
+                auto_connect=False,
+            )
+            client.connect()
+
+            try:
+
+                if not self.warm_account(client, cache, account_name, roots):
+                    break
+
+            finally:
+                cache.flush()
+
+        log_debug(f"CacheWarmer: used {self._calls} calls and {self._bytes} bytes")
+
+    def warm_account(self, client, cache, account_name, roots):
+        """
+        Continues the pass over the folders of the account, returns False when
+        the budget is used
+        """
+
+        if self._passes.get(account_name, (None,))[0] != roots:
+            self._passes[account_name] = (roots, collections.deque(roots), set(roots))
+            self._truncated.discard(account_name)
+
+        roots, folders, queued = self._passes[account_name]
+
+        while folders:
+
+            if not self._within_budget():
+                return False
+
+            path = folders[0]
+            cached_folder = cache.get_folder(path)
+            metadata = client.update_metadata(path)
+            self._calls += 1
+
+            if metadata is None and is_offline():
+                return False
+
+            folders.popleft()
+
+            # None when the folder is gone
+            if metadata:
+
+                if cache.get_folder(path).get("entries") is not cached_folder.get("entries"):
+                    # A new or changed listing, charged by its cached size which
+                    # is close to the size of the response
+                    self._bytes += len(repr(metadata))
+
+                for folder_path in metadata["folders"]:
+
+                    if folder_path in queued:
+                        continue
+
+                    if len(queued) >= self._max_folders:
+
+                        if account_name not in self._truncated:
+                            log(f"CacheWarmer: {account_name} has more than {self._max_folders} folders in {roots}, the rest isn't warmed up")
+                            self._truncated.add(account_name)
+
+                        break
+
+                    queued.add(folder_path)
+                    folders.append(folder_path)
+
+                if not self.save_thumbnails(client, account_name, metadata):
+                    return False
+
+            xbmc.sleep(self.THROTTLE)
+
+        # The pass is done, the next run starts a new one
+        del self._passes[account_name]
+        return True
+
+    def save_thumbnails(self, client, account_name, metadata):
+        """
+        Downloads the missing thumbnails of the media in the listing, returns
+        False when the budget is used
+        """
+
+        thumb_path = f"{get_cache_path(account_name)}/thumb/"
+        locations = {}
+
+        for file_type in self.THUMBNAIL_TYPES:
+
+            for file_path in metadata["files"][file_type]:
+                location = get_thumbnail_location(thumb_path, file_path)
+
+                if not xbmcvfs.exists(location):
+                    locations[file_path] = location
+
+        file_paths = list(locations)
+
+        for i in range(0, len(file_paths), self.THUMBNAIL_BATCH):
+
+            if not self._within_budget():
+                return False
+
+            batch = file_paths[i:i + self.THUMBNAIL_BATCH]
+            client.save_thumbnails([client.create_thumbnail_obj(path) for path in batch], locations)
+            self._calls += 1
+            self._bytes += sum(os.path.getsize(locations[path]) for path in batch if os.path.exists(locations[path]))
+            xbmc.sleep(self.THROTTLE)
+
+        return True
@@ -61,6 +61,43 @@ IMAGE_EXT = (
     "svg",
 )
 
+# Images the thumbnail API can render (up to THUMBNAIL_MAX_SIZE)
+PREVIEW_EXT = (
+    "bmp",
+    "gif",
+    "jpg",
+    "jpeg",
+    "png",
+)
+
+THUMBNAIL_MAX_SIZE = 20 * 1024 * 1024
+THUMBNAIL_SIZE = "w640h480"
+PREVIEW_SIZE = "w2048h1536"
+
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = 1000
+SEARCH_TIME_BUDGET = 10 # Seconds per account for a search of all accounts
+
+# Search file categories per content type, matching folders are always shown
+SEARCH_CATEGORIES = {
+    "video": ("video", "folder"),
+    "audio": ("audio", "folder"),
+    "image": ("image", "folder"),
+}
+
+# Views of the search index: (string id, order, media type or None for all)
+INDEX_VIEWS = {
+    "recent_video": (30063, "date", "video"),
+    "recent_audio": (30064, "date", "audio"),
+    "image_by_date": (30065, "date", "image"),
+    "largest": (30066, "size", None),
+}
+
+INDEX_VIEW_PAGE_SIZE = 100
+
+BATCH_SIZE = 1000 # Maximum number of entries of a batch job
+BATCH_POLL_INTERVAL = 1000 # Milliseconds
+
 AUDIO_EXT = (
     "aac",
     "aiff",
@@ -77,3 +114,12 @@ AUDIO_EXT = (
     "wav",
     "wma",
 )
+
+SUBTITLE_EXT = (
+    "ass",
+    "smi",
+    "srt",
+    "ssa",
+    "sub",
+    "vtt",
+)
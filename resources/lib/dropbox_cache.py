@@ -1,5 +1,7 @@
 import os
+import re
 import queue
+import time
 import shutil
 import datetime
 import threading
@@ -21,7 +23,73 @@ from dropbox.files import (
 from .utils import *
 
 
+PREVIEW_PATTERN = re.compile(r"(.+)\.[0-9a-f]+\.jpg") # Image name, revision
+
+
+def get_previews(dir_name):
+    """
+    Returns the previews in the preview folder by the name of their image,
+    there can be previews of several revisions of an image
+    """
+
+    previews = {}
+
+    if not os.path.isdir(dir_name):
+        return previews
+
+    for filename in os.listdir(dir_name):
+        match = PREVIEW_PATTERN.fullmatch(filename)
+
+        if match:
+            previews.setdefault(match.group(1), []).append(os.path.join(dir_name, filename))
+
+    return previews
+
+
+def get_media_info(metadata):
+    """
+    Returns the media info of a file in compact form:
+    (duration in seconds, width, height, time taken) or None
+    """
+
+    media_info = getattr(metadata, "media_info", None)
+
+    # Still pending when Dropbox hasn't processed the file yet
+    if not media_info or not media_info.is_metadata():
+        return None
+
+    info = media_info.get_metadata()
+    duration = getattr(info, "duration", None) # Only videos have a duration
+    dimensions = info.dimensions
+    time_taken = info.time_taken
+    return (
+        duration // 1000 if duration else 0,
+        dimensions.width if dimensions else 0,
+        dimensions.height if dimensions else 0,
+        time_taken.strftime("%Y-%m-%d %H:%M:%S") if time_taken else "",
+    )
+
+
+def get_thumbnail_location(thumb_path, path):
+    location = replace_file_extension(path, "jpg")
+    return os.path.normpath(thumb_path + location)
+
+
+def get_deleted_metadata(metadata):
+    return DeletedMetadata(name=metadata.name, path_lower=metadata.path_lower, path_display=metadata.path_display)
+
+
 class DropboxCache(StorageServer.StorageServer):
+    """
+    Keeps the cached data of an account in memory and shares it between the
+    plugin, the deletion thread and the FileLoader workers.
+    Changes are buffered and written back to the StorageServer by a flush
+    timer, so many changes in a short time only cost one serialization.
+    """
+
+    FLUSH_DELAY = 2.0 # Seconds
+    LOCAL_CHANGE_TIME = 10.0 # Seconds a folder changed by the addon is listed without asking Dropbox
+    WARMED_TIME = 600.0 # Seconds a folder listed by the cache warm-up is listed without asking Dropbox
 
     def __init__(self, account_name):
         super().__init__(ADDON_NAME)
@@ -29,7 +97,12 @@ class DropboxCache(StorageServer.StorageServer):
         cache_path = get_cache_path(account_name)
         self._shadow_path = f"{cache_path}/shadow/"
         self._thumb_path = f"{cache_path}/thumb/"
+        self._preview_path = f"{cache_path}/preview/"
         self._data = None
+        self._data_lock = threading.RLock()
+        self._folder_locks = {}
+        self._dirty = {"links": set(), "metadata": set()}
+        self._flush_timer = None
         self._stop_event = threading.Event()
 
     def stop(self):
@@ -39,31 +112,197 @@ class DropboxCache(StorageServer.StorageServer):
         return self._stop_event.is_set()
 
     def delete(self):
-        super().delete(self._cache_name)
-
-    def save(self, data=None):
 
-        if data is None:
-            data = self._data
-        else:
-            self._data = data
+        with self._data_lock:
+            self._cancel_flush()
+            self._dirty = {"links": set(), "metadata": set()}
+            self._data = None
+            self._prune_folder_locks(list(self._folder_locks))
 
-        super().set(self._cache_name, repr(data))
+        super().delete(self._cache_name)
 
-    def get(self):
+    def _load(self):
         data = super().get(self._cache_name)
 
         if data:
-            self._data = eval(data)
+            return eval(data)
         else:
-            self._data = {
+            return {
                 "links": {},
                 "metadata": {},
             }
 
-        return self._data
+    def get(self):
+
+        with self._data_lock:
+
+            if self._data is None:
+                self._data = self._load()
+
+            return self._data
+
+    def folder_lock(self, path):
+        """
+        Returns the lock which guards the listing of a single folder
+        """
+
+        with self._data_lock:
+            return self._folder_locks.setdefault(path, threading.RLock())
+
+    def _prune_folder_locks(self, paths):
+        # A lock which is in use is kept, its holder may still rely on it
+        for path in paths:
+            lock = self._folder_locks.get(path)
+
+            if lock and lock.acquire(blocking=False):
+                del self._folder_locks[path]
+                lock.release()
+
+    def _delete_folders(self, path):
+        """
+        Deletes the cached listings of the folder and its subfolders
+        """
+
+        folders = self.get()["metadata"]
+        prefix = path + DROPBOX_SEP
+
+        for folder_path in [folder_path for folder_path in folders if folder_path == path or folder_path.startswith(prefix)]:
+            del folders[folder_path]
+            self._mark_dirty("metadata", folder_path)
+
+        self._prune_folder_locks([folder_path for folder_path in self._folder_locks if folder_path == path or folder_path.startswith(prefix)])
+
+    def get_folder(self, path):
+
+        with self._data_lock:
+            return self.get()["metadata"].get(path, {})
+
+    def set_folder(self, path, cursor, entries):
+
+        with self._data_lock:
+            self.get()["metadata"][path] = {
+                "cursor": cursor,
+                "entries": entries,
+            }
+            self._mark_dirty("metadata", path)
+
+    def apply_changes(self, entries):
+        """
+        Applies the metadata returned by a file action (e.g. a move) to the
+        cached folders, so the listing after the action needs no Dropbox call
+        """
+
+        with self._data_lock:
+            folders = self.get()["metadata"]
+
+            for metadata in entries:
+                path = metadata.path_lower
+                dir_name = os.path.dirname(path)
+                folder = folders.get(dir_name)
+
+                if folder:
+                    folders[dir_name] = dict(folder, entries=self.sort_metadata([metadata], folder["entries"]), changed=time.time())
+                    self._mark_dirty("metadata", dir_name)
+
+                if isinstance(metadata, DeletedMetadata):
+                    # The listings inside a deleted folder are gone as well
+                    self._delete_folders(path)
+
+    def is_changed_locally(self, folder):
+        """
+        Checks if the cached folder was just changed by a file action
+        """
+
+        return bool(folder) and time.time() < folder.get("changed", 0) + self.LOCAL_CHANGE_TIME
+
+    def mark_warmed(self, path):
+        """
+        Marks the cached folder as just listed by the warm-up of the cache
+        """
+
+        with self._data_lock:
+            folders = self.get()["metadata"]
+            folder = folders.get(path)
+
+            if folder:
+                folders[path] = dict(folder, warmed=time.time())
+                self._mark_dirty("metadata", path)
+
+    def is_warmed(self, folder):
+        """
+        Checks if the cached folder was just listed by the warm-up of the cache
+        """
+
+        return bool(folder) and time.time() < folder.get("warmed", 0) + self.WARMED_TIME
+
+    def get_link(self, path):
+
+        with self._data_lock:
+            return self.get()["links"].get(path)
+
+    def set_link(self, path, link, expires):
+
+        with self._data_lock:
+            self.get()["links"][path] = {"link": link, "expires": expires}
+            self._mark_dirty("links", path)
+
+    def _mark_dirty(self, section, key):
+        self._dirty[section].add(key)
+
+        # Don't restart a pending timer, otherwise a steady stream of changes
+        # would postpone the flush forever
+        if not self._flush_timer:
+            self._flush_timer = threading.Timer(self.FLUSH_DELAY, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def _cancel_flush(self):
+
+        if self._flush_timer:
+            self._flush_timer.cancel()
+            self._flush_timer = None
+
+    def flush(self):
+        """
+        Writes the dirty entries to the StorageServer.
+        The stored data is read back first, so entries which were changed by
+        another process (e.g. the service) in the meantime are not lost.
+        """
+
+        with self._data_lock:
+            self._cancel_flush()
+
+            if not self._dirty["links"] and not self._dirty["metadata"]:
+                return
+
+            dirty = self._dirty
+            self._dirty = {"links": set(), "metadata": set()}
+            locked = super().lock(self._cache_name)
+
+            try:
+                stored_data = self._load()
+
+                for section, keys in dirty.items():
+
+                    for key in keys:
+
+                        if key in self._data[section]:
+                            stored_data[section][key] = self._data[section][key]
+                        else:
+                            stored_data[section].pop(key, None)
+
+                super().set(self._cache_name, repr(stored_data))
+            finally:
+
+                if locked:
+                    super().unlock(self._cache_name)
 
     def sort_metadata(self, entries, cached_metadata=None):
+        """
+        Returns the listing of the entries, applied to a copy of the cached
+        listing when given. The cached listing itself isn't changed, the flush
+        may be serializing it meanwhile; set_folder swaps in the new one.
+        """
 
         if not cached_metadata:
             data = {
@@ -78,9 +317,15 @@ class DropboxCache(StorageServer.StorageServer):
                     "folders": {},
                     "files": {},
                 },
+                "media": {}, # path: compact media info
             }
         else:
-            data = cached_metadata
+            data = {
+                "folders": dict(cached_metadata["folders"]),
+                "files": {file_type: dict(files) for file_type, files in cached_metadata["files"].items()},
+                "deleted": {deletion_type: dict(deleted) for deletion_type, deleted in cached_metadata["deleted"].items()},
+                "media": dict(cached_metadata.get("media", {})),
+            }
 
         for metadata in entries:
             path = metadata.path_lower
@@ -94,6 +339,14 @@ class DropboxCache(StorageServer.StorageServer):
             elif isinstance(metadata, FileMetadata):
                 file_type = identify_file_type(metadata.name)
                 data["files"][file_type][path] = metadata
+                media_info = get_media_info(metadata)
+
+                if media_info:
+                    data["media"][path] = media_info
+                    # Only the compact form is cached
+                    metadata.media_info = None
+                else:
+                    data["media"].pop(path, None)
 
                 if path in data["deleted"]["files"]:
                     del data["deleted"]["files"][path]
@@ -109,43 +362,80 @@ class DropboxCache(StorageServer.StorageServer):
 
                         if path in metadata_:
                             data["deleted"]["files"][path] = metadata
+                            data["media"].pop(path, None)
                             del metadata_[path]
                             break
 
         return data
 
     def process_deletions(self, path):
+        path = path.lower()
 
-        if not self._data:
-            return
+        with self._data_lock:
+
+            if not self._data or path not in self._data["metadata"]:
+                return
+
+            deleted_metadata = self._data["metadata"][path]["entries"]["deleted"]
+            deletions = [(deletion_type, list(deleted_metadata[deletion_type])) for deletion_type in ("files", "folders")]
+
+        done = {"files": set(), "folders": set()}
+
+        try:
+
+            for deletion_type, paths in deletions:
 
-        deleted_metadata = self._data["metadata"][path]["entries"]["deleted"]
+                for deleted_path in paths:
 
-        if not deleted_metadata:
+                    if self.stopped():
+                        return
+
+                    # Removing the files is done outside the lock, it can take a while
+                    self.delete_cached_path(deleted_path, file=deletion_type == "files")
+                    done[deletion_type].add(deleted_path)
+
+        finally:
+            self._remove_deletions(path, done)
+
+    def _remove_deletions(self, path, done):
+        """
+        Removes the handled deletions from the cached folder. Like in
+        apply_changes the folder is replaced, not changed, so a flush never
+        serializes a listing which changes meanwhile.
+        """
+
+        if not done["files"] and not done["folders"]:
             return
 
-        for deletion_type in ("files", "folders"):
+        with self._data_lock:
 
-            for path in list(deleted_metadata[deletion_type]):
+            if not self._data or path not in self._data["metadata"]:
+                return
 
-                if self.stopped():
-                    return
+            folder = self._data["metadata"][path]
+            deleted = {
+                deletion_type: {key: value for key, value in deleted.items() if key not in done[deletion_type]}
+                for deletion_type, deleted in folder["entries"]["deleted"].items()
+            }
+            self._data["metadata"][path] = dict(folder, entries=dict(folder["entries"], deleted=deleted))
+            self._mark_dirty("metadata", path)
 
-                self.delete_cached_path(path, file=deletion_type == "files")
-                del deleted_metadata[deletion_type][path]
-                self.save()
+            for folder_path in done["folders"]:
+                self._delete_folders(folder_path)
 
     def delete_cached_path(self, path, file=True):
         thumb_path = os.path.normpath(self._thumb_path + path)
         shadow_path = os.path.normpath(self._shadow_path + path)
+        preview_path = os.path.normpath(self._preview_path + path)
 
         if file:
             thumb_path = replace_file_extension(thumb_path, "jpg")
+            previews = get_previews(os.path.dirname(preview_path))
+            paths = [shadow_path, thumb_path] + previews.get(os.path.basename(preview_path), [])
         else:
-            thumb_path += os.sep
-            shadow_path += os.sep
+            paths = [shadow_path + os.sep, thumb_path + os.sep, preview_path + os.sep]
 
-        for path in (shadow_path, thumb_path):
+        for path in paths:
 
             if xbmcvfs.exists(path):
 
@@ -166,10 +456,14 @@ class FileLoader(threading.Thread):
         cache_path = get_cache_path(account_name)
         self._shadow_path = f"{cache_path}/shadow/"
         self._thumb_path = f"{cache_path}/thumb/"
+        self._preview_path = f"{cache_path}/preview/"
         self._thumb_list = queue.Queue() # Thread safe
+        self._preview_list = queue.Queue() # Thread safe
+        self._previews = {} # Preview folder: previews by image name
         self._file_list = queue.Queue() # Thread safe
         self._stop_event = threading.Event()
         self._thumb_batch_total = 25
+        self._preview_batch_total = 5 # Previews are much larger than thumbnails
         self._file_batch_total = ADDON_SETTINGS.getInt("files_per_batch")
 
     def stop(self):
@@ -181,7 +475,10 @@ class FileLoader(threading.Thread):
     def run(self):
         log_debug(f"FileLoader started for: {self._module}")
         tasks = []
-        t = threading.Thread(target=self._thumb_batch_download)
+        t = threading.Thread(target=self._thumb_batch_download, args=(self._thumb_list, self._thumb_batch_total, THUMBNAIL_SIZE))
+        t.start()
+        tasks.append(t)
+        t = threading.Thread(target=self._thumb_batch_download, args=(self._preview_list, self._preview_batch_total, PREVIEW_SIZE))
         t.start()
         tasks.append(t)
         t = threading.Thread(target=self._file_batch_download)
@@ -204,11 +501,11 @@ class FileLoader(threading.Thread):
             for _ in range(self._file_batch_total):
 
                 try:
-                    path = self._file_list.get(timeout=0.1)
+                    path, size = self._file_list.get(timeout=0.1)
                     location = self._get_shadow_location(path)
 
                     if not xbmcvfs.exists(location):
-                        t = threading.Thread(target=self._client.save_file, args=(path, location))
+                        t = threading.Thread(target=self._client.save_file, args=(path, location, size))
                         t.start()
                         tasks.append(t)
 
@@ -220,20 +517,19 @@ class FileLoader(threading.Thread):
 
             xbmc.sleep(100)
 
-    def _thumb_batch_download(self):
+    def _thumb_batch_download(self, thumb_list, batch_total, size):
 
         while not self.stopped():
             batch = []
             locations = {}
 
-            for _ in range(self._thumb_batch_total):
+            for _ in range(batch_total):
 
                 try:
-                    path = self._thumb_list.get(timeout=0.1)
-                    location = self._get_thumb_Location(path)
+                    path, location = thumb_list.get(timeout=0.1)
 
                     if not xbmcvfs.exists(location):
-                        batch.append(self._client.create_thumbnail_obj(path))
+                        batch.append(self._client.create_thumbnail_obj(path, size))
                         locations[path] = location
 
                 except queue.Empty:
@@ -245,16 +541,51 @@ class FileLoader(threading.Thread):
             xbmc.sleep(100)
 
     def _get_thumb_Location(self, path):
-        location = replace_file_extension(path, "jpg")
-        return os.path.normpath(self._thumb_path + location)
+        return get_thumbnail_location(self._thumb_path, path)
 
     def _get_shadow_location(self, path):
         return os.path.normpath(self._shadow_path + path)
 
+    def _get_preview_location(self, path, rev):
+        # The revision is part of the name, a changed image gets a new preview.
+        # The extension of the image stays, photo.jpg and photo.png get their own previews.
+        return os.path.normpath(f"{self._preview_path}{path}.{rev}.jpg")
+
     def get_thumbnail(self, path):
-        self._thumb_list.put(path)
-        return self._get_thumb_Location(path)
+        location = self._get_thumb_Location(path)
+        self._thumb_list.put((path, location))
+        return location
+
+    def get_preview(self, path, rev):
+        """
+        Returns the location of a screen sized rendition of the image
+        """
+
+        location = self._get_preview_location(path, rev)
+        dir_name = os.path.dirname(location)
+
+        # The preview folder is listed once for all the images of a folder
+        if dir_name not in self._previews:
+            self._previews[dir_name] = get_previews(dir_name)
+
+        name = os.path.basename(path)
+        old_locations = self._previews[dir_name].get(name, [])
+
+        if location not in old_locations:
+
+            # Remove the previews of older revisions
+            for old_location in old_locations:
+
+                try:
+                    os.remove(old_location)
+                except OSError as e:
+                    log_debug(f"FileLoader failed to remove {old_location}: {e!r}")
+
+            self._previews[dir_name][name] = [location]
+            self._preview_list.put((path, location))
+
+        return location
 
-    def get_file(self, path):
-        self._file_list.put(path)
+    def get_file(self, path, size=0):
+        self._file_list.put((path, size))
         return self._get_shadow_location(path)
@@ -21,6 +21,7 @@
 
 import os
 import re
+import time
 import queue
 import base64
 import shutil
@@ -37,23 +38,47 @@ import dropbox.dropbox
 import dropbox.exceptions
 
 from .utils import *
-from .dropbox_cache import DropboxCache
+from .dropbox_cache import DropboxCache, get_deleted_metadata
+from .search_index import SearchIndex
+from .network import NETWORK_ERRORS, is_offline, set_offline, set_online
+from .batch_job import call_with_retries, wait_for_job
+from .segmented_download import SegmentedDownloader
+from .zip_stream import ZipStreamExtractor, use_zip_download
+from .dropbox_uploader import Uploader, UploadSessions, FolderUploader, is_same_content
 
 
-def command(silent=False, max_retries=3):
+def command(silent=False, max_retries=3, offline=None):
     """
-    A decorator for handling authentication and exceptions
+    A decorator for handling authentication and exceptions.
+    Without network the command fails at once, or is served by the method
+    named offline (e.g. from the cache).
     """
 
     def decorate(f):
 
+        def serve_offline(self, *args, **keywords):
+
+            if offline:
+                return getattr(self, offline)(*args, **keywords)
+
+            if not silent:
+                xbmcgui.Dialog().notification(ADDON_NAME, LANGUAGE_STRING(30070), xbmcgui.NOTIFICATION_WARNING)
+
         def wrapper(self, *args, **keywords):
+
+            if is_offline():
+                log_debug(f"{f.__name__}: offline")
+                return serve_offline(self, *args, **keywords)
+
             retries = max_retries
 
             while retries > 0:
 
                 try:
-                    return f(self, *args, **keywords)
+                    result = f(self, *args, **keywords)
+                    # The call reached Dropbox, a failure of the network is over
+                    set_online()
+                    return result
                 except dropbox.exceptions.RateLimitError as e:
 
                     if e.backoff:
@@ -61,6 +86,10 @@ def command(silent=False, max_retries=3):
                     else:
                         xbmc.sleep(1000)
 
+                except NETWORK_ERRORS as e:
+                    log_error(f"{f.__name__} failed, no connection: {e!r}")
+                    set_offline()
+                    return serve_offline(self, *args, **keywords)
                 except Exception as e:
                     error = traceback.format_exc()
                     log_error(f"{f.__name__} failed: {error}")
@@ -92,6 +121,7 @@ class KodiDropboxClient:
         self._app_key = app_key
         self._app_secret = app_secret
         self._account_name = account_name
+        self._cache = None
 
         if cache:
             self._cache = cache
@@ -128,8 +158,33 @@ class KodiDropboxClient:
     def disconnect(self):
         self.dropbox_api = None
 
-    @command()
+    def flush_cache(self):
+        """
+        Writes the pending cache changes, call this before the plugin exits
+        """
+
+        if self._cache:
+            self._cache.flush()
+
+    @command(offline="get_offline_metadata")
     def get_metadata(self, path, directory=False):
+        return self._get_metadata(path, directory)
+
+    @command(silent=True)
+    def update_metadata(self, path):
+        """
+        Brings the cached listing of the directory up to date without
+        showing failures, for the background warm-up of the cache
+        """
+
+        metadata = self._get_metadata(path, directory=True, warm_up=True)
+
+        if metadata:
+            self._cache.mark_warmed(path.lower())
+
+        return metadata
+
+    def _get_metadata(self, path, directory=False, warm_up=False):
         """
         The metadata of the directory is cached.
         The metadata of a file is retrieved from the directory metadata.
@@ -143,62 +198,106 @@ class KodiDropboxClient:
         if not directory:
             dir_name = os.path.dirname(path)
 
-        cached_data = self._cache.get()
-        cached_metadata = cached_data["metadata"].get(path, {})
+        # Only one thread at a time may update the listing of a folder
+        with self._cache.folder_lock(dir_name):
+            cached_metadata = self._cache.get_folder(dir_name)
 
-        if cached_metadata:
-            cursor = cached_metadata["cursor"]
-        else:
-            cursor = None
+            if cached_metadata:
+                cursor = cached_metadata["cursor"]
+            else:
+                cursor = None
 
-        if directory or not cached_metadata:
-            has_more = True
-            entries = []
+            if directory and self._cache.is_changed_locally(cached_metadata):
+                # The result of the action is already applied to the listing
+                return cached_metadata["entries"]
 
-            while has_more:
+            if directory and not warm_up and self._cache.is_warmed(cached_metadata):
+                # Listed by the warm-up of the cache a moment ago
+                return cached_metadata["entries"]
 
-                if cursor:
+            if directory or not cached_metadata:
+                has_more = True
+                entries = []
 
-                    try:
-                        result = self.dropbox_api.files_list_folder_continue(cursor)
-                    except dropbox.exceptions.ApiError as e:
-                        # Cursor has expired
-                        result = self.dropbox_api.files_list_folder("" if dir_name == "/" else dir_name)
+                while has_more:
+
+                    if cursor:
+
+                        try:
+                            result = self.dropbox_api.files_list_folder_continue(cursor)
+                        except dropbox.exceptions.ApiError as e:
+                            # Cursor has expired
+                            result = self.dropbox_api.files_list_folder("" if dir_name == "/" else dir_name, include_media_info=True)
+
+                        else:
+
+                            if not result.entries and cached_metadata:
+                                return cached_metadata["entries"]
 
                     else:
+                        # Dropbox expects root path to be an empty string otherwise it will fail
+                        result = self.dropbox_api.files_list_folder("" if dir_name == "/" else dir_name, include_media_info=True)
 
-                        if not result.entries and cached_metadata:
-                            return cached_metadata["entries"]
+                    cursor = result.cursor
+                    has_more = result.has_more
+                    entries += result.entries
 
-                else:
-                    # Dropbox expects root path to be an empty string otherwise it will fail
-                    result = self.dropbox_api.files_list_folder("" if dir_name == "/" else dir_name)
+                metadata = self._cache.sort_metadata(entries, cached_metadata.get("entries"))
+                self._cache.set_folder(dir_name, cursor, metadata)
 
-                cursor = result.cursor
-                has_more = result.has_more
-                entries += result.entries
+            else:
+                metadata = cached_metadata["entries"]
 
-            metadata = self._cache.sort_metadata(entries, cached_metadata.get("entries"))
-            cached_data["metadata"][dir_name] = {
-                "cursor": cursor,
-                "entries": metadata,
-            }
-            self._cache.save(cached_data)
+            if not directory:
+                return self._find_file(metadata, path)
 
-        else:
-            metadata = cached_metadata
+            return metadata
 
-        if not directory:
+    def get_offline_metadata(self, path, directory=False):
+        """
+        Returns the metadata like get_metadata without contacting Dropbox, from
+        the cache or the search index of the synchronization
+        """
 
-            for file_type, entries in metadata["files"].items():
+        path = path.lower()
+        dir_name = path if directory else os.path.dirname(path)
+        metadata = self.get_cached_metadata(dir_name)
+
+        if not metadata:
+            entries = SearchIndex(self._account_name).get_children(dir_name)
 
-                if path in entries:
-                    return entries[path]
+            if entries is None:
+                log_debug(f"No offline metadata of: {dir_name}")
+                return None
+
+            metadata = self._cache.sort_metadata(entries)
+
+        if not directory:
+            return self._find_file(metadata, path)
 
         return metadata
 
+    @staticmethod
+    def _find_file(metadata, path):
+
+        for file_type, entries in metadata["files"].items():
+
+            if path in entries:
+                return entries[path]
+
     @command()
     def get_media_url(self, path):
+        return self._get_media_url(path)
+
+    @command(silent=True)
+    def prefetch_media_url(self, path):
+        """
+        Resolves the media URL ahead of playback, failures are only logged
+        """
+
+        return self._get_media_url(path)
+
+    def _get_media_url(self, path):
         """
         Cache this URL because it takes a lot of time requesting it
         If the media URL is still valid, within the margin, then don't
@@ -207,9 +306,7 @@ class KodiDropboxClient:
 
         link = None
         margin = 13800 # Seconds - link valid for 4 hours
-        cached_data = self._cache.get()
-        cached_links = cached_data["links"]
-        cached_link = cached_links.get(path)
+        cached_link = self._cache.get_link(path)
 
         if cached_link:
 
@@ -223,47 +320,199 @@ class KodiDropboxClient:
             result = self.dropbox_api.files_get_temporary_link(path)
             link = result.link
             expiry = datetime.datetime.now() + datetime.timedelta(seconds=margin)
-            cached_links[path] = {"link": link, "expires": expiry}
+            self._cache.set_link(path, link, expiry)
             log_debug("Media URL storing URL.")
-            self._cache.save(cached_data)
 
         return link
 
+    def get_cached_metadata(self, path):
+        """
+        Returns the cached metadata of the directory without contacting Dropbox,
+        None when the directory isn't cached
+        """
+
+        return self._cache.get_folder(path.lower()).get("entries")
+
     @command()
-    def search(self, query, path):
-        options = dropbox.files.SearchOptions(path=path)
-        has_more = True
-        cursor = False
-        entries = []
+    def search(self, query, path, content_type=None):
+        entries = [entry for page in self.search_pages(query, path, content_type) for entry in page]
+        return self._cache.sort_metadata(entries)
 
-        while has_more:
+    def search_pages(self, query, path, content_type=None, max_results=SEARCH_MAX_RESULTS, silent=False):
+        """
+        Yields the results page by page, at most max_results in total.
+        The server only returns results of the content type when the files
+        are filtered.
+        When silent, failures are raised to the caller instead of shown,
+        e.g. for a search in a background thread.
+        """
 
-            if cursor:
-                result = files_search_continue_v2(cursor)
-            else:
-                result = self.dropbox_api.files_search_v2(query, options=options)
+        if is_offline():
 
-            cursor = result.cursor
-            has_more = result.has_more
-            entries += [m.metadata.get_metadata() for m in result.matches if m.metadata.is_metadata()]
+            if silent:
+                raise ConnectionError("Dropbox can't be reached")
 
-        return self._cache.sort_metadata(entries)
+            xbmcgui.Dialog().notification(ADDON_NAME, LANGUAGE_STRING(30070), xbmcgui.NOTIFICATION_WARNING)
+            return
+
+        options = self.create_search_options(path, content_type)
+        cursor = None
+        results_total = 0
+
+        try:
+
+            while results_total < max_results:
+
+                if cursor:
+                    result = self.dropbox_api.files_search_continue_v2(cursor)
+                else:
+                    result = self.dropbox_api.files_search_v2(query, options=options)
+
+                set_online()
+                entries = [m.metadata.get_metadata() for m in result.matches if m.metadata.is_metadata()]
+                entries = entries[:max_results - results_total]
+                results_total += len(entries)
+                yield entries
+
+                if not result.has_more:
+                    break
+
+                cursor = result.cursor
+
+        except NETWORK_ERRORS as e:
+            log_error(f"search_pages failed, no connection: {e!r}")
+            set_offline()
+
+            if silent:
+                raise
+
+            xbmcgui.Dialog().notification(ADDON_NAME, LANGUAGE_STRING(30070), xbmcgui.NOTIFICATION_WARNING)
+        except Exception as e:
+            # A generator can't use the command decorator
+            log_error(f"search_pages failed: {traceback.format_exc()}")
+
+            if silent:
+                raise
+
+            xbmcgui.Dialog().ok(ADDON_NAME, f"{LANGUAGE_STRING(30206)} {e!r}")
+
+    @staticmethod
+    def create_search_options(path, content_type=None):
+        options = dropbox.files.SearchOptions(path=path, max_results=SEARCH_PAGE_SIZE)
+        categories = SEARCH_CATEGORIES.get(content_type)
+
+        # Older versions of the SDK don't know the file categories
+        if categories and ADDON_SETTINGS.getBool("file_filter") and hasattr(options, "file_categories"):
+            options.file_categories = [getattr(dropbox.files.FileCategory, category) for category in categories]
+
+        return options
+
+    def _apply_changes(self, entries):
+
+        if self._cache:
+            self._cache.apply_changes(entries)
+            # The refresh after the action runs in an other process
+            self._cache.flush()
 
     @command()
     def delete(self, path):
-        return self.dropbox_api.files_delete_v2(path)
+        result = self.dropbox_api.files_delete_v2(path)
+        self._apply_changes([get_deleted_metadata(result.metadata)])
+        return result
 
     @command()
     def copy(self, from_path, to_path):
-        return self.dropbox_api.files_copy_v2(from_path, to_path)
+        result = self.dropbox_api.files_copy_v2(from_path, to_path)
+        self._apply_changes([result.metadata])
+        return result
 
     @command()
     def move(self, from_path, to_path, autorename=False):
-        return self.dropbox_api.files_move_v2(from_path, to_path, autorename=autorename)
+        result = self.dropbox_api.files_move_v2(from_path, to_path, autorename=autorename)
+        self._apply_changes([self._get_moved_metadata(from_path), result.metadata])
+        return result
+
+    @staticmethod
+    def _get_moved_metadata(from_path):
+        # The old location of a moved item is gone
+        return dropbox.files.DeletedMetadata(name=os.path.basename(from_path), path_lower=from_path.lower(), path_display=from_path)
 
     @command()
     def create_folder(self, path):
-        return self.dropbox_api.files_create_folder_v2(path)
+        result = self.dropbox_api.files_create_folder_v2(path)
+        self._apply_changes([result.metadata])
+        return result
+
+    # The batch commands are never run again as a whole, the jobs which already
+    # ran would be launched again. Each call of a job is retried on its own and
+    # the results of every job are applied to the cache right away.
+    @command(max_retries=1)
+    def delete_batch(self, paths):
+        """
+        Deletes the paths in batch jobs, returns the metadata of each deleted
+        path (None when it failed)
+        """
+
+        results = []
+
+        for i in range(0, len(paths), BATCH_SIZE):
+            entries = [dropbox.files.DeleteArg(path) for path in paths[i:i + BATCH_SIZE]]
+            launch = call_with_retries(self.dropbox_api.files_delete_batch, entries)
+            result = wait_for_job(launch, self.dropbox_api.files_delete_batch_check)
+            deleted = [entry.get_success().metadata if entry.is_success() else None for entry in result.entries]
+            self._apply_changes([get_deleted_metadata(metadata) for metadata in deleted if metadata])
+            results += deleted
+
+        return results
+
+    @command(max_retries=1)
+    def copy_batch(self, relocations):
+        """
+        Copies the (from_path, to_path) relocations in batch jobs, returns
+        the metadata of each copy (None when it failed)
+        """
+
+        results = []
+
+        for chunk, copied in self._relocate_batch(relocations, self.dropbox_api.files_copy_batch_v2, self.dropbox_api.files_copy_batch_check_v2):
+            self._apply_changes([metadata for metadata in copied if metadata])
+            results += copied
+
+        return results
+
+    @command(max_retries=1)
+    def move_batch(self, relocations):
+        """
+        Moves the (from_path, to_path) relocations in batch jobs, returns the
+        metadata of each moved item (None when it failed)
+        """
+
+        results = []
+
+        for chunk, moved in self._relocate_batch(relocations, self.dropbox_api.files_move_batch_v2, self.dropbox_api.files_move_batch_check_v2):
+            changes = []
+
+            for (from_path, to_path), metadata in zip(chunk, moved):
+
+                if metadata:
+                    changes.append(self._get_moved_metadata(from_path))
+                    changes.append(metadata)
+
+            self._apply_changes(changes)
+            results += moved
+
+        return results
+
+    def _relocate_batch(self, relocations, launch_job, check):
+        """
+        Yields the relocations of each batch job with their results
+        """
+
+        for i in range(0, len(relocations), BATCH_SIZE):
+            chunk = relocations[i:i + BATCH_SIZE]
+            entries = [dropbox.files.RelocationPath(from_path, to_path) for from_path, to_path in chunk]
+            result = wait_for_job(call_with_retries(launch_job, entries), check)
+            yield chunk, [entry.get_success() if entry.is_success() else None for entry in result.entries]
 
     @command()
     def upload(self, filename, path, dialog=False):
@@ -273,40 +522,144 @@ class KodiDropboxClient:
             log_error("File size of upload file <= 0")
             return
 
-        file = open(filename, "rb")
-        uploader = Uploader(self.dropbox_api, file, size)
+        path = re.sub(r"/+", "/", path + DROPBOX_SEP + os.path.basename(filename))
+
+        if path == "/":
+            path = ""
+        else:
+            path = "/" + path.strip("/")
+
+        remote_metadata = self.get_remote_file(path)
+
+        if remote_metadata:
+
+            if is_same_content(filename, remote_metadata):
+                log(f"Upload skipped, the same file is already present: {path}")
+                return remote_metadata
+
+            log_error(f"Upload conflict, a different file is already present: {path}")
+
+            if dialog:
+                xbmcgui.Dialog().ok(ADDON_NAME, f"{LANGUAGE_STRING(30210)} {path}")
+
+            return
+
+        sessions = UploadSessions(self._account_name) if self._account_name else None
+        uploader = Uploader(self.dropbox_api, filename, path, ADDON_SETTINGS.getInt("upload_connections", 1), sessions)
         uploader.start()
-        dialog = xbmcgui.DialogProgress()
-        dialog.create(LANGUAGE_STRING(30033), filename)
-        dialog.update(int((uploader.cursor.offset * 100) / uploader.target_length))
 
-        while uploader.cursor.offset < uploader.target_length:
+        if dialog:
+            progress = xbmcgui.DialogProgress()
+            progress.create(LANGUAGE_STRING(30033), filename)
 
-            if dialog.iscanceled():
-                log("User canceled the upload")
-                break
+        # The progress is polled, the upload itself runs in the Uploader threads
+        while uploader.is_alive():
+
+            if dialog:
 
-            uploader.upload_next()
-            dialog.update(int((uploader.cursor.offset * 100) / uploader.target_length))
+                if progress.iscanceled():
+                    log("User canceled the upload")
+                    uploader.stop()
 
-        dialog.close()
+                progress.update(
+                    int((uploader.bytes_uploaded * 100) / uploader.target_length),
+                    f"{filename}\n{get_transfer_text(uploader.bytes_uploaded, uploader.target_length, uploader.throughput)}",
+                )
 
-        if uploader.cursor.offset == uploader.target_length:
-            path = re.sub(r"/+", "/", path + DROPBOX_SEP + os.path.basename(filename))
+            xbmc.sleep(200)
 
-            if path == "/":
-                path = ""
-            else:
-                path = "/" + path.strip("/")
+        uploader.join()
+
+        if dialog:
+            progress.close()
+
+        if uploader.error:
+            raise uploader.error
+
+        if uploader.completed:
+            metadata = uploader.finish()
+            self._apply_changes([metadata])
+            return metadata
+
+    def get_remote_file(self, path):
+        """
+        Returns the metadata of the path from the cache or else from Dropbox,
+        None when the path doesn't exist.
+        """
+
+        dir_name = os.path.dirname(path.lower())
+        cached_metadata = self._cache.get_folder(dir_name) if self._cache else None
+
+        if cached_metadata:
+            entries = cached_metadata["entries"]
+
+            if path.lower() in entries["folders"]:
+                return entries["folders"][path.lower()]
+
+            for file_type, files in entries["files"].items():
+
+                if path.lower() in files:
+                    return files[path.lower()]
+
+        try:
+            return self.dropbox_api.files_get_metadata(path)
+        except dropbox.exceptions.ApiError as e:
+
+            if e.error.is_path() and e.error.get_path().is_not_found():
+                return None
+
+            raise
+
+    @command()
+    def upload_folder(self, local_path, path, dialog=False):
+        local_path = os.path.normpath(local_path)
+        path = re.sub(r"/+", "/", path + DROPBOX_SEP + os.path.basename(local_path))
+        path = "/" + path.strip("/")
+        sessions = UploadSessions(self._account_name) if self._account_name else None
+        uploader = FolderUploader(self.dropbox_api, local_path, path, ADDON_SETTINGS.getInt("upload_connections", 1), sessions)
+        uploader.start()
+
+        if dialog:
+            progress = xbmcgui.DialogProgress()
+            progress.create(LANGUAGE_STRING(30049), local_path)
+
+        while uploader.is_alive():
+
+            if dialog:
+
+                if progress.iscanceled():
+                    log("User canceled the upload")
+                    uploader.stop()
+
+                bytes_uploaded = uploader.bytes_uploaded
+                percent = int((bytes_uploaded * 100) / uploader.bytes_total) if uploader.bytes_total else 0
+                progress.update(
+                    percent,
+                    "{} {}/{}\n{}".format(
+                        LANGUAGE_STRING(30050),
+                        uploader.files_uploaded + len(uploader.skipped),
+                        uploader.files_total,
+                        get_transfer_text(bytes_uploaded, uploader.bytes_total, uploader.throughput),
+                    )
+                )
+
+            xbmc.sleep(200)
 
-            uploaded = uploader.finish(path)
-            file.close()
-            return uploaded
+        uploader.join()
+
+        if dialog:
+            progress.close()
+
+        if uploader.error:
+            raise uploader.error
+
+        if not uploader.stopped():
+            return uploader
 
     @staticmethod
-    def create_thumbnail_obj(path):
+    def create_thumbnail_obj(path, size=THUMBNAIL_SIZE):
         format = dropbox.files.ThumbnailFormat("jpeg", None)
-        size = dropbox.files.ThumbnailSize("w640h480", None)
+        size = dropbox.files.ThumbnailSize(size, None)
         return dropbox.files.ThumbnailArg(path, format, size)
 
     @command(silent=True)
@@ -331,12 +684,30 @@ class KodiDropboxClient:
                 log_debug(f"Downloaded file to: {location}")
 
     @command(silent=True)
-    def save_file(self, path, location):
+    def save_file(self, path, location, size=0):
+        """
+        Large files (size above the threshold) are downloaded in segments
+        over several connections, other files over one connection.
+        """
+
         dir_name = os.path.dirname(location) + os.sep # Add os seperator because it is a dir
 
         if not xbmcvfs.exists(dir_name):
             xbmcvfs.mkdirs(dir_name)
 
+        segments = ADDON_SETTINGS.getInt("download_segments", 1)
+        threshold = ADDON_SETTINGS.getInt("segmented_download_threshold", 64) * 1024 * 1024
+
+        if segments > 1 and size >= threshold:
+            result = self.dropbox_api.files_get_temporary_link(path)
+            downloader = SegmentedDownloader(result.link, location, result.metadata.size, segments, result.metadata.content_hash)
+
+            if downloader.download():
+                log_debug(f"Downloaded file to: {location}")
+                return True
+
+            log_error(f"Segmented download failed, downloading over one connection: {path}")
+
         metadata, resp = self.dropbox_api.files_download(path)
 
         with open(location, "wb") as cache_file: # 'b' option required for windows
@@ -345,6 +716,35 @@ class KodiDropboxClient:
         log_debug(f"Downloaded file to: {location}")
         return True
 
+    @command(silent=True)
+    def save_folder_zip(self, path, location, on_file=None):
+        """
+        Downloads a folder as one zip archive and extracts it into location
+        while downloading, the archive itself is never stored.
+        """
+
+        metadata, resp = self.dropbox_api.files_download_zip(path)
+
+        try:
+            resp.raw.decode_content = True
+            ZipStreamExtractor(resp.raw, location, on_file).extract()
+        finally:
+            resp.close()
+
+        log_debug(f"Downloaded folder to: {location}")
+        return True
+
+    @command(silent=True)
+    def list_folder(self, path, recursive=False, cursor=None):
+
+        if cursor:
+            result = self.dropbox_api.files_list_folder_continue(cursor)
+        else:
+            # Dropbox expects root path to be an empty string otherwise it will fail
+            result = self.dropbox_api.files_list_folder("" if path == "/" else path, recursive=recursive)
+
+        return result.entries, result.cursor, result.has_more
+
     @command(silent=True)
     def get_remote_changes(self, cursor=None):
 
@@ -366,48 +766,13 @@ class KodiDropboxClient:
         return self.dropbox_api.users_get_current_account()
 
 
-class ChunkedUploader:
-    """
-    Contains the logic around a chunked upload, which uploads a
-    large file to Dropbox via the /chunked_upload endpoint.
-    """
-
-    def __init__(self, client, file_obj, length):
-        self.client = client
-        self.file_obj = file_obj
-        self.target_length = length
-        self.cursor = None
-
-    def start(self):
-        result = self.client.files_upload_session_start(self.file_obj.read(self.chunk_size))
-        self.cursor = dropbox.files.UploadSessionCursor(result.session_id, self.file_obj.tell())
-
-    def finish(self, path):
-        commit = dropbox.files.CommitInfo(path=path)
-        next_chunk_size = min(self.chunk_size, self.target_length - self.cursor.offset)
-        return self.client.files_upload_session_finish(self.file_obj.read(next_chunk_size), self.cursor, commit)
-
-
-class Uploader(ChunkedUploader):
+class Downloader(threading.Thread):
     """
-    Use the ChunkedUploader, but create a
-    step() function to
+    Downloads a file or a complete folder.
+    The folder tree is enumerated with one recursive listing, the files are
+    downloaded by a pool of workers while the enumeration is still running.
     """
 
-    def __init__(self, client, file_obj, length):
-        super().__init__(client, file_obj, length)
-        self.chunk_size = 1 * 1024 * 1024 # 1 MB sizes
-
-    def upload_next(self):
-        next_chunk_size = min(self.chunk_size, self.target_length - self.cursor.offset)
-        self.client.files_upload_session_append_v2(self.file_obj.read(next_chunk_size), self.cursor)
-        self.cursor.offset = self.file_obj.tell()
-
-
-class Downloader(threading.Thread):
-    _items_handled = 0
-    _items_total = 0
-
     def __init__(self, client, path, location, is_dir):
         super().__init__()
         self._client = client
@@ -416,87 +781,203 @@ class Downloader(threading.Thread):
         self.is_dir = is_dir
         self.remote_base_path = os.path.dirname(path)
         self._file_list = queue.Queue() # Thread safe
+        self._workers_total = ADDON_SETTINGS.getInt("files_per_batch", 5)
+        self._enumerated = threading.Event()
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
         self.monitor = xbmc.Monitor()
         self._progress = xbmcgui.DialogProgress()
         self._progress.create(LANGUAGE_STRING(30039))
         self._progress.update(0)
+        self._current_item = ""
+        self.files_total = 0
+        self.files_handled = 0
+        self.bytes_total = 0
+        self.bytes_handled = 0
+        self.start_time = 0
         self.canceled = False
         self.error = False
 
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
     def run(self):
         log_debug(f"Downloader started for: {self.path}")
+        self.start_time = time.time()
+        tasks = []
 
-        # First get all the file-items in the path
         if not self.is_dir:
             # Download a single file
-            entries = self._client.get_metadata(self.path)
+            metadata = self._client.get_metadata(self.path)
 
-            if not entries:
-                raise Exception(f"{ADDON_ID} No metadata retrieved")
+            if metadata:
+                self._add_item(metadata)
+            else:
+                log_error(f"Downloader no metadata retrieved for: {self.path}")
+                self.error = True
 
-            self._file_list.put(entries)
+            self._enumerated.set()
         else:
-            # Download a directory
-            self.get_file_items(self.path)
+            # Download a directory, start downloading while enumerating
+            t = threading.Thread(target=self._enumerate)
+            t.start()
+            tasks.append(t)
 
-        self._items_total = self._file_list.qsize()
+        for _ in range(self._workers_total):
+            t = threading.Thread(target=self._download_worker)
+            t.start()
+            tasks.append(t)
 
-        # Check if need to quit
-        while not self._progress.iscanceled() and not self._file_list.empty() and not self.monitor.abortRequested():
-            # Download the list of files/dirs
-            item_to_retrieve = self._file_list.get()
+        while any(task.is_alive() for task in tasks):
 
-            if item_to_retrieve:
-                self._progress.update(int((self._items_handled * 100) / self._items_total), f"{LANGUAGE_STRING(30041)} {item_to_retrieve.path_display}")
-                base_path = item_to_retrieve.path_display
-                base_path = re.sub(self.remote_base_path, "", base_path, count=1, flags=re.IGNORECASE) # Remove the remote base path
-                location = os.path.normpath(self.location + base_path)
+            if self._progress.iscanceled() or self.monitor.abortRequested():
+                self.canceled = True
+                self.stop()
 
-                if isinstance(item_to_retrieve, dropbox.files.FolderMetadata):
-                    location += os.sep # Add os seperator because it is a dir
+            self._update_progress()
+            xbmc.sleep(200)
 
-                    if not xbmcvfs.exists(location):
-                        xbmcvfs.mkdirs(location)
+        for task in tasks:
+            task.join()
 
-                else:
+        if self.canceled:
+            log_debug(f"Downloader stopped (as requested) for: {self.path}")
+        elif not self.error:
+            self._progress.update(100)
+            log_debug(f"Downloader finished for: {self.path}")
 
-                    if not self._client.save_file(item_to_retrieve.path_display, location):
-                        log_error(f"Downloader failed for: {item_to_retrieve.path_display}")
-                        self._progress.close()
-                        self.error = True
+        self._progress.close()
+        del self._progress
 
-                        if xbmcvfs.exists(location):
-                            os.remove(location)
+    def _update_progress(self):
+
+        with self._lock:
+            percent = int((self.bytes_handled * 100) / self.bytes_total) if self.bytes_total else 0
+            elapsed = time.time() - self.start_time
+            speed = self.bytes_handled / elapsed if elapsed else 0
+            self._progress.update(
+                percent,
+                "{} {}\n{}/{}\n{}".format(
+                    LANGUAGE_STRING(30041),
+                    self._current_item,
+                    self.files_handled,
+                    self.files_total,
+                    get_transfer_text(self.bytes_handled, self.bytes_total, speed),
+                )
+            )
 
-                        return
+    def _enumerate(self):
+        cursor = None
+        has_more = True
 
-                self._items_handled += 1
+        while has_more and not self.stopped():
+            result = self._client.list_folder(self.path, recursive=True, cursor=cursor)
 
-            xbmc.sleep(100)
+            if not result:
+                log_error(f"Downloader failed to list: {self.path}")
+                self.error = True
+                self.stop()
+                break
 
-        if self._progress.iscanceled():
-            log_debug(f"Downloader stopped (as requested) for: {self.path}")
-            self.canceled = True
-        else:
-            self._progress.update(100)
-            log_debug(f"Downloader finished for: {self.path}")
+            first_page = cursor is None
+            entries, cursor, has_more = result
 
-        self._progress.close()
-        del self._progress
+            # Only a folder listed in one page is downloaded as one zip archive,
+            # a larger folder starts downloading without waiting for the listing
+            if first_page and not has_more and self._download_zip(entries):
+                break
 
-    def get_file_items(self, path):
-        entries = self._client.get_metadata(path, directory=True)
+            for metadata in entries:
+                self._add_item(metadata)
 
-        if not entries:
-            return
+        self._enumerated.set()
+
+    def _download_zip(self, entries):
+        files = [metadata for metadata in entries if isinstance(metadata, dropbox.files.FileMetadata)]
+        sizes = [metadata.size for metadata in files] or [0]
+
+        if not use_zip_download(len(entries), sum(sizes), max(sizes)):
+            return False
+
+        log_debug(f"Downloader using a zip archive for: {self.path}")
+
+        with self._lock:
+            self.files_total = len(files)
+            self.bytes_total = sum(sizes)
+
+        def on_file(location, size):
+
+            if self.stopped():
+                raise Exception("Zip download canceled")
+
+            self._current_item = location
+
+            with self._lock:
+                self.files_handled += 1
+                self.bytes_handled += size
+
+        if self._client.save_folder_zip(self.path, self.location, on_file) or self.stopped():
+            return True
+
+        # Fall back to downloading file by file
+        log_error(f"Downloader failed to download the zip archive for: {self.path}")
+
+        with self._lock:
+            self.files_total = self.files_handled = 0
+            self.bytes_total = self.bytes_handled = 0
+
+        return False
+
+    def _add_item(self, metadata):
+
+        if isinstance(metadata, dropbox.files.FolderMetadata):
+            location = self._get_location(metadata) + os.sep # Add os seperator because it is a dir
+
+            if not xbmcvfs.exists(location):
+                xbmcvfs.mkdirs(location)
+
+        elif isinstance(metadata, dropbox.files.FileMetadata):
+
+            with self._lock:
+                self.files_total += 1
+                self.bytes_total += metadata.size
+
+            self._file_list.put(metadata)
+
+    def _get_location(self, metadata):
+        base_path = metadata.path_display
+        base_path = re.sub(re.escape(self.remote_base_path), "", base_path, count=1, flags=re.IGNORECASE) # Remove the remote base path
+        return os.path.normpath(self.location + base_path)
+
+    def _download_worker(self):
+
+        while not self.stopped():
+
+            try:
+                metadata = self._file_list.get(timeout=0.1)
+            except queue.Empty:
+
+                if self._enumerated.is_set() and self._file_list.empty():
+                    return
+
+                continue
+
+            self._current_item = metadata.path_display
+            location = self._get_location(metadata)
 
-        files = entries["files"]
-        folders = entries["folders"]
+            if not self._client.save_file(metadata.path_display, location, metadata.size):
+                log_error(f"Downloader failed for: {metadata.path_display}")
+                self.error = True
+                self.stop()
 
-        for file_type, entries in files.items():
+                if xbmcvfs.exists(location):
+                    os.remove(location)
 
-            for path, metadata in entries.items():
-                self._file_list.put(metadata)
+                return
 
-        for path in folders:
-            self.get_file_items(path)
+            with self._lock:
+                self.files_handled += 1
+                self.bytes_handled += metadata.size
@@ -0,0 +1,734 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import time
+import pickle
+import threading
+
+import xbmc
+
+import dropbox.files
+import dropbox.exceptions
+
+from .utils import *
+from .batch_job import call_with_retries, wait_for_job
+
+
+def is_same_content(filename, metadata):
+    """
+    Checks if the remote file has the same content as the local file.
+    The content hash is only computed when the sizes are equal.
+    """
+
+    if not isinstance(metadata, dropbox.files.FileMetadata):
+        return False
+
+    if metadata.size != os.stat(filename).st_size:
+        return False
+
+    return get_content_hash(filename) == metadata.content_hash
+
+
+class UploadSessions:
+    """
+    Stores the state of the unfinished upload sessions of an account, so an
+    interrupted upload can be resumed from the last acknowledged offset.
+    """
+
+    SESSION_LIFETIME = 7 * 24 * 60 * 60 - 60 * 60 # Seconds, Dropbox keeps a session for 7 days
+
+    def __init__(self, account_name):
+        self._storage_file = os.path.normpath(f"{DATA_PATH}/accounts/{account_name}/upload_sessions.pik")
+        self._lock = threading.Lock()
+        self._sessions = {}
+        self._load()
+
+    def _load(self):
+
+        try:
+
+            with open(self._storage_file, "rb") as f:
+                self._sessions = pickle.load(f)
+
+        except EnvironmentError as e:
+            log_debug(f"Opening upload sessions Exception: {e!r}")
+            return
+
+        # Remove the sessions Dropbox doesn't know anymore
+        now = time.time()
+        stale_sessions = [key for key, state in self._sessions.items() if state["created"] + self.SESSION_LIFETIME < now]
+
+        for key in stale_sessions:
+            log_debug(f"Removing stale upload session for: {key[0]}")
+            del self._sessions[key]
+
+        if stale_sessions:
+            self._save()
+
+    def _save(self):
+
+        try:
+
+            with open(self._storage_file, "wb") as f:
+                pickle.dump(self._sessions, f, -1)
+
+        except EnvironmentError as e:
+            log_error(f"Storing upload sessions Exception: {e!r}")
+
+    @staticmethod
+    def get_file_identity(filename):
+        st = os.stat(filename)
+        return st.st_size, st.st_mtime, st.st_ino
+
+    def get(self, filename, path):
+        """
+        Returns the stored state, if the local file didn't change since
+        """
+
+        key = (filename, path.lower())
+
+        with self._lock:
+            state = self._sessions.get(key)
+
+            if state and state["identity"] != self.get_file_identity(filename):
+                log(f"File changed since the upload was interrupted: {filename}")
+                del self._sessions[key]
+                self._save()
+                state = None
+
+        return state
+
+    def set(self, filename, path, state):
+
+        with self._lock:
+            self._sessions[(filename, path.lower())] = state
+            self._save()
+
+    def remove(self, filename, path):
+
+        with self._lock:
+
+            if self._sessions.pop((filename, path.lower()), None):
+                self._save()
+
+
+class Uploader(threading.Thread):
+    """
+    Uploads a file to Dropbox with an upload session.
+    The chunks are read at their offset (os.pread where available), so no
+    file position has to be shared between the workers and only the chunks in
+    flight are in memory, also for files larger than the address space.
+    When the Dropbox SDK supports concurrent upload sessions several chunks
+    are sent at the same time, otherwise the chunks are sent one after another.
+    The chunk size adapts to the measured upload speed.
+    With UploadSessions the acknowledged ranges are stored after every chunk,
+    so an interrupted upload only sends the missing ranges the next time.
+
+    The api can be a dropbox.Dropbox object or any object which implements the
+    same upload session methods, e.g. a local mock to measure the throughput.
+    """
+
+    CHUNK_ALIGNMENT = 4 * 1024 * 1024 # Concurrent sessions require chunks of a multiple of 4 MB
+    MIN_CHUNK_SIZE = 4 * 1024 * 1024
+    MAX_CHUNK_SIZE = 148 * 1024 * 1024 # Largest multiple of 4 MB below the 150 MB API limit
+    MAX_BUFFER_SIZE = 256 * 1024 * 1024 # Total size of the chunks in flight
+    CHUNK_DURATION = 5.0 # Seconds, the chunk size is tuned to this duration
+    MAX_RETRIES = 5
+
+    def __init__(self, api, filename, path, connections=1, sessions=None):
+        super().__init__()
+        self._api = api
+        self.filename = filename
+        self.path = path
+        self.target_length = os.stat(filename).st_size
+        self._sessions = sessions
+        # A file of one chunk gains nothing from a concurrent session
+        self._concurrent = connections > 1 and self.target_length > self.CHUNK_ALIGNMENT and hasattr(dropbox.files, "UploadSessionType")
+        self._connections = connections if self._concurrent else 1
+        self._max_chunk_size = max(
+            self.MIN_CHUNK_SIZE,
+            min(self.MAX_CHUNK_SIZE, self.MAX_BUFFER_SIZE // self._connections) // self.CHUNK_ALIGNMENT * self.CHUNK_ALIGNMENT,
+        )
+        self._chunk_size = self.MIN_CHUNK_SIZE
+        self._gaps = []
+        self._file_obj = None
+        self._lock = threading.Lock()
+        self._read_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._state = None
+        self._resumed_bytes = 0
+        self.session_id = None
+        self.bytes_uploaded = 0
+        self.start_time = 0
+        self.end_time = 0
+        self.error = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    @property
+    def elapsed(self):
+
+        if not self.start_time:
+            return 0
+
+        return (self.end_time or time.time()) - self.start_time
+
+    @property
+    def throughput(self):
+        """
+        Bytes per second, resumed bytes are not counted
+        """
+
+        elapsed = self.elapsed
+
+        if not elapsed:
+            return 0
+
+        return (self.bytes_uploaded - self._resumed_bytes) / elapsed
+
+    @property
+    def completed(self):
+        return bool(self._state and self._state["closed"]) and not self.error
+
+    def run(self):
+        log_debug(f"Uploader started for: {self.filename} (concurrent: {self._concurrent})")
+        self.start_time = time.time()
+
+        try:
+
+            with open(self.filename, "rb") as self._file_obj:
+
+                try:
+                    resumed = self._resume_session()
+
+                    try:
+                        self._upload()
+                    except dropbox.exceptions.ApiError as e:
+
+                        if not resumed or not self._session_lost(e):
+                            raise
+
+                        log(f"Upload session expired, restarting upload for: {self.filename}")
+                        self._new_session()
+                        self._upload()
+
+                finally:
+                    self._file_obj = None
+
+        except Exception as e:
+            log_error(f"Uploader failed for: {self.filename}: {e!r}")
+            self.error = e
+
+        self.end_time = time.time()
+
+        if self.stopped():
+            log_debug(f"Uploader stopped (as requested) for: {self.filename}")
+        else:
+            log_debug(f"Uploader finished for: {self.filename} ({format_size(self.throughput)}/s)")
+
+    def _resume_session(self):
+        state = None
+
+        if self._sessions:
+            state = self._sessions.get(self.filename, self.path)
+
+        if not state or state["concurrent"] != self._concurrent:
+            self._new_session()
+            return False
+
+        self._state = state
+        self.session_id = state["session_id"]
+        self.bytes_uploaded = self._resumed_bytes = sum(end - start for start, end in state["ranges"])
+        log(f"Resuming upload of {self.filename} at {format_size(self.bytes_uploaded)}")
+        return True
+
+    def _new_session(self):
+        self.error = None
+        self.session_id = None
+        self.bytes_uploaded = self._resumed_bytes = 0
+        self._state = {
+            "session_id": None,
+            "concurrent": self._concurrent,
+            "identity": UploadSessions.get_file_identity(self.filename),
+            "ranges": [],
+            "closed": False,
+            "created": time.time(),
+        }
+
+    @staticmethod
+    def _session_lost(error):
+        error = error.error
+        return error.is_not_found() or error.is_closed()
+
+    def _upload(self):
+
+        if self._state["closed"]:
+            # Everything was sent before, only the commit is missing
+            return
+
+        if self._concurrent:
+            self._upload_concurrent()
+        else:
+            self._upload_sequential()
+
+        if self.error:
+            raise self.error
+
+    def _upload_sequential(self):
+        ranges = self._state["ranges"]
+        offset = ranges[0][1] if ranges else 0
+
+        if not self.session_id:
+            length = min(self._chunk_size, self.target_length)
+            close = length == self.target_length
+            result = self._api.files_upload_session_start(self._read(0, length), close=close)
+            self.session_id = self._state["session_id"] = result.session_id
+            self._acknowledge(0, length, close)
+            offset = length
+
+        while offset < self.target_length and not self.stopped():
+            length = min(self._chunk_size, self.target_length - offset)
+            offset = self._upload_chunk(offset, length, close=offset + length == self.target_length)
+
+            if offset is None:
+                return
+
+    def _read(self, offset, length):
+        """
+        Returns the chunk of the file at offset
+        """
+
+        if not hasattr(os, "pread"):
+
+            # Windows has no positional read, the workers share the file position
+            with self._read_lock:
+                self._file_obj.seek(offset)
+                return self._file_obj.read(length)
+
+        chunks = []
+
+        while length > 0:
+            data = os.pread(self._file_obj.fileno(), length, offset)
+
+            if not data:
+                raise EOFError(f"{self.filename} ended at {offset}")
+
+            chunks.append(data)
+            offset += len(data)
+            length -= len(data)
+
+        return b"".join(chunks)
+
+    def _upload_concurrent(self):
+
+        if not self.session_id:
+            concurrent = dropbox.files.UploadSessionType.concurrent
+            # A concurrent session can't receive data in the start call
+            result = self._api.files_upload_session_start(b"", session_type=concurrent)
+            self.session_id = self._state["session_id"] = result.session_id
+            self._store_state()
+
+        # The last chunk closes the session, so it has to be sent after all the others
+        tail_offset = (self.target_length - 1) // self.CHUNK_ALIGNMENT * self.CHUNK_ALIGNMENT
+        self._gaps = self._get_gaps(tail_offset)
+        workers = []
+
+        for _ in range(self._connections):
+            t = threading.Thread(target=self._upload_worker)
+            t.start()
+            workers.append(t)
+
+        for worker in workers:
+            worker.join()
+
+        if not self.stopped() and not self.error:
+            self._upload_chunk(tail_offset, self.target_length - tail_offset, close=True)
+
+    def _get_gaps(self, end_offset):
+        """
+        Returns the ranges up to end_offset which aren't acknowledged yet
+        """
+
+        gaps = []
+        offset = 0
+
+        for start, end in self._state["ranges"]:
+
+            if start >= end_offset:
+                break
+
+            if start > offset:
+                gaps.append((offset, start))
+
+            offset = max(offset, end)
+
+        if offset < end_offset:
+            gaps.append((offset, end_offset))
+
+        return gaps
+
+    def _upload_worker(self):
+
+        while not self.stopped() and not self.error:
+
+            with self._lock:
+
+                if not self._gaps:
+                    return
+
+                # Acknowledged ranges are aligned, so the gaps and chunks are aligned as well
+                start, end = self._gaps[0]
+                length = min(self._chunk_size, end - start)
+
+                if start + length == end:
+                    self._gaps.pop(0)
+                else:
+                    self._gaps[0] = (start + length, end)
+
+            if self._upload_chunk(start, length) is None:
+                return
+
+    def _upload_chunk(self, offset, length, close=False):
+        """
+        Returns the acknowledged end offset of the chunk or None on failure
+        """
+
+        retries = 0
+
+        while not self.stopped():
+            cursor = dropbox.files.UploadSessionCursor(self.session_id, offset)
+            start_time = time.time()
+
+            try:
+                self._api.files_upload_session_append_v2(self._read(offset, length), cursor, close=close)
+            except dropbox.exceptions.RateLimitError as e:
+                xbmc.sleep((e.backoff or 1) * 1000)
+                continue
+            except dropbox.exceptions.ApiError as e:
+                correct_offset = self._get_correct_offset(e)
+
+                if not self._concurrent and correct_offset is not None and correct_offset > offset:
+                    # The server received more than we know of (e.g. a response got lost),
+                    # continue from the offset the server acknowledged
+                    self._acknowledge(offset, correct_offset, close and correct_offset == self.target_length)
+                    return correct_offset
+
+                self.error = e
+                return None
+
+            except Exception as e:
+                retries += 1
+
+                if retries >= self.MAX_RETRIES:
+                    self.error = e
+                    return None
+
+                log_error(f"Uploader chunk at offset {offset} failed, retrying: {e!r}")
+                xbmc.sleep(1000 * 2 ** retries)
+                continue
+
+            self._acknowledge(offset, offset + length, close)
+            self._adapt_chunk_size(length, time.time() - start_time)
+            return offset + length
+
+        return None
+
+    @staticmethod
+    def _get_correct_offset(error):
+        error = error.error
+
+        if error.is_incorrect_offset():
+            return error.get_incorrect_offset().correct_offset
+
+    def _acknowledge(self, start, end, closed=False):
+
+        with self._lock:
+            ranges = self._state["ranges"] + [[start, end]]
+            ranges.sort()
+            merged = []
+
+            for range_ in ranges:
+
+                if merged and range_[0] <= merged[-1][1]:
+                    merged[-1][1] = max(merged[-1][1], range_[1])
+                else:
+                    merged.append(list(range_))
+
+            self._state["ranges"] = merged
+            self._state["closed"] = closed
+            self.bytes_uploaded = sum(end - start for start, end in merged)
+            self._store_state()
+
+    def _store_state(self):
+
+        # A file of one chunk is cheaper to send again than to keep track of
+        if self._sessions and self.target_length > self.MIN_CHUNK_SIZE:
+            self._sessions.set(self.filename, self.path, self._state)
+
+    def _adapt_chunk_size(self, length, duration):
+
+        # Only full chunks tell something about the speed
+        if length != self._chunk_size:
+            return
+
+        with self._lock:
+
+            if duration < self.CHUNK_DURATION / 2:
+                self._chunk_size = min(self._chunk_size * 2, self._max_chunk_size)
+            elif duration > self.CHUNK_DURATION * 2:
+                self._chunk_size = max(self._chunk_size // 2 // self.CHUNK_ALIGNMENT * self.CHUNK_ALIGNMENT, self.MIN_CHUNK_SIZE)
+
+    def get_cursor(self):
+        return dropbox.files.UploadSessionCursor(self.session_id, self.target_length)
+
+    def finish(self):
+        """
+        Commits the uploaded (and closed) session to the path
+        """
+
+        commit = dropbox.files.CommitInfo(path=self.path)
+        result = self._api.files_upload_session_finish(b"", self.get_cursor(), commit)
+        self.remove_session()
+        return result
+
+    def remove_session(self):
+
+        if self._sessions:
+            self._sessions.remove(self.filename, self.path)
+
+
+class FolderUploader(threading.Thread):
+    """
+    Uploads a local folder tree to Dropbox.
+    The files are uploaded concurrently, each with its own upload session, and
+    committed in groups with files_upload_session_finish_batch.
+    """
+
+    def __init__(self, api, local_path, path, connections=1, sessions=None):
+        super().__init__()
+        self._api = api
+        self.local_path = os.path.normpath(local_path)
+        self.path = path.rstrip(DROPBOX_SEP)
+        self._connections = connections
+        self._sessions = sessions
+        self._files = []
+        self._remote_files = {}
+        self._uploaders = []
+        self._to_commit = []
+        self._lock = threading.Lock()
+        self._commit_lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._bytes_done = 0
+        self.files_total = 0
+        self.files_uploaded = 0
+        self.skipped = []
+        self.conflicts = []
+        self.failed = []
+        self.bytes_total = 0
+        self.start_time = 0
+        self.end_time = 0
+        self.error = None
+
+    def stop(self):
+        self._stop_event.set()
+
+        with self._lock:
+
+            for uploader in self._uploaders:
+                uploader.stop()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    @property
+    def bytes_uploaded(self):
+
+        with self._lock:
+            return self._bytes_done + sum(uploader.bytes_uploaded for uploader in self._uploaders)
+
+    @property
+    def throughput(self):
+        elapsed = (self.end_time or time.time()) - self.start_time
+
+        if not self.start_time or not elapsed:
+            return 0
+
+        return self.bytes_uploaded / elapsed
+
+    def run(self):
+        log_debug(f"FolderUploader started for: {self.local_path}")
+        self.start_time = time.time()
+
+        try:
+            self._files = [(entry.path, entry.stat().st_size) for entry in self._scan(self.local_path)]
+            self.files_total = len(self._files)
+            self.bytes_total = sum(size for filename, size in self._files)
+            self._files.reverse() # Pop the files in the order they were found
+            self._remote_files = self._get_remote_files()
+            workers = []
+
+            for _ in range(self._connections):
+                t = threading.Thread(target=self._upload_worker)
+                t.start()
+                workers.append(t)
+
+            for worker in workers:
+                worker.join()
+
+            # Commit the rest, in batches
+            while self._to_commit and not self.stopped():
+                self._commit()
+
+        except Exception as e:
+            log_error(f"FolderUploader failed for: {self.local_path}: {e!r}")
+            self.error = e
+
+        self.end_time = time.time()
+
+        if self.stopped():
+            log_debug(f"FolderUploader stopped (as requested) for: {self.local_path}")
+        else:
+            log_debug(f"FolderUploader finished for: {self.local_path} ({format_size(self.throughput)}/s)")
+
+    def _scan(self, local_path):
+
+        with os.scandir(local_path) as entries:
+
+            for entry in entries:
+
+                if entry.is_dir(follow_symlinks=False):
+                    yield from self._scan(entry.path)
+                elif entry.is_file():
+                    yield entry
+
+    def _get_remote_path(self, filename):
+        relative_path = os.path.relpath(filename, self.local_path)
+        return self.path + DROPBOX_SEP + relative_path.replace(os.sep, DROPBOX_SEP)
+
+    def _get_remote_files(self):
+        """
+        Returns the metadata of all the files already present in the remote folder
+        """
+
+        remote_files = {}
+
+        try:
+            result = call_with_retries(self._api.files_list_folder, self.path, True)
+        except dropbox.exceptions.ApiError as e:
+            # The remote folder doesn't exist yet
+            return remote_files
+
+        while True:
+
+            for metadata in result.entries:
+                remote_files[metadata.path_lower] = metadata
+
+            if not result.has_more:
+                return remote_files
+
+            result = call_with_retries(self._api.files_list_folder_continue, result.cursor)
+
+    def _upload_worker(self):
+
+        while not self.stopped() and not self.error:
+
+            with self._lock:
+
+                if not self._files:
+                    return
+
+                filename, size = self._files.pop()
+
+            path = self._get_remote_path(filename)
+            remote_metadata = self._remote_files.get(path.lower())
+
+            if remote_metadata:
+
+                if is_same_content(filename, remote_metadata):
+                    log_debug(f"FolderUploader skipping unchanged file: {filename}")
+                    self.skipped.append(filename)
+                else:
+                    log_error(f"FolderUploader conflict, a different file is present: {path}")
+                    self.conflicts.append(filename)
+
+                with self._lock:
+                    self._bytes_done += size
+
+                continue
+
+            with self._lock:
+                uploader = Uploader(self._api, filename, path, sessions=self._sessions)
+                self._uploaders.append(uploader)
+
+            # The upload runs in this worker thread
+            uploader.run()
+
+            with self._lock:
+                self._uploaders.remove(uploader)
+                self._bytes_done += uploader.bytes_uploaded
+
+            if uploader.completed:
+                self._add_to_commit(uploader)
+            elif not self.stopped():
+                log_error(f"FolderUploader failed to upload: {filename}")
+                self.failed.append(filename)
+
+    def _add_to_commit(self, uploader):
+
+        with self._lock:
+            self._to_commit.append(uploader)
+            batch_full = len(self._to_commit) >= BATCH_SIZE
+
+        if batch_full:
+            self._commit()
+
+    def _commit(self):
+
+        with self._commit_lock:
+
+            with self._lock:
+                uploaders = self._to_commit[:BATCH_SIZE]
+                self._to_commit = self._to_commit[BATCH_SIZE:]
+
+            if not uploaders:
+                return
+
+            log_debug(f"FolderUploader committing {len(uploaders)} files")
+            entries = [
+                dropbox.files.UploadSessionFinishArg(uploader.get_cursor(), dropbox.files.CommitInfo(path=uploader.path))
+                for uploader in uploaders
+            ]
+            launch = call_with_retries(self._api.files_upload_session_finish_batch, entries)
+            result = wait_for_job(launch, self._api.files_upload_session_finish_batch_check)
+
+            for uploader, entry in zip(uploaders, result.entries):
+
+                if entry.is_success():
+                    uploader.remove_session()
+                    self.files_uploaded += 1
+                else:
+                    log_error(f"FolderUploader failed to commit: {uploader.path}: {entry.get_failure()}")
+                    self.failed.append(uploader.filename)
@@ -20,6 +20,7 @@
 # */
 
 import uuid
+import itertools
 import threading
 
 import xbmc
@@ -33,6 +34,7 @@ from .dropbox_client import KodiDropboxClient
 
 
 HANDLE = int(sys.argv[1])
+MENU_PATH_MARKER = "\0" # Stands for the item path in the context menu templates
 
 
 class DropboxViewer:
@@ -41,9 +43,11 @@ class DropboxViewer:
     """
 
     _use_steaming_urls = False
+    _use_image_previews = False
     _filter_files = False
     _loader = None
     _session = ""
+    _page_size = 0
 
     def __init__(self, params, account_settings):
         self._account_settings = account_settings
@@ -59,12 +63,18 @@ class DropboxViewer:
         )
         self._filter_files = ADDON_SETTINGS.getBool("file_filter")
         self._use_steaming_urls = ADDON_SETTINGS.getBool("stream_media")
+        self._use_image_previews = ADDON_SETTINGS.getBool("image_previews", True)
         self._enabled_sync = self._account_settings.synchronisation
         self._local_sync_path = self._account_settings.sync_path
         self._remote_sync_path = self._account_settings.remote_path
         self._current_path = params.get("path", DROPBOX_SEP)
         self._module = params.get("module", "")
         self._content_type = params.get("content_type", "executable")
+        self._page = int(params.get("page", 0))
+        self._page_size = ADDON_SETTINGS.getInt("page_size", 1000)
+        self._list_items = [] # (url, list item, is folder), added in one go
+        self._media_info = {} # path: compact media info of the listed files
+        self._menu_templates = {} # (is folder, synchronized): [(label, url parts)]
         # Set/change 'session_id' to let the other FolderBrowser know that it has to quit
         self._session = str(uuid.uuid4())
         self.win = xbmcgui.Window(xbmcgui.getCurrentWindowId())
@@ -105,6 +115,7 @@ class DropboxViewer:
         return entries
 
     def show(self, cache_to_disc=True, succeeded=True):
+        self.flush_list_items()
         xbmcplugin.endOfDirectory(HANDLE, succeeded=succeeded, cacheToDisc=cache_to_disc)
 
         if self._loader:
@@ -129,52 +140,114 @@ class DropboxViewer:
 
                 xbmc.sleep(100)
 
-    def build_list(self, items):
-        # Create and start the thread that will download the files
+        # Write the cache changes of this listing in one go
+        self._cache.flush()
+
+    def create_loader(self):
+        # Create the thread that will download the files, show starts it
         self._loader = FileLoader(self._client, self._module, self._account_name)
-        self.process_folders(items["folders"])
+
+    def build_list(self, items):
+        self.create_loader()
+        self._media_info.update(items.get("media", {}))
+
+        if not self._page_size:
+            self.add_items(items)
+            return
+
+        # The cached listing keeps its order, a page is a range of it
+        start = self._page * self._page_size
+        entries = list(itertools.islice(self.get_entries(items), start, start + self._page_size + 1))
+
+        for entry in entries[:self._page_size]:
+            self.add_entry(*entry)
+
+        if len(entries) > self._page_size:
+            self.add_next_page()
+
+    def get_entries(self, items):
+        """
+        Yields (path, metadata, media type) of the items, folders first
+        """
+
+        for path, metadata in items["folders"].items():
+            yield path, metadata, "folder"
 
         if not self._filter_files or self._content_type == "executable":
-            [self.process_files(file_type, entries) for file_type, entries in items["files"].items()]
+            file_types = items["files"]
         else:
-            self.process_files(self._content_type, items["files"][self._content_type])
+            file_types = (self._content_type,)
+
+        for file_type in file_types:
+
+            for path, metadata in items["files"][file_type].items():
+                yield path, metadata, file_type
 
-    def process_folders(self, folders):
-        [self.add_folder(metadata.name, path) for path, metadata in folders.items()]
+    def add_items(self, items):
+        self._media_info.update(items.get("media", {}))
 
-    def process_files(self, content_type, entries):
-        [self.add_file(path, metadata, content_type) for path, metadata in entries.items()]
+        for entry in self.get_entries(items):
+            self.add_entry(*entry)
+
+    def add_entry(self, path, metadata, media_type):
+
+        if media_type == "folder":
+            self.add_folder(metadata.name, path)
+        else:
+            self.add_file(path, metadata, media_type)
+
+    def add_next_page(self):
+        list_item = xbmcgui.ListItem(LANGUAGE_STRING(30067))
+        list_item.setArt({"icon": "DefaultFolder.png", "thumb": "DefaultFolder.png"})
+        # Stays the last item whichever sort method is chosen
+        list_item.setProperty("SpecialSort", "bottom")
+        url = self.get_url(self._current_path) + f"&page={self._page + 1}"
+        self.add_list_item(url, list_item, True)
+
+    def add_list_item(self, url, list_item, is_folder):
+        self._list_items.append((url, list_item, is_folder))
+
+    def flush_list_items(self):
+        """
+        Adds the collected items to the listing in one call
+        """
+
+        if self._list_items:
+            xbmcplugin.addDirectoryItems(HANDLE, self._list_items, len(self._list_items))
+            self._list_items = []
+
+    def add_index_views(self):
+        """
+        Adds the views of the search index, which the synchronization keeps
+        """
+
+        for view, (string_id, order, media_type) in INDEX_VIEWS.items():
+
+            if self._filter_files and media_type and self._content_type not in ("executable", media_type):
+                continue
+
+            list_item = xbmcgui.ListItem(LANGUAGE_STRING(string_id))
+            list_item.setArt({"icon": "DefaultFolder.png", "thumb": "DefaultFolder.png"})
+            url = self.get_url(DROPBOX_SEP, module="browse_view") + f"&view={view}"
+            self.add_list_item(url, list_item, True)
 
     def add_folder(self, name, path):
         list_item = xbmcgui.ListItem(name)
         list_item.setArt({"icon": "DefaultFolder.png", "thumb": "DefaultFolder.png"})
         url = self.get_url(path, module="browse_folder")
-        context_menu_items = []
-        search_url = self.get_url(path, module="search_dropbox")
-        context_menu_items.append((LANGUAGE_STRING(30017), f"RunPlugin({search_url})"))
-        context_menu_items.append((LANGUAGE_STRING(30022), self.get_context_url(path, "delete")))
-        context_menu_items.append((LANGUAGE_STRING(30002), self.get_context_url(path, "rename")))
-        context_menu_items.append((LANGUAGE_STRING(30027), self.get_context_url(path, "move")))
-        context_menu_items.append((LANGUAGE_STRING(30024), self.get_context_url(path, "copy")))
-        context_menu_items.append((LANGUAGE_STRING(30029), self.get_context_url(path, "create_folder")))
-        context_menu_items.append((LANGUAGE_STRING(30031), self.get_context_url(path, "upload")))
-        context_menu_items.append((LANGUAGE_STRING(30037), self.get_context_url(path, "download", extra="is_dir=True")))
-
-        if self._enabled_sync and self._remote_sync_path in path:
-            context_menu_items.append((LANGUAGE_STRING(30112), self.get_context_url(path, "sync_now")))
-
-        list_item.addContextMenuItems(context_menu_items)
+        list_item.addContextMenuItems(self.get_context_menu(path, True))
         # No useful metadata of folder
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
+        self.add_list_item(url, list_item, True)
 
     def add_file(self, path, metadata, media_type):
         filename = metadata.name
         list_item = xbmcgui.ListItem(filename)
         list_item.setArt({"icon": ICONS[media_type]})
         list_item.setDateTime(metadata.server_modified.strftime("%Y-%m-%d %H:%M:%S"))
-        list_item.setInfo(TYPES[media_type], {"size": metadata.size})
+        self.set_info(list_item, path, metadata, media_type)
+        context_menu_items = self.get_context_menu(path, False)
 
-        if self._enabled_sync and self._remote_sync_path in path:
+        if self._enabled_sync and self._remote_sync_path in path and media_type not in self._account_settings.virtual_types:
             # Use the synchronized location for url
             url = get_local_sync_path(self._local_sync_path, self._remote_sync_path, path)
         elif media_type in ("image", "video", "audio"):
@@ -184,30 +257,81 @@ class DropboxViewer:
                 # This doesn't work for pictures
                 list_item.setProperty("IsPlayable", "true")
                 url = f"{ADDON_URL}?action=play&path={path}&filename={filename}&account={self._account_name}"
+            elif media_type == "image" and self.has_preview(metadata):
+                # Show a screen sized rendition, the original only on request
+                url = self._loader.get_preview(path, metadata.rev)
+                context_menu_items.append((LANGUAGE_STRING(30057), self.get_context_url(path, "view_original", extra=f"size={metadata.size}")))
             else:
-                url = self._loader.get_file(path)
+                url = self._loader.get_file(path, metadata.size)
                 # url = self.get_media_url(path)
 
         else:
             list_item.setProperty("IsPlayable", "false")
             url = "No action"
 
+        list_item.addContextMenuItems(context_menu_items)
+        self.add_list_item(url, list_item, False)
+
+    def set_info(self, list_item, path, metadata, media_type):
+        info = {"size": metadata.size}
+        media_info = self._media_info.get(path)
+
+        if media_info:
+            duration, width, height, time_taken = media_info
+
+            if media_type == "video":
+                info["duration"] = duration
+                list_item.addStreamInfo("video", {"width": width, "height": height, "duration": duration})
+            elif media_type == "image":
+                info["exif:resolution"] = f"{width},{height}"
+
+                if time_taken:
+                    info["exif:exiftime"] = time_taken
+                    # Sort photos by the date they were taken
+                    list_item.setDateTime(time_taken)
+
+        list_item.setInfo(TYPES[media_type], info)
+
+    def get_context_menu(self, path, is_dir):
+        """
+        Returns the context menu of an item, from a template which is created
+        once per listing
+        """
+
+        sync = self._enabled_sync and self._remote_sync_path in path
+        key = (is_dir, sync)
+
+        if key not in self._menu_templates:
+            self._menu_templates[key] = self.create_menu_template(is_dir, sync)
+
+        return [(label, path.join(parts)) for label, parts in self._menu_templates[key]]
+
+    def create_menu_template(self, is_dir, sync):
+        """
+        Creates the labels and urls of a context menu, the urls are split at
+        the places of the item path
+        """
+
+        item_path = MENU_PATH_MARKER
+        # The folder actions of a file act on the current folder
+        folder_path = item_path if is_dir else self._current_path
+        search_url = self.get_url(folder_path, module="search_dropbox")
         context_menu_items = []
-        search_url = self.get_url(self._current_path, module="search_dropbox")
         context_menu_items.append((LANGUAGE_STRING(30017), f"RunPlugin({search_url})"))
-        context_menu_items.append((LANGUAGE_STRING(30022), self.get_context_url(path, "delete")))
-        context_menu_items.append((LANGUAGE_STRING(30002), self.get_context_url(path, "rename")))
-        context_menu_items.append((LANGUAGE_STRING(30027), self.get_context_url(path, "move")))
-        context_menu_items.append((LANGUAGE_STRING(30024), self.get_context_url(path, "copy")))
-        context_menu_items.append((LANGUAGE_STRING(30029), self.get_context_url(self._current_path, "create_folder")))
-        context_menu_items.append((LANGUAGE_STRING(30031), self.get_context_url(self._current_path, "upload")))
-        context_menu_items.append((LANGUAGE_STRING(30037), self.get_context_url(path, "download", extra="is_dir=False")))
+        context_menu_items.append((LANGUAGE_STRING(30022), self.get_context_url(item_path, "delete")))
+        context_menu_items.append((LANGUAGE_STRING(30002), self.get_context_url(item_path, "rename")))
+        context_menu_items.append((LANGUAGE_STRING(30027), self.get_context_url(item_path, "move")))
+        context_menu_items.append((LANGUAGE_STRING(30024), self.get_context_url(item_path, "copy")))
+        context_menu_items.append((LANGUAGE_STRING(30071), self.get_context_url(self._current_path, "batch")))
+        context_menu_items.append((LANGUAGE_STRING(30029), self.get_context_url(folder_path, "create_folder")))
+        context_menu_items.append((LANGUAGE_STRING(30031), self.get_context_url(folder_path, "upload")))
+        context_menu_items.append((LANGUAGE_STRING(30047), self.get_context_url(folder_path, "upload_folder")))
+        context_menu_items.append((LANGUAGE_STRING(30037), self.get_context_url(item_path, "download", extra=f"is_dir={is_dir}")))
 
-        if self._enabled_sync and self._remote_sync_path in path:
-            context_menu_items.append((LANGUAGE_STRING(30112), self.get_context_url(self._current_path, "sync_now")))
+        if sync:
+            context_menu_items.append((LANGUAGE_STRING(30112), self.get_context_url(folder_path, "sync_now")))
 
-        list_item.addContextMenuItems(context_menu_items)
-        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=False)
+        return [(label, url.split(MENU_PATH_MARKER)) for label, url in context_menu_items]
 
     def get_url(self, path, module=None):
         url = f"{ADDON_URL}?content_type={self._content_type}&account={self._account_name}&path={path}"
@@ -219,10 +343,14 @@ class DropboxViewer:
 
         return url
 
+    def has_preview(self, metadata):
+        file_extension = os.path.splitext(metadata.name)[1][1:].lower()
+        return self._use_image_previews and file_extension in PREVIEW_EXT and metadata.size <= THUMBNAIL_MAX_SIZE
+
     def get_context_url(self, path, action, extra=None):
         url = f"RunPlugin({ADDON_URL}?action={action}&account={self._account_name}"
 
-        if action == "upload":
+        if action in ("upload", "upload_folder"):
             url += f"&to_path={path}"
         else:
             url += f"&path={path}"
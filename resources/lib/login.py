@@ -27,20 +27,33 @@ from .utils import *
 from .account_settings import AccountSettings
 
 
+def is_unlocked(account_settings):
+    """
+    Checks if the account can be used without asking for the passcode
+    """
+
+    if not account_settings.passcode:
+        return True
+
+    win = xbmcgui.Window(xbmcgui.getCurrentWindowId())
+    win_prop_name = account_settings.account_name + "Unlocked"
+    unlock_timeout = account_settings.passcode_timeout * 60 # to minutes
+
+    try:
+        unlocked_time = float(win.getProperty(win_prop_name))
+    except ValueError:
+        unlocked_time = 0.0
+
+    return time.time() < unlocked_time + unlock_timeout
+
+
 def unlock(account_settings):
     unlocked = True
     win = xbmcgui.Window(xbmcgui.getCurrentWindowId())
 
     if account_settings.passcode:
         win_prop_name = account_settings.account_name + "Unlocked"
-        unlock_timeout = account_settings.passcode_timeout * 60 # to minutes
-
-        try:
-            unlocked_time = float(win.getProperty(win_prop_name))
-        except ValueError:
-            unlocked_time = 0.0
-
-        unlocked = time.time() < unlocked_time + unlock_timeout
+        unlocked = is_unlocked(account_settings)
 
         if not unlocked:
             log("Unlock with passcode required")
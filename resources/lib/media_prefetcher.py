@@ -0,0 +1,190 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import threading
+import urllib.request
+
+import xbmc
+import xbmcvfs
+
+from .utils import *
+from .account_settings import AccountSettings
+from .dropbox_client import KodiDropboxClient
+from .streaming_proxy import get_proxy_url
+
+
+TIMEOUT = 30 # Seconds
+PLAYER_WAIT = 30 # Seconds the playback may take to start
+
+
+def prefetch_media(account_name, path, subtitles_attached=True):
+    """
+    Prefetches the items which follow the played path, run by the service
+    so the plugin can exit as soon as the item is resolved
+    """
+
+    account_settings = AccountSettings(account_name)
+
+    if not account_settings.access_token:
+        return
+
+    client = KodiDropboxClient(
+        account_settings.access_token,
+        account_settings.refresh_token,
+        account_settings.app_key,
+        account_settings.app_secret,
+        account_name,
+    )
+
+    try:
+        MediaPrefetcher(client, account_name).prefetch(path, subtitles_attached)
+    except Exception as e:
+        log_error(f"Prefetching failed for {path}: {e!r}")
+    finally:
+        client.flush_cache()
+
+
+class MediaPrefetcher:
+    """
+    Prepares the playback of the items which follow the played item in its
+    folder: their media links are resolved (in the link cache or by the
+    streaming proxy) and their subtitle files are downloaded to the shadow
+    folder, so the next item starts without waiting on Dropbox.
+    Only the cached folder metadata is used, nothing is listed for this.
+    """
+
+    def __init__(self, client, account_name):
+        self._client = client
+        self._account_name = account_name
+        self._shadow_path = f"{get_cache_path(account_name)}/shadow/"
+        self._count = ADDON_SETTINGS.getInt("prefetch_items", 3)
+
+    def _get_folder_files(self, path):
+        metadata = self._client.get_cached_metadata(os.path.dirname(path))
+
+        if not metadata:
+            return {}
+
+        return metadata["files"]
+
+    def _get_shadow_location(self, path):
+        return os.path.normpath(self._shadow_path + path)
+
+    def get_subtitles(self, path, download=True):
+        """
+        Returns the local locations of the subtitle files next to the media
+        file (e.g. movie.srt or movie.en.srt for movie.mkv), downloading
+        them when needed and download is set
+        """
+
+        files = self._get_folder_files(path)
+        name = os.path.splitext(os.path.basename(path))[0].lower()
+        locations = []
+
+        for sidecar_path, metadata in files.get("other", {}).items():
+            sidecar_name, file_extension = os.path.splitext(metadata.name.lower())
+
+            if file_extension[1:] not in SUBTITLE_EXT:
+                continue
+
+            if sidecar_name != name and not sidecar_name.startswith(name + "."):
+                continue
+
+            location = self._get_shadow_location(sidecar_path)
+
+            if xbmcvfs.exists(location) or download and self._client.save_file(sidecar_path, location, metadata.size):
+                locations.append(location)
+
+        return locations
+
+    def get_next_items(self, path):
+        """
+        Returns the paths of the media files of the same type which follow
+        the path in its folder, sorted by name
+        """
+
+        files = self._get_folder_files(path)
+        entries = files.get(identify_file_type(path), {})
+        paths = sorted(entries, key=lambda entry: entries[entry].name.lower())
+
+        try:
+            index = paths.index(path.lower())
+        except ValueError:
+            return []
+
+        return paths[index + 1:index + 1 + self._count]
+
+    def prefetch(self, path, subtitles_attached=True):
+        """
+        Resolves the links and subtitles of the next items, returns when done.
+        The subtitles of the played item are downloaded first and handed to
+        the player when the item was resolved without them.
+        """
+
+        if not subtitles_attached:
+            self._load_subtitles(path)
+
+        tasks = []
+
+        for next_path in self.get_next_items(path):
+            t = threading.Thread(target=self._prefetch_item, args=(next_path,))
+            t.start()
+            tasks.append(t)
+
+        for task in tasks:
+            task.join()
+
+    def _load_subtitles(self, path):
+        locations = self.get_subtitles(path)
+
+        if not locations:
+            return
+
+        player = xbmc.Player()
+        monitor = xbmc.Monitor()
+
+        # The player may still be opening the item
+        for _ in range(PLAYER_WAIT):
+
+            if player.isPlaying():
+                player.setSubtitles(locations[0])
+                log_debug(f"Subtitles loaded: {locations[0]}")
+                return
+
+            if monitor.waitForAbort(1):
+                return
+
+    def _prefetch_item(self, path):
+        proxy_url = get_proxy_url(self._account_name, path)
+
+        if proxy_url:
+            # The proxy resolves the link when the file is requested
+            try:
+                request = urllib.request.Request(proxy_url, method="HEAD")
+                urllib.request.urlopen(request, timeout=TIMEOUT).close()
+            except Exception as e:
+                log_debug(f"Prefetching through the proxy failed for {path}: {e!r}")
+
+        else:
+            self._client.prefetch_media_url(path)
+
+        self.get_subtitles(path)
+        log_debug(f"Prefetched: {path}")
@@ -0,0 +1,70 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import time
+
+import requests.exceptions
+
+from .utils import *
+
+
+RETRY_INTERVAL = 30 # Seconds before Dropbox is tried again
+OFFLINE_PROPERTY = f"{ADDON_ID}.offline"
+
+# Failures of the connection, not of the request
+NETWORK_ERRORS = (
+    requests.exceptions.ConnectionError,
+    requests.exceptions.Timeout,
+)
+
+
+# The network state is shared by the plugin and the service through a property
+# of the home window. It holds the time of the last failure, so after a failure
+# every request fails at once until RETRY_INTERVAL has passed, instead of
+# waiting for the timeouts of the SDK. Then the next request is the probe: it
+# clears the failure when it succeeds and renews it when it fails again.
+def set_offline():
+
+    if not get_home_window().getProperty(OFFLINE_PROPERTY):
+        log("Dropbox can't be reached, working offline")
+
+    get_home_window().setProperty(OFFLINE_PROPERTY, str(time.time()))
+
+
+def set_online():
+
+    if get_home_window().getProperty(OFFLINE_PROPERTY):
+        log("Dropbox can be reached again")
+        get_home_window().clearProperty(OFFLINE_PROPERTY)
+
+
+def is_offline():
+    """
+    Returns True when the last request failed on the network less than
+    RETRY_INTERVAL ago
+    """
+
+    try:
+        failed_time = float(get_home_window().getProperty(OFFLINE_PROPERTY))
+    except ValueError:
+        return False
+
+    return time.time() < failed_time + RETRY_INTERVAL
@@ -0,0 +1,374 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import heapq
+import bisect
+import pickle
+import itertools
+import threading
+
+from dropbox.files import FileMetadata, FolderMetadata, DeletedMetadata
+
+from .utils import *
+
+
+def get_trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class SearchIndex:
+    """
+    Local index of the metadata of an account for searching names without
+    asking Dropbox.
+    The service keeps it up to date from the change feed of the synchronization
+    and stores it, the plugin adds the folders of the browse cache to it.
+    Names are indexed by their trigrams, a search only checks the names which
+    contain all trigrams of the search words.
+    A search is only answered locally when the complete subtree is indexed.
+    The files are also kept ordered by date and by size per media type, for
+    views like the recently added videos. These orders are built when the
+    index is stored (or first used) and then updated with the entries, so
+    the plugin loads them with the index instead of sorting all files.
+    A large update (e.g. the first sync) drops them, they are sorted once
+    afterwards instead of inserting entry by entry.
+    """
+
+    ORDERS = {
+        "date": lambda metadata: -metadata.server_modified.timestamp(),
+        "size": lambda metadata: -metadata.size,
+    }
+    BULK_UPDATE = 500 # Entries, a larger update rebuilds the orders
+
+    def __init__(self, account_name):
+        self.account_name = account_name
+        self._index_file = os.path.normpath(f"{DATA_PATH}/accounts/{account_name}/search_index.pik")
+        self._lock = threading.RLock()
+        self._entries = {} # path_lower: metadata
+        self._trigrams = {} # trigram: set of path_lower
+        self._children = {} # folder key: set of path_lower of its children
+        self._complete = set() # Folders of which the whole subtree is indexed
+        self._listed = set() # Folders of which all children are indexed
+        self._ordered = {} # order: {media_type: sorted list of (key, path_lower)}
+        self._dirty = False
+        self.load()
+
+    def load(self):
+
+        try:
+
+            with open(self._index_file, "rb") as file_obj:
+                data = pickle.load(file_obj)
+
+            self._entries, self._trigrams, self._complete = data[:3]
+            # An index stored without the orders builds them when first used
+            self._ordered = data[3] if len(data) > 3 else {}
+            self._children = data[4] if len(data) > 4 else self._get_children_map()
+
+        except EnvironmentError:
+            pass
+        except Exception as e:
+            log_error(f"SearchIndex failed to load for {self.account_name}: {e!r}")
+
+    def save(self):
+
+        with self._lock:
+
+            if not self._dirty:
+                return
+
+            # The plugin may read the index meanwhile, replace it in one go
+            temp_file = self._index_file + ".tmp"
+
+            for order in self.ORDERS:
+                self._get_ordered(order)
+
+            try:
+
+                with open(temp_file, "wb") as file_obj:
+                    pickle.dump([self._entries, self._trigrams, self._complete, self._ordered, self._children], file_obj, -1)
+
+                os.replace(temp_file, self._index_file)
+                self._dirty = False
+            except EnvironmentError as e:
+                log_error(f"SearchIndex failed to save for {self.account_name}: {e!r}")
+
+    def clear(self):
+
+        with self._lock:
+            self._entries = {}
+            self._trigrams = {}
+            self._children = {}
+            self._complete = set()
+            self._listed = set()
+            self._ordered = {}
+            self._dirty = True
+
+    def update(self, entries):
+        """
+        Applies metadata of the change feed (or a listing)
+        """
+
+        entries = list(entries)
+
+        with self._lock:
+
+            if len(entries) > self.BULK_UPDATE:
+                # Every insertion into an order is linear, sort them again when used or stored
+                self._ordered = {}
+
+            for metadata in entries:
+
+                if isinstance(metadata, DeletedMetadata):
+                    self._remove(metadata.path_lower)
+                elif isinstance(metadata, (FileMetadata, FolderMetadata)):
+                    self._add(metadata)
+
+            self._dirty = True
+
+    def _add(self, metadata):
+        path = metadata.path_lower
+
+        if path in self._entries:
+            self._remove_entry(path)
+
+        self._entries[path] = metadata
+
+        for trigram in get_trigrams(metadata.name.lower()):
+            self._trigrams.setdefault(trigram, set()).add(path)
+
+        self._children.setdefault(self._get_parent_key(path), set()).add(path)
+
+        if isinstance(metadata, FileMetadata):
+
+            for order, files in self._ordered.items():
+                entry = (self.ORDERS[order](metadata), path)
+                bisect.insort(files.setdefault(identify_file_type(metadata.name), []), entry)
+
+    def _remove_entry(self, path):
+        metadata = self._entries.pop(path, None)
+
+        if not metadata:
+            return
+
+        for trigram in get_trigrams(metadata.name.lower()):
+            paths = self._trigrams.get(trigram)
+
+            if paths:
+                paths.discard(path)
+
+                if not paths:
+                    del self._trigrams[trigram]
+
+        parent = self._get_parent_key(path)
+        siblings = self._children.get(parent)
+
+        if siblings:
+            siblings.discard(path)
+
+            if not siblings:
+                del self._children[parent]
+
+        if isinstance(metadata, FileMetadata):
+
+            for order, files in self._ordered.items():
+                entry = (self.ORDERS[order](metadata), path)
+                entries = files.get(identify_file_type(metadata.name), [])
+                i = bisect.bisect_left(entries, entry)
+
+                if i < len(entries) and entries[i] == entry:
+                    del entries[i]
+
+    def _remove(self, path):
+        self._remove_entry(path)
+        # The contents of a deleted folder are deleted too
+        folders = [path]
+
+        while folders:
+
+            for child in self._children.pop(folders.pop(), set()):
+                self._remove_entry(child)
+                folders.append(child)
+
+    def set_complete(self, path):
+
+        with self._lock:
+            self._complete.add(self._get_folder_key(path))
+            self._dirty = True
+
+    def is_complete(self, path):
+        """
+        Checks if everything below path is indexed
+        """
+
+        path = self._get_folder_key(path)
+
+        with self._lock:
+
+            if any(path == folder or path.startswith(folder + DROPBOX_SEP) or not folder for folder in self._complete):
+                return True
+
+            return self._is_listed(path)
+
+    def _is_listed(self, path):
+        folders = [path]
+
+        while folders:
+            folder = folders.pop()
+
+            if folder not in self._listed:
+                return False
+
+            for child in self._children.get(folder, ()):
+
+                if isinstance(self._entries[child], FolderMetadata):
+                    folders.append(child)
+
+        return True
+
+    @staticmethod
+    def _get_folder_key(path):
+        # The root is stored as an empty string
+        return path.lower().rstrip(DROPBOX_SEP)
+
+    def _get_parent_key(self, path):
+        return self._get_folder_key(os.path.dirname(path))
+
+    def _get_children_map(self):
+        children = {}
+
+        for path in self._entries:
+            children.setdefault(self._get_parent_key(path), set()).add(path)
+
+        return children
+
+    def get_children(self, path):
+        """
+        Returns the metadata of the entries in the folder, None when the
+        folder isn't indexed completely
+        """
+
+        if not self.is_complete(path):
+            return None
+
+        with self._lock:
+            return [self._entries[child] for child in self._children.get(self._get_folder_key(path), ())]
+
+    def add_cached_folders(self, cache):
+        """
+        Adds the folders of the browse cache (in memory only)
+        """
+
+        with self._lock:
+            dirty = self._dirty
+
+            for path, folder in cache.get()["metadata"].items():
+
+                # The change feed is more recent than the browse cache
+                if self.is_complete(path):
+                    continue
+
+                entries = folder["entries"]
+                self.update(entries["folders"].values())
+
+                for files in entries["files"].values():
+                    self.update(files.values())
+                self._listed.add(self._get_folder_key(path))
+
+            # The browse cache isn't stored with the index
+            self._dirty = dirty
+
+    def search(self, query, path=DROPBOX_SEP, max_results=1000):
+        """
+        Returns the metadata of the entries in path of which the name
+        contains all words of the query
+        """
+
+        words = query.lower().split()
+        scope = self._get_folder_key(path) + DROPBOX_SEP
+        results = []
+
+        with self._lock:
+            candidates = None
+
+            for word in words:
+                trigrams = get_trigrams(word)
+
+                if not trigrams:
+                    # Too short to use the index
+                    continue
+
+                for trigram in trigrams:
+                    paths = self._trigrams.get(trigram, set())
+                    candidates = paths if candidates is None else candidates & paths
+
+            if candidates is None:
+                candidates = self._entries.keys()
+
+            for candidate in candidates:
+                metadata = self._entries[candidate]
+                name = metadata.name.lower()
+
+                if candidate.startswith(scope) and all(word in name for word in words):
+                    results.append(metadata)
+
+                    if len(results) >= max_results:
+                        break
+
+        return results
+
+    def _get_ordered(self, order):
+
+        if order not in self._ordered:
+            files = {}
+
+            for path, metadata in self._entries.items():
+
+                if isinstance(metadata, FileMetadata):
+                    files.setdefault(identify_file_type(metadata.name), []).append((self.ORDERS[order](metadata), path))
+
+            for entries in files.values():
+                entries.sort()
+
+            self._ordered[order] = files
+
+        return self._ordered[order]
+
+    def get_range(self, order, media_type=None, path=DROPBOX_SEP, start=0, count=100):
+        """
+        Returns the metadata of the files in path from start to start + count
+        in the order ("date": newest first, "size": largest first), only of
+        media_type when given. The second value is True when more follow.
+        """
+
+        scope = self._get_folder_key(path) + DROPBOX_SEP
+
+        with self._lock:
+            files = self._get_ordered(order)
+
+            if media_type:
+                entries = files.get(media_type, [])
+            else:
+                entries = heapq.merge(*files.values())
+
+            paths = (entry_path for key, entry_path in entries if entry_path.startswith(scope))
+            paths = list(itertools.islice(paths, start, start + count + 1))
+            return [self._entries[entry_path] for entry_path in paths[:count]], len(paths) > count
@@ -0,0 +1,170 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import threading
+import urllib.request
+
+import xbmc
+
+from .utils import *
+
+
+READ_SIZE = 1024 * 1024
+TIMEOUT = 30 # Seconds
+
+
+def fetch_range(url, start, end):
+    """
+    Opens the byte range start-end (inclusive) of the url
+    """
+
+    request = urllib.request.Request(url, headers={"Range": f"bytes={start}-{end}"})
+    response = urllib.request.urlopen(request, timeout=TIMEOUT)
+
+    if response.status != 206:
+        response.close()
+        raise IOError(f"Range request not supported, status: {response.status}")
+
+    return response
+
+
+class SegmentedDownloader:
+    """
+    Downloads a large file over several connections at the same time.
+    The file is split in byte ranges which are fetched in parallel from a
+    temporary link and written at their offset in the preallocated file.
+    """
+
+    MAX_RETRIES = 5
+
+    def __init__(self, url, location, size, segments=4, content_hash=None):
+        self.url = url
+        self.location = location
+        self.size = size
+        self._segments = segments
+        self._content_hash = content_hash
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self.bytes_downloaded = 0
+        self.error = None
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def download(self):
+        log_debug(f"SegmentedDownloader started for: {self.location} ({self._segments} segments)")
+        self._preallocate()
+        segment_size = -(-self.size // self._segments) # Round up
+        tasks = []
+
+        for start in range(0, self.size, segment_size):
+            end = min(start + segment_size, self.size)
+            t = threading.Thread(target=self._download_segment, args=(start, end))
+            t.start()
+            tasks.append(t)
+
+        for task in tasks:
+            task.join()
+
+        if self.error or self.stopped():
+            log_error(f"SegmentedDownloader failed for: {self.location}: {self.error!r}")
+            return False
+
+        if self._content_hash and get_content_hash(self.location) != self._content_hash:
+            log_error(f"SegmentedDownloader content hash mismatch for: {self.location}")
+            return False
+
+        log_debug(f"SegmentedDownloader finished for: {self.location}")
+        return True
+
+    def _preallocate(self):
+
+        with open(self.location, "wb") as file_obj:
+
+            if hasattr(os, "posix_fallocate"):
+
+                try:
+                    os.posix_fallocate(file_obj.fileno(), 0, self.size)
+                    return
+                except OSError as e:
+                    # Not supported by every file system
+                    log_debug(f"posix_fallocate failed: {e!r}")
+
+            file_obj.truncate(self.size)
+
+    def _download_segment(self, start, end):
+        offset = start
+        retries = 0
+
+        with open(self.location, "r+b") as file_obj:
+
+            while offset < end and not self.stopped() and not self.error:
+
+                try:
+                    response = fetch_range(self.url, offset, end - 1)
+
+                    try:
+
+                        while offset < end and not self.stopped():
+                            data = response.read(min(READ_SIZE, end - offset))
+
+                            if not data:
+                                raise IOError(f"Connection closed at offset {offset}")
+
+                            self._write(file_obj, data, offset)
+                            offset += len(data)
+
+                            with self._lock:
+                                self.bytes_downloaded += len(data)
+
+                    finally:
+                        response.close()
+
+                except Exception as e:
+                    retries += 1
+
+                    if retries >= self.MAX_RETRIES:
+                        self.error = e
+                        return
+
+                    # Continue with the rest of the segment
+                    log_error(f"SegmentedDownloader segment at offset {offset} failed, retrying: {e!r}")
+                    xbmc.sleep(1000 * 2 ** retries)
+
+    @staticmethod
+    def _write(file_obj, data, offset):
+
+        if hasattr(os, "pwrite"):
+            view = memoryview(data)
+
+            while view:
+                written = os.pwrite(file_obj.fileno(), view, offset)
+                view = view[written:]
+                offset += written
+
+        else:
+            # Every segment has its own file object, so seeking is safe
+            file_obj.seek(offset)
+            file_obj.write(data)
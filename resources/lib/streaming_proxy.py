@@ -0,0 +1,531 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import re
+import hmac
+import time
+import shutil
+import secrets
+import mimetypes
+import threading
+import urllib.error
+import urllib.parse
+import collections
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import xbmcvfs
+
+from .utils import *
+from .account_settings import AccountSettings
+from .dropbox_client import KodiDropboxClient
+from .segmented_download import fetch_range
+
+
+HOST = "127.0.0.1"
+CHUNK_SIZE = 2 * 1024 * 1024
+MAX_READAHEAD = 8 # Chunks
+MAX_FETCHES = 4 # Concurrent read-ahead fetches
+MAX_SOURCES = 8
+LINK_LIFETIME = 13800 # Seconds - link valid for 4 hours
+TOKEN_PROPERTY = f"{ADDON_ID}.proxy_token"
+
+
+# The proxy serves the files of all accounts, so a URL must hold the token of
+# the running proxy. The token is a property of the home window, only the
+# processes of Kodi can read it.
+def get_proxy_url(account_name, path):
+    """
+    Returns the URL of the path on the streaming proxy of the service,
+    None when the proxy isn't running or is disabled
+    """
+
+    port = ADDON_SETTINGS.getInt("streaming_proxy_port", 0)
+    token = get_home_window().getProperty(TOKEN_PROPERTY)
+
+    if not port or not token or not ADDON_SETTINGS.getBool("streaming_proxy", True):
+        return None
+
+    return "http://{}:{}/{}/{}{}".format(
+        HOST,
+        port,
+        token,
+        urllib.parse.quote(account_name, safe=""),
+        urllib.parse.quote(path),
+    )
+
+
+class ChunkCache:
+    """
+    Bounded on-disk cache of media chunks, keyed by the content hash of the
+    file so a changed file never serves old data.
+    The least recently used chunks are removed when the cache is full.
+    """
+
+    def __init__(self, path, max_size):
+        self._path = path
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        self._size = 0
+
+        if not xbmcvfs.exists(self._path):
+            xbmcvfs.mkdirs(self._path)
+
+        for location, size, mtime in self._get_chunks():
+            self._size += size
+
+    def _get_chunks(self):
+
+        for dir_entry in os.scandir(self._path):
+
+            if dir_entry.is_dir():
+
+                for entry in os.scandir(dir_entry.path):
+                    st = entry.stat()
+                    yield entry.path, st.st_size, st.st_mtime
+
+    def _get_location(self, content_hash, index):
+        return os.path.join(self._path, content_hash, str(index))
+
+    def get(self, content_hash, index):
+        location = self._get_location(content_hash, index)
+
+        try:
+
+            with open(location, "rb") as file_obj:
+                data = file_obj.read()
+
+        except EnvironmentError:
+            return None
+
+        # Mark as recently used
+        os.utime(location)
+        return data
+
+    def put(self, content_hash, index, data):
+        location = self._get_location(content_hash, index)
+        dir_name = os.path.dirname(location) + os.sep
+
+        if not xbmcvfs.exists(dir_name):
+            xbmcvfs.mkdirs(dir_name)
+
+        # Write to a temporary file first, a reader never sees a partial chunk
+        temp_location = f"{location}.{threading.get_ident()}.tmp"
+
+        with open(temp_location, "wb") as file_obj:
+            file_obj.write(data)
+
+        os.replace(temp_location, location)
+
+        with self._lock:
+            self._size += len(data)
+
+            if self._size > self._max_size:
+                self._evict()
+
+    def _evict(self):
+        chunks = sorted(self._get_chunks(), key=lambda chunk: chunk[2])
+        self._size = sum(chunk[1] for chunk in chunks)
+        target_size = self._max_size * 0.9
+
+        for location, size, mtime in chunks:
+
+            if self._size <= target_size:
+                break
+
+            try:
+                os.remove(location)
+                self._size -= size
+            except OSError as e:
+                log_debug(f"ChunkCache failed to remove {location}: {e!r}")
+
+        # Remove the folders of files which are completely gone
+        for dir_entry in os.scandir(self._path):
+
+            if dir_entry.is_dir() and not os.listdir(dir_entry.path):
+                shutil.rmtree(dir_entry.path, ignore_errors=True)
+
+
+class StreamSource:
+    """
+    A remote file which is streamed through the proxy.
+    It keeps the temporary link (renewed when it expires), serves the chunks
+    from the ChunkCache and reads ahead while the playback is sequential.
+    """
+
+    def __init__(self, client, path, chunk_cache):
+        self._client = client
+        self.path = path
+        self._chunk_cache = chunk_cache
+        self._lock = threading.Lock()
+        self._fetches = {} # Chunk index: Event
+        self._fetch_semaphore = threading.BoundedSemaphore(MAX_FETCHES)
+        self._last_index = -1
+        self._readahead = 1
+        self._link = None
+        self._link_generation = 0 # Counts the renewals of the link
+        self._link_expires = 0
+        self.size = 0
+        self.content_hash = None
+        self._renew_link(0)
+
+    def _renew_link(self, generation):
+        """
+        Replaces the link of the generation and returns (link, generation).
+        The request is made outside the lock, a link which another thread
+        renewed meanwhile is kept.
+        """
+
+        with self._lock:
+
+            if generation != self._link_generation:
+                return self._link, self._link_generation
+
+        result = self._client.dropbox_api.files_get_temporary_link(self.path)
+
+        with self._lock:
+
+            if generation == self._link_generation:
+                self._link = result.link
+                self._link_generation += 1
+                self._link_expires = time.time() + LINK_LIFETIME
+                self.size = result.metadata.size
+                self.content_hash = result.metadata.content_hash
+                log_debug(f"StreamSource new link for: {self.path}")
+
+            return self._link, self._link_generation
+
+    def _get_link(self):
+
+        with self._lock:
+            link, generation = self._link, self._link_generation
+            expired = time.time() > self._link_expires
+
+        if expired:
+            return self._renew_link(generation)
+
+        return link, generation
+
+    def _fetch(self, index):
+        start = index * CHUNK_SIZE
+        end = min(start + CHUNK_SIZE, self.size) - 1
+        link, generation = self._get_link()
+
+        try:
+            response = fetch_range(link, start, end)
+        except urllib.error.HTTPError as e:
+            # The link expired before its time, renew it once
+            log_debug(f"StreamSource link failed ({e.code}) for: {self.path}")
+            link, generation = self._renew_link(generation)
+            response = fetch_range(link, start, end)
+
+        try:
+            data = response.read()
+        finally:
+            response.close()
+
+        # Never cache a short chunk, it would be served as the end of the file
+        if len(data) != end - start + 1:
+            raise EOFError(f"Chunk {index} of {self.path} has {len(data)} of {end - start + 1} bytes")
+
+        self._chunk_cache.put(self.content_hash, index, data)
+        return data
+
+    def get_chunk(self, index):
+        data = self._chunk_cache.get(self.content_hash, index)
+
+        if data is None:
+
+            with self._lock:
+                event = self._fetches.get(index)
+
+                if not event:
+                    event = self._fetches[index] = threading.Event()
+                    fetching = True
+                else:
+                    fetching = False
+
+            if fetching:
+
+                try:
+                    data = self._fetch(index)
+                finally:
+
+                    with self._lock:
+                        del self._fetches[index]
+
+                    event.set()
+
+            else:
+                # Another thread (e.g. the read-ahead) is fetching it already
+                event.wait()
+                data = self._chunk_cache.get(self.content_hash, index)
+
+                if data is None:
+                    return self.get_chunk(index)
+
+        self._read_ahead(index)
+        return data
+
+    def _read_ahead(self, index):
+
+        with self._lock:
+
+            # Grow the read-ahead while the playback is sequential, reset it on a seek
+            if index == self._last_index + 1:
+                self._readahead = min(self._readahead * 2, MAX_READAHEAD)
+            elif index != self._last_index:
+                self._readahead = 1
+
+            self._last_index = index
+            last_index = (self.size - 1) // CHUNK_SIZE
+            indexes = [
+                i for i in range(index + 1, min(index + self._readahead, last_index) + 1)
+                if i not in self._fetches
+            ]
+
+        for i in indexes:
+
+            if self._fetch_semaphore.acquire(blocking=False):
+                t = threading.Thread(target=self._read_ahead_chunk, args=(i,))
+                t.daemon = True
+                t.start()
+
+    def _read_ahead_chunk(self, index):
+
+        try:
+
+            with self._lock:
+
+                if index in self._fetches:
+                    return
+
+                event = self._fetches[index] = threading.Event()
+
+            try:
+
+                if self._chunk_cache.get(self.content_hash, index) is None:
+                    self._fetch(index)
+
+            except Exception as e:
+                log_debug(f"StreamSource read-ahead failed for chunk {index}: {e!r}")
+            finally:
+
+                with self._lock:
+                    del self._fetches[index]
+
+                event.set()
+
+        finally:
+            self._fetch_semaphore.release()
+
+
+class StreamingProxy(ThreadingMixIn, HTTPServer):
+    """
+    Local HTTP server which serves byte ranges of Dropbox files to the Kodi
+    player, so seeking doesn't need a new connection to Dropbox and replayed
+    parts come from the disk cache.
+    """
+
+    daemon_threads = True
+
+    def __init__(self):
+        HTTPServer.__init__(self, (HOST, 0), StreamingProxyHandler)
+        cache_size = ADDON_SETTINGS.getInt("stream_cache_size", 1024) * 1024 * 1024
+        self.chunk_cache = ChunkCache(os.path.join(get_cache_root(), "stream"), cache_size)
+        self._sources = collections.OrderedDict()
+        self._clients = {}
+        self._lock = threading.Lock()
+        self.token = secrets.token_urlsafe(16) # New for every session
+        get_home_window().setProperty(TOKEN_PROPERTY, self.token)
+        ADDON.setSettingInt("streaming_proxy_port", self.server_port)
+        log_debug(f"StreamingProxy started on port: {self.server_port}")
+
+    def server_close(self):
+        ADDON.setSettingInt("streaming_proxy_port", 0)
+        get_home_window().clearProperty(TOKEN_PROPERTY)
+        super().server_close()
+
+    def _get_client(self, account_name):
+        client = self._clients.get(account_name)
+
+        if not client:
+            account = AccountSettings(account_name)
+
+            if not account.access_token:
+                return None
+
+            client = KodiDropboxClient(
+                account.access_token,
+                account.refresh_token,
+                account.app_key,
+                account.app_secret,
+                account_name,
+                auto_connect=False,
+            )
+            connected, msg = client.connect()
+
+            if not connected:
+                log_error(f"StreamingProxy could not connect to dropbox: {msg}")
+                return None
+
+            # Another request may have connected the account meanwhile
+            client = self._clients.setdefault(account_name, client)
+
+        return client
+
+    def get_source(self, account_name, path):
+        key = (account_name, path.lower())
+
+        with self._lock:
+            source = self._sources.get(key)
+
+            if source:
+                self._sources.move_to_end(key)
+                return source
+
+        # Connect and get the temporary link without the lock,
+        # the other files keep streaming meanwhile
+        client = self._get_client(account_name)
+
+        if not client:
+            return None
+
+        source = StreamSource(client, path, self.chunk_cache)
+
+        with self._lock:
+            # Another request may have opened the file meanwhile
+            source = self._sources.setdefault(key, source)
+            self._sources.move_to_end(key)
+
+            while len(self._sources) > MAX_SOURCES:
+                self._sources.popitem(last=False)
+
+            return source
+
+
+class StreamingProxyHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        log_debug(f"StreamingProxy {format % args}")
+
+    def do_HEAD(self):
+        self._handle(send_body=False)
+
+    def do_GET(self):
+        self._handle(send_body=True)
+
+    def _handle(self, send_body):
+        parts = self.path.split("?")[0].split("/", 3)
+
+        if len(parts) < 4:
+            self.send_error(404)
+            return
+
+        if not hmac.compare_digest(parts[1], self.server.token):
+            self.send_error(403)
+            return
+
+        account_name = urllib.parse.unquote(parts[2])
+        path = "/" + urllib.parse.unquote(parts[3])
+
+        try:
+            source = self.server.get_source(account_name, path)
+        except Exception as e:
+            log_error(f"StreamingProxy failed to open {path}: {e!r}")
+            source = None
+
+        if not source:
+            self.send_error(404)
+            return
+
+        start, end = self._parse_range(source.size)
+
+        if start is None:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{source.size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        if self.headers.get("Range"):
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{source.size}")
+        else:
+            self.send_response(200)
+
+        self.send_header("Content-Type", mimetypes.guess_type(path)[0] or "application/octet-stream")
+        self.send_header("Content-Length", str(end - start + 1))
+        self.send_header("Accept-Ranges", "bytes")
+        self.end_headers()
+
+        if not send_body:
+            return
+
+        offset = start
+
+        try:
+
+            while offset <= end:
+                index = offset // CHUNK_SIZE
+                data = source.get_chunk(index)
+                chunk_start = offset - index * CHUNK_SIZE
+                chunk_end = min(len(data), end - index * CHUNK_SIZE + 1)
+
+                if chunk_end <= chunk_start:
+                    raise EOFError(f"Chunk {index} of {path} ended early")
+
+                self.wfile.write(data[chunk_start:chunk_end])
+                offset = index * CHUNK_SIZE + chunk_end
+
+        except (ConnectionError, OSError) as e:
+            # The player closes the connection when it seeks or stops
+            log_debug(f"StreamingProxy connection closed: {e!r}")
+            self.close_connection = True
+        except Exception as e:
+            log_error(f"StreamingProxy failed to stream {path}: {e!r}")
+            self.close_connection = True
+
+    def _parse_range(self, size):
+        range_header = self.headers.get("Range")
+
+        if not range_header:
+            return 0, size - 1
+
+        match = re.match(r"bytes=(\d*)-(\d*)", range_header)
+
+        if not match or not (match.group(1) or match.group(2)):
+            return None, None
+
+        if not match.group(1):
+            # Suffix range: the last n bytes
+            start = max(size - int(match.group(2)), 0)
+            end = size - 1
+        else:
+            start = int(match.group(1))
+            end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+
+        if start > end or start >= size:
+            return None, None
+
+        return start, end
@@ -28,6 +28,8 @@ import xbmcvfs
 from ..utils import *
 from .notify_sync import *
 from .sync_account import SyncAccount
+from .library_scan import LibraryScanner
+from ..media_prefetcher import prefetch_media
 
 
 class DropboxSynchronizer(threading.Thread):
@@ -40,17 +42,18 @@ class DropboxSynchronizer(threading.Thread):
         super().__init__()
         self._accounts = []
         self._notified = None
+        self._library_scanner = LibraryScanner()
         self.monitor = xbmc.Monitor()
 
     def run(self):
         # Get available accounts and create them
         self.update_accounts()
-        self._notified = NotifySyncServer()
+        self._notified = NotifySyncServer(self.handle_request)
         self._notified.start()
 
         while not self.monitor.abortRequested():
             # First get all notifications
-            account_name, notification = self._notified.get_notification()
+            account_name, notification, data = self._notified.get_notification()
 
             if notification:
                 account = None
@@ -66,7 +69,7 @@ class DropboxSynchronizer(threading.Thread):
                 if notification == NOTIFY_SYNC_PATH:
 
                     if account:
-                        account.notify_sync_request(None)
+                        account.notify_sync_request(data)
                     else:
                         log_error("DropboxSynchronizer: NOTIFY_SYNC_PATH recieved without account")
 
@@ -79,6 +82,11 @@ class DropboxSynchronizer(threading.Thread):
 
                 elif notification == NOTIFY_ADDED_REMOVED_ACCOUNT:
                     self.update_accounts()
+                elif notification == NOTIFY_PREFETCH:
+                    # Runs next to the synchronization, it can take a while
+                    t = threading.Thread(target=prefetch_media, args=(account_name, data["path"], data["subtitles_attached"]))
+                    t.daemon = True
+                    t.start()
                 else:
                     log_error("DropboxSynchronizer: Unknown notification recieved")
 
@@ -105,6 +113,20 @@ class DropboxSynchronizer(threading.Thread):
         if self._notified:
             self._notified.close_server()
 
+        self._library_scanner.stop()
+
+    def handle_request(self, account_name, request, data):
+        """
+        Answers a request of a NotifySyncClient, called from the thread of its connection
+        """
+
+        if request == REQUEST_STATUS:
+            return {
+                account.account_name: account.get_status()
+                for account in list(self._accounts)
+                if not account_name or account.account_name == account_name
+            }
+
     def update_accounts(self):
         """
         Get available accounts and create/delete them
@@ -149,6 +171,6 @@ class DropboxSynchronizer(threading.Thread):
 
             if name not in existing_accounts:
                 log_debug(f"DropboxSynchronizer: account {name} added")
-                account = SyncAccount(name)
+                account = SyncAccount(name, self._library_scanner)
                 account.init()
                 self._accounts.append(account)
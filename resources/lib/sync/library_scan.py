@@ -0,0 +1,181 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import json
+import threading
+
+import xbmc
+
+from ..utils import *
+
+
+LIBRARIES = {
+    "video": "VideoLibrary",
+    "audio": "AudioLibrary",
+}
+
+
+class LibraryScanner:
+    """
+    Collects the local folders in which the synchronization added, changed
+    or removed media and updates only those folders in the Kodi library.
+    Changes are merged and sent after a quiet period (DELAY), so a sync of
+    many files results in a few scans. Folders inside an other changed
+    folder are covered by the scan of that folder.
+    The JSON-RPC function can be replaced, e.g. by a stub for testing.
+    """
+
+    DELAY = 30.0 # Seconds without changes before scanning
+    RETRY_DELAY = 60.0 # Seconds, when the library is busy
+
+    def __init__(self, rpc=None):
+        self._rpc = rpc or xbmc.executeJSONRPC
+        self._lock = threading.Lock()
+        self._scan_dirs = {media_type: set() for media_type in LIBRARIES}
+        self._clean_dirs = {media_type: set() for media_type in LIBRARIES}
+        self._timer = None
+
+    def add(self, location, media_type, removed=False):
+        """
+        Records the change of the local file (or folder) location
+        """
+
+        if media_type not in LIBRARIES or not ADDON_SETTINGS.getBool("library_scan", True):
+            return
+
+        dir_name = os.path.dirname(os.path.normpath(location)) + os.sep
+        dirs = self._clean_dirs if removed else self._scan_dirs
+
+        with self._lock:
+            dirs[media_type].add(dir_name)
+            self._schedule(self.DELAY)
+
+    def add_removed_folder(self, location):
+        """
+        Records the removal of a local folder, it could contain any media
+        """
+
+        for media_type in LIBRARIES:
+            self.add(location, media_type, removed=True)
+
+    def _schedule(self, delay):
+
+        # Every change restarts the quiet period
+        if self._timer:
+            self._timer.cancel()
+
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def stop(self):
+
+        with self._lock:
+
+            if self._timer:
+                self._timer.cancel()
+                self._timer = None
+
+    def flush(self):
+        """
+        Sends the scans of the recorded folders
+        """
+
+        with self._lock:
+            self._timer = None
+
+            if self._is_scanning():
+                log_debug("LibraryScanner: library is busy, scanning later")
+                self._schedule(self.RETRY_DELAY)
+                return
+
+            requests = []
+
+            for media_type, library in LIBRARIES.items():
+
+                clean_dirs = self._merge(self._clean_dirs[media_type])
+
+                if media_type == "audio":
+
+                    # AudioLibrary.Clean has no directory, it cleans the whole library
+                    if clean_dirs:
+                        requests.append((f"{library}.Clean", {"showdialogs": False}))
+
+                else:
+
+                    for dir_name in clean_dirs:
+                        requests.append((f"{library}.Clean", {"directory": dir_name, "showdialogs": False}))
+
+                for dir_name in self._merge(self._scan_dirs[media_type]):
+                    requests.append((f"{library}.Scan", {"directory": dir_name, "showdialogs": False}))
+
+                self._clean_dirs[media_type].clear()
+                self._scan_dirs[media_type].clear()
+
+        for method, params in requests:
+            log_debug(f"LibraryScanner: {method} {params.get('directory', '')}")
+            self._call(method, params)
+
+        return requests
+
+    @staticmethod
+    def _merge(dirs):
+        """
+        Returns the folders which aren't inside an other folder of dirs
+        """
+
+        merged = []
+
+        for dir_name in sorted(dirs, key=len):
+
+            if not any(dir_name.startswith(parent) for parent in merged):
+                merged.append(dir_name)
+
+        return merged
+
+    def _is_scanning(self):
+        result = self._call("XBMC.GetInfoBooleans", {"booleans": ["Library.IsScanning"]})
+
+        if not result:
+            return False
+
+        return bool(result.get("Library.IsScanning"))
+
+    def _call(self, method, params):
+        request = {
+            "jsonrpc": "2.0",
+            "method": method,
+            "params": params,
+            "id": 1,
+        }
+
+        try:
+            response = json.loads(self._rpc(json.dumps(request)))
+        except Exception as e:
+            log_error(f"LibraryScanner: {method} failed: {e!r}")
+            return None
+
+        if "error" in response:
+            log_error(f"LibraryScanner: {method} failed: {response['error']}")
+            return None
+
+        return response.get("result")
@@ -19,8 +19,10 @@
 # *
 # */
 
+import os
 import json
 import queue
+import struct
 import socket
 import threading
 
@@ -29,25 +31,78 @@ from ..utils import *
 
 HOST = "127.0.0.1" # Use 127.0.0.1 needed for windows
 PORT = 0 # Let OS get a free port
-SOCKET_BUFFER_SIZE = 1024
+SOCKET_PATH = os.path.join(DATA_PATH, "notify.sock") # Used where unix domain sockets are available
+SOCKET_TIMEOUT = 5 # Seconds
+FRAME_HEADER = struct.Struct(">I") # Length of the JSON message which follows
+MAX_FRAME_SIZE = 16 * 1024 * 1024
 NOTIFY_SYNC_PATH = "sync_path"
 NOTIFY_CHANGED_ACCOUNT = "account_settings_changed"
 NOTIFY_ADDED_REMOVED_ACCOUNT = "account_added_removed"
+NOTIFY_PREFETCH = "prefetch"
+REQUEST_STATUS = "status"
+REQUESTS = (REQUEST_STATUS,) # Answered directly instead of queued
+
+
+def send_frame(sock, message):
+    data = json.dumps(message).encode("utf-8")
+    sock.sendall(FRAME_HEADER.pack(len(data)) + data)
+
+
+def recv_exact(sock, size):
+    data = b""
+
+    while len(data) < size:
+        received = sock.recv(size - len(data))
+
+        if not received:
+            return None
+
+        data += received
+
+    return data
+
+
+def recv_frame(sock):
+    """
+    Returns the next message, None when the connection is closed
+    """
+
+    header = recv_exact(sock, FRAME_HEADER.size)
+
+    if header is None:
+        return None
+
+    size, = FRAME_HEADER.unpack(header)
+
+    if size > MAX_FRAME_SIZE:
+        raise ValueError(f"Frame too large: {size}")
+
+    data = recv_exact(sock, size)
+
+    if data is None:
+        return None
+
+    return json.loads(data.decode("utf-8"))
 
 
 class NotifySyncServer(threading.Thread):
     """
-    The NotifySyncServer listens to a TCP port to check if a NotifySyncClient
+    The NotifySyncServer listens to a socket to check if a NotifySyncClient
     reported a change event. A change event can be sent by a client (DMBC plugin)
     when something changes on the synced folder.
     This NotifySyncServer is started by the DropboxSynchronizer. And DropboxSynchronizer
     will check the NotifySyncServer to see if it should perform a sync.
+    The messages are length prefixed JSON frames (a frame can hold a batch of
+    messages) over a unix domain socket, or over TCP where those don't exist.
+    Clients keep their connection open and get a reply for every message.
     """
 
-    def __init__(self):
+    def __init__(self, request_handler=None):
         super().__init__()
         self._socket = None
         self._used_port = 0
+        self._unix_socket = False
+        self._request_handler = request_handler
         self._notify_list = queue.Queue() # Thread safe
         self._stop_event = threading.Event()
 
@@ -58,36 +113,47 @@ class NotifySyncServer(threading.Thread):
         return self._stop_event.is_set()
 
     def setup_server(self):
-        self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
 
-        try:
-            self._socket.bind((HOST, PORT))
-            self._used_port = self._socket.getsockname()[1]
-            self._socket.listen(1)
-        except Exception as e:
-            log_error(f"NotifySyncServer failed to bind to socket: {e!r}")
-            self._socket.close()
-            self._socket = None
-            self._used_port = 0
+        if hasattr(socket, "AF_UNIX"):
 
-        ADDON.setSettingInt("notify_server_port", self._used_port)
+            try:
 
-    def close_server(self):
-        self.stop()
-        s = None
+                if os.path.exists(SOCKET_PATH):
+                    os.remove(SOCKET_PATH)
 
-        # Fake a notify to stop the thread
-        try:
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.connect((HOST, self._used_port))
-            s.sendall("".encode("utf-8"))
-        except socket.error as e:
-            log_error(f"NotifySyncServer Exception: {e!r}")
-        finally:
+                self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+                self._socket.bind(SOCKET_PATH)
+                self._unix_socket = True
+            except Exception as e:
+                # E.g. the path is too long for a unix domain socket
+                log_error(f"NotifySyncServer failed to bind to unix socket: {e!r}")
 
-            if s:
-                s.close()
+                if self._socket:
+                    self._socket.close()
+                    self._socket = None
+
+        if not self._socket:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+            try:
+                self._socket.bind((HOST, PORT))
+                self._used_port = self._socket.getsockname()[1]
+            except Exception as e:
+                log_error(f"NotifySyncServer failed to bind to socket: {e!r}")
+                self._socket.close()
+                self._socket = None
+                self._used_port = 0
+
+        if self._socket:
+            self._socket.listen(5)
+            # Check regularly if the server has to stop
+            self._socket.settimeout(1)
 
+        # Port 0 tells the clients to use the unix socket
+        ADDON.setSettingInt("notify_server_port", self._used_port)
+
+    def close_server(self):
+        self.stop()
         # Wait for the thread
         self.join()
 
@@ -98,84 +164,217 @@ class NotifySyncServer(threading.Thread):
 
         account_name = None
         notification = None
+        notification_data = None
 
         if not self._notify_list.empty():
+            account_name, notification, notification_data = self._notify_list.get()
 
-            try:
-                data = json.loads(self._notify_list.get())
-                account_name = data[0]
-                notification = data[1]
-            except Exception as e:
-                log_error("NotifySyncServer: failed to parse recieved data")
-
-        return account_name, notification
+        return account_name, notification, notification_data
 
     def run(self):
         self.setup_server()
         log_debug("NotifySyncServer started")
 
         while not self.stopped() and self._socket:
-            client_socket = None
 
             # Check for new client connection
             try:
                 client_socket, address = self._socket.accept()
-            except socket.timeout as e:
-                log_debug(f"NotifySyncServer Exception: {e!r}")
+            except socket.timeout:
+                continue
             except socket.error as e:
                 log_error(f"NotifySyncServer Exception: {e!r}")
-            except:
-                log_error("NotifySyncServer Exception")
+                continue
 
-            if client_socket:
-                # Check the socket for new notificatios from client(s))
-                data = client_socket.recv(SOCKET_BUFFER_SIZE)
-                log_debug(f"NotifySyncServer received data: {data!r}")
-                self._notify_list.put(data)
-                client_socket.close()
+            # Every client gets its own thread, the connection stays open
+            t = threading.Thread(target=self._handle_client, args=(client_socket,))
+            t.daemon = True
+            t.start()
 
         if self._socket:
             self._socket.close()
             self._socket = None
 
+        if self._unix_socket and os.path.exists(SOCKET_PATH):
+            os.remove(SOCKET_PATH)
+
         log_debug("NotifySyncServer stopped")
 
+    def _handle_client(self, client_socket):
+        # Wait as long as the client keeps the connection open
+        client_socket.settimeout(None)
+
+        try:
+
+            while not self.stopped():
+                message = recv_frame(client_socket)
+
+                if message is None:
+                    break
+
+                log_debug(f"NotifySyncServer received data: {message!r}")
+
+                if isinstance(message, list):
+                    send_frame(client_socket, [self._handle_message(item) for item in message])
+                else:
+                    send_frame(client_socket, self._handle_message(message))
+
+        except Exception as e:
+            log_error(f"NotifySyncServer Exception: {e!r}")
+        finally:
+            client_socket.close()
+
+    def _handle_message(self, message):
+
+        try:
+            account_name = message["account"]
+            notification = message["notification"]
+            data = message.get("data")
+        except Exception as e:
+            log_error("NotifySyncServer: failed to parse recieved data")
+            return {"error": "Invalid message"}
+
+        reply = {"id": message.get("id")}
+
+        if notification in REQUESTS:
+
+            if self._request_handler:
+                reply["result"] = self._request_handler(account_name, notification, data)
+            else:
+                reply["error"] = "No request handler"
+
+        else:
+            self._notify_list.put((account_name, notification, data))
+            reply["result"] = True
+
+        return reply
+
 
 class NotifySyncClient:
     """
     NotifySyncClient is the client of NotifySyncServer and reports an event to
-    NotifySyncServer by sending data over the TCP socket.
+    NotifySyncServer by sending data over the socket.
+    The connection is shared by the clients of a process and kept open.
     """
 
-    def send_notification(self, account_name, notification, data=None):
-        s = None
+    _socket = None
+    _lock = threading.Lock()
+    _message_id = 0
+
+    @classmethod
+    def _connect(cls):
         used_port = ADDON_SETTINGS.getInt("notify_server_port")
 
         if used_port > 0:
+            s = socket.create_connection((HOST, used_port), timeout=SOCKET_TIMEOUT)
+        elif hasattr(socket, "AF_UNIX") and os.path.exists(SOCKET_PATH):
+            s = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            s.settimeout(SOCKET_TIMEOUT)
 
             try:
-                s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-                s.connect((HOST, used_port))
-                send_data = json.dumps([account_name, notification, data])
-                s.sendall(send_data.encode("utf-8"))
-                log_debug(f"NotifySyncClient send: {send_data!r}")
-            except socket.error as e:
-                log_error(f"NotifySyncClient Exception: {e!r}")
-            finally:
-
-                if s:
-                    s.close()
+                s.connect(SOCKET_PATH)
+            except socket.error:
+                s.close()
+                raise
 
         else:
-            log_error("NotifySyncClient no port defined")
+            return None
+
+        return s
+
+    @classmethod
+    def _close(cls):
+
+        if cls._socket:
+            cls._socket.close()
+            cls._socket = None
+
+    def request(self, messages):
+        """
+        Sends the message (or a list of messages in one frame) and returns
+        the reply (or list of replies), None when the server isn't reachable
+        """
+
+        cls = type(self)
+
+        with cls._lock:
+
+            # The clients of a process share the message ids
+            for message in messages if isinstance(messages, list) else [messages]:
+                cls._message_id += 1
+                message["id"] = cls._message_id
+
+            # Retry once, the kept connection can be closed by the server meanwhile.
+            # Only a failure before the server got the messages is retried,
+            # a notification must not be handled twice.
+            for attempt in range(2):
+                reused = cls._socket is not None
+
+                try:
+
+                    if not reused:
+                        cls._socket = cls._connect()
+
+                        if not cls._socket:
+                            log_error("NotifySyncClient no server defined")
+                            return None
+
+                    send_frame(cls._socket, messages)
+                except socket.error as e:
+                    log_error(f"NotifySyncClient Exception: {e!r}")
+                    cls._close()
+                    continue
+
+                try:
+                    reply = recv_frame(cls._socket)
+                except (socket.error, ValueError) as e:
+                    # E.g. a timeout, the server may have handled the messages
+                    log_error(f"NotifySyncClient Exception: {e!r}")
+                    cls._close()
+                    return None
+
+                if reply is None:
+                    cls._close()
+
+                    # A kept connection which the server closed before the messages
+                    # arrived, the send only reached the local buffer
+                    if reused:
+                        log_debug("NotifySyncClient connection closed by the server, reconnecting")
+                        continue
+
+                    log_error("NotifySyncClient connection closed by the server")
+                    return None
+
+                log_debug(f"NotifySyncClient send: {messages!r}")
+                return reply
+
+        return None
+
+    def create_message(self, account_name, notification, data=None):
+        # The id is given when the message is sent
+        return {"account": account_name, "notification": notification, "data": data}
+
+    def send_notification(self, account_name, notification, data=None):
+        return self.request(self.create_message(account_name, notification, data))
+
+    def send_notifications(self, notifications):
+        """
+        Sends a list of (account_name, notification, data) in one frame
+        """
+
+        return self.request([self.create_message(*notification) for notification in notifications])
 
     def sync_path(self, account, path):
+        self.sync_paths(account, [path])
+
+    def sync_paths(self, account, paths):
         # Check if synchronization is enabled and check if the path is somewhere
         # in the remote path
-        if account.synchronisation and account.remote_path in path:
-            # Ignore the path for now otherwise need to change receiving number of
-            # SOCKET_BUFFER_SIZE according to the path string size
-            self.send_notification(account.account_name, NOTIFY_SYNC_PATH)
+        paths = [path for path in paths if account.synchronisation and account.remote_path in path]
+
+        if paths:
+            # Only the paths (and their contents) get synchronized
+            self.send_notifications([(account.account_name, NOTIFY_SYNC_PATH, path) for path in paths])
         else:
             log_debug("NotifySyncClient Sync not enabled or path not part of remote sync path")
 
@@ -184,3 +383,20 @@ class NotifySyncClient:
 
     def account_added_removed(self):
         self.send_notification(None, NOTIFY_ADDED_REMOVED_ACCOUNT)
+
+    def prefetch(self, account_name, path, subtitles_attached=True):
+        """
+        Asks the service to get the items which follow the played path ready
+        """
+
+        self.send_notification(account_name, NOTIFY_PREFETCH, {"path": path, "subtitles_attached": subtitles_attached})
+
+    def get_status(self, account_name=None):
+        """
+        Returns the synchronization status of the account (or all accounts)
+        """
+
+        reply = self.send_notification(account_name, REQUEST_STATUS)
+
+        if reply:
+            return reply.get("result")
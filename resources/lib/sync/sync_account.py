@@ -30,9 +30,11 @@ import xbmcvfs
 
 from ..utils import *
 from .sync_folder import SyncFolder
+from .virtual_sync import VirtualSync
 from .sync_thread import SynchronizeThread
 from ..account_settings import AccountSettings
 from ..dropbox_client import KodiDropboxClient
+from ..search_index import SearchIndex
 
 
 class SyncAccount:
@@ -42,15 +44,18 @@ class SyncAccount:
     done on user request or when settings of an account are changed.
     """
 
-    def __init__(self, account_name):
+    def __init__(self, account_name, library_scanner=None):
         super().__init__()
         self.account_name = account_name
+        self.library_scanner = library_scanner
+        self.search_index = SearchIndex(account_name)
         self._refresh_token = ""
         self._access_token = ""
         self._app_key = ""
         self._app_secret = ""
         self._sync_path = ""
         self._remote_sync_path = "" # DROPBOX_SEP
+        self._virtual_types = None # Media types synchronized as .strm files
         self._sync_freq = 0 # Minutes
         self._new_sync_time = 0
         self.root = None
@@ -85,6 +90,14 @@ class SyncAccount:
 
         return stopped
 
+    def get_status(self):
+        return {
+            "enabled": self._enabled,
+            "syncing": bool(self._sync_thread and self._sync_thread.is_alive()),
+            "next_sync": self._new_sync_time,
+            "pending_requests": len(self._sync_requests),
+        }
+
     def check_sync(self):
         """
         Check if it is time to sync according to the interval time.
@@ -97,19 +110,38 @@ class SyncAccount:
 
             # Did we get sync requests or is it time to sync?
             if len(self._sync_requests) > 0 or self._new_sync_time < now:
+                paths = self._get_sync_paths()
                 self._sync_requests = []
 
                 if self._new_sync_time < now:
                     # Update new sync time
                     self._update_sync_time()
+                    paths = None # Everything
 
                 if self._get_client(reconnect=True):
-                    self._start_sync()
+                    self._start_sync(paths)
 
     def notify_sync_request(self, path):
 
         if self._enabled:
-            self._sync_requests.append(path)
+            self._sync_requests.append(path.lower() if path else None)
+
+    def _get_sync_paths(self):
+        """
+        Merges the requested paths, None when everything has to be synchronized
+        """
+
+        paths = []
+
+        for path in sorted(self._sync_requests, key=lambda path: len(path or "")):
+
+            if not path or path == self._remote_sync_path.lower():
+                return None
+
+            if not any(path == parent or path.startswith(parent + DROPBOX_SEP) for parent in paths):
+                paths.append(path)
+
+        return paths
 
     def notify_changed_settings(self):
         self._get_settings()
@@ -121,10 +153,10 @@ class SyncAccount:
         if xbmcvfs.exists(self._sync_path):
             shutil.rmtree(self._sync_path)
 
-    def _start_sync(self):
+    def _start_sync(self, paths=None):
         # Use a separate thread to do the syncing, so that the DropboxSynchronizer
         # can still handle other stuff (like changing settings) during syncing
-        self._sync_thread = SynchronizeThread(self)
+        self._sync_thread = SynchronizeThread(self, paths)
         self._sync_thread.start()
 
     def _get_settings(self):
@@ -133,6 +165,7 @@ class SyncAccount:
         enable = account.synchronisation
         temp_path = account.sync_path
         temp_remote_path = account.remote_path
+        temp_virtual_types = list(account.virtual_types)
         temp_freq = float(account.sync_freq)
         got_semaphore = True
 
@@ -140,7 +173,12 @@ class SyncAccount:
         if not self.sync_semaphore.acquire(False):
             got_semaphore = False
 
-            if enable != self._enabled or temp_path != self._sync_path or temp_remote_path != self._remote_sync_path:
+            if (
+                enable != self._enabled
+                or temp_path != self._sync_path
+                or temp_remote_path != self._remote_sync_path
+                or (self._virtual_types is not None and temp_virtual_types != self._virtual_types)
+            ):
                 log(f"Can't change settings while synchronizing for {self.account_name}")
                 dialog = xbmcgui.Dialog()
                 stop_sync = dialog.yesno(ADDON_NAME, f"{LANGUAGE_STRING(30110)} {LANGUAGE_STRING(30113)}")
@@ -157,6 +195,7 @@ class SyncAccount:
                     account.synchronisation = self._enabled
                     account.sync_path = self._sync_path
                     account.remote_path = self._remote_sync_path
+                    account.virtual_types = self._virtual_types
                     account.save()
                     return
 
@@ -209,10 +248,14 @@ class SyncAccount:
             # Get initial location
             self._remote_sync_path = temp_remote_path
 
-        # Remote path changed?
-        if temp_remote_path != self._remote_sync_path:
+        if self._virtual_types is None:
+            self._virtual_types = temp_virtual_types
+
+        # Remote path or the media types synchronized as .strm files changed?
+        if temp_remote_path != self._remote_sync_path or temp_virtual_types != self._virtual_types:
             self._remote_sync_path = temp_remote_path
-            log(f"Changed remote path for {self.account_name} to {self._remote_sync_path}")
+            self._virtual_types = temp_virtual_types
+            log(f"Changed remote path for {self.account_name} to {self._remote_sync_path} (stream links for: {self._virtual_types})")
 
             if self.root:
                 # Restart the synchronization
@@ -318,7 +361,12 @@ class SyncAccount:
                 log_error("Remote cursor present, but no remote data")
 
     def create_sync_root(self):
-        self.root = SyncFolder(self._remote_sync_path, self._client)
+        virtual = None
+
+        if self._virtual_types:
+            virtual = VirtualSync(self.account_name, self._virtual_types)
+
+        self.root = SyncFolder(self._remote_sync_path, self._client, virtual)
 
     def get_client_cursor(self):
 
@@ -351,6 +399,8 @@ class SyncAccount:
         except EnvironmentError as e:
             log_error(f"Storing storage_file Exception: {e!r}")
 
+        self.search_index.save()
+
     def get_sync_data(self):
         data = None
         cursor = None
@@ -367,6 +417,9 @@ class SyncAccount:
 
     def clear_sync_data(self):
         self._client_cursor = None
+        # The change feed starts from the beginning again
+        self.search_index.clear()
+        self.search_index.save()
 
         try:
             os.remove(self._storage_file)
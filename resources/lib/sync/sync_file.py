@@ -30,9 +30,12 @@ from .sync_object import SyncObject
 
 class SyncFile(SyncObject):
 
-    def __init__( self, path, client):
+    def __init__( self, path, client, virtual=None):
         log_debug(f"Create SyncFile: {path}")
-        super().__init__(path, client)
+        super().__init__(path, client, virtual)
+
+    def is_virtual(self):
+        return bool(self._virtual and self._name and self._virtual.is_virtual(self._name))
 
     def in_sync(self):
 
@@ -93,9 +96,15 @@ class SyncFile(SyncObject):
 
         self._state = self.in_sync()
 
-        if self._state == self.OBJECT_TO_DOWNLOAD:
+        if self._state == self.OBJECT_TO_DOWNLOAD and self.is_virtual():
+            succeeded = self._virtual.write(self.path, self._name, self._local_path)
+
+            if succeeded:
+                self.update_timestamp()
+
+        elif self._state == self.OBJECT_TO_DOWNLOAD:
             log_debug(f"Download file to: {self._local_path}")
-            succeeded = self._client.save_file(self.path, self._local_path)
+            succeeded = self._client.save_file(self.path, self._local_path, self.size)
 
             if succeeded:
                 self.update_timestamp()
@@ -136,6 +145,19 @@ class SyncFile(SyncObject):
 
         return succeeded
 
+    def set_downloaded(self):
+        """
+        Marks the file as synced when it was downloaded by other means,
+        e.g. as part of a zip archive of its folder
+        """
+
+        if not self._local_path or not xbmcvfs.exists(self._local_path):
+            return False
+
+        self.update_timestamp()
+        self._state = self.OBJECT_IN_SYNC
+        return True
+
     def set_item_info(self, path, metadata):
 
         if path == self.path:
@@ -152,3 +174,9 @@ class SyncFile(SyncObject):
 
     def set_client(self, client):
         self._client = client
+
+    def update_local_path(self, parent_sync_path):
+        super().update_local_path(parent_sync_path)
+
+        if self._local_path and self.is_virtual():
+            self._local_path = self._virtual.get_location(self._local_path)
@@ -32,9 +32,9 @@ from .sync_object import SyncObject
 
 class SyncFolder(SyncObject):
 
-    def __init__(self, path, client):
+    def __init__(self, path, client, virtual=None):
         log_debug(f"Create SyncFolder: {path}")
-        super().__init__(path, client)
+        super().__init__(path, client, virtual)
         self.is_dir = True
         self._children = {}
 
@@ -85,9 +85,9 @@ class SyncFolder(SyncObject):
 
             # Create the child
             if metadata.is_dir:
-                child = SyncFolder(child_path, self._client)
+                child = SyncFolder(child_path, self._client, self._virtual)
             else:
-                child = SyncFile(child_path, self._client)
+                child = SyncFile(child_path, self._client, self._virtual)
 
             # Add the new created child to the childern's list
             self._children[child_path] = child
@@ -163,15 +163,23 @@ class SyncFolder(SyncObject):
 
             self._failure = True
 
-    def get_items_to_sync(self):
+    def get_items_to_sync(self, paths=None):
+        """
+        Returns the folders and files which aren't in sync, only those in
+        (or leading to) paths when given
+        """
+
         dirs_to_sync = []
         items_to_sync = []
         remove_list = {}
 
         for path, child in self._children.items():
 
+            if paths and not any(self._in_scope(path, scope_path) for scope_path in paths):
+                continue
+
             if child.is_dir:
-                new_dirs, new_items = child.get_items_to_sync()
+                new_dirs, new_items = child.get_items_to_sync(paths)
                 dirs_to_sync += new_dirs
                 items_to_sync += new_items
 
@@ -198,6 +206,14 @@ class SyncFolder(SyncObject):
 
         return dirs_to_sync, items_to_sync
 
+    @staticmethod
+    def _in_scope(path, scope_path):
+        return (
+            path == scope_path
+            or path.startswith(scope_path + DROPBOX_SEP)
+            or scope_path.startswith(path + DROPBOX_SEP)
+        )
+
     def set_client(self, client):
         self._client = client
 
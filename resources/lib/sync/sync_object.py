@@ -37,9 +37,10 @@ class SyncObject:
     OBJECT_REMOVED = 5
     OBJECT_SKIP = 6
 
-    def __init__(self, path, client):
+    def __init__(self, path, client, virtual=None):
         self.path = path
         self._client = client
+        self._virtual = virtual # VirtualSync, None for a normal synchronization
         self._name = None
         self._local_path = None
         self.is_dir = False
@@ -49,6 +50,7 @@ class SyncObject:
         self._remote_timestamp = 0
         self._new_remote_timestamp = 0
         self._remote_client_modified_timestamp = 0
+        self.size = 0 # Only known for updated remote info
         self._state = self.OBJECT_IN_SYNC
 
     def set_item_info(self, metadata):
@@ -84,6 +86,7 @@ class SyncObject:
             # Convert to local time
             self._new_remote_timestamp = time.mktime(metadata.server_modified.replace(tzinfo=timezone.utc).astimezone(tz=None).timetuple())
             self._remote_client_modified_timestamp = time.mktime(metadata.client_modified.replace(tzinfo=timezone.utc).astimezone(tz=None).timetuple())
+            self.size = metadata.size
 
         self._remote_present = True
         self._name = metadata.name
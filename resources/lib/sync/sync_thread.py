@@ -19,20 +19,23 @@
 # *
 # */
 
+import os
 import time
 import threading
 
 import xbmc
 
 from ..utils import *
+from ..zip_stream import use_zip_download
 
 
 class SynchronizeThread(threading.Thread):
     PROGRESS_TIMEOUT = 20.0
 
-    def __init__(self, sync_account):
+    def __init__(self, sync_account, paths=None):
         super().__init__()
         self._sync_account = sync_account
+        self._paths = paths # Only synchronize these paths, None for everything
         self._last_progress_update = 0.0
         self._stop_event = threading.Event()
 
@@ -61,10 +64,13 @@ class SynchronizeThread(threading.Thread):
         has_more = True
         inital_sync = False
         client_cursor = self._sync_account.get_client_cursor()
+        search_index = self._sync_account.search_index
 
         if not client_cursor:
             inital_sync = True
             log("Starting first sync")
+        elif not search_index.is_complete(DROPBOX_SEP):
+            self._build_search_index()
 
         while has_more and not self.stopped():
             # Sync, get all metadata
@@ -74,6 +80,8 @@ class SynchronizeThread(threading.Thread):
                 return
 
             items, client_cursor, has_more = data
+            # The change feed covers the whole account
+            search_index.update(items)
 
             # Prepare item list
             for metadata in items:
@@ -93,23 +101,58 @@ class SynchronizeThread(threading.Thread):
             if len(items) > 0:
                 self._sync_account.root.update_local_root_path(self._sync_account._sync_path)
 
+            if not has_more and inital_sync:
+                search_index.set_complete(DROPBOX_SEP)
+
             # Store new cursor + data
             self._sync_account.store_sync_data(client_cursor)
 
+    def _build_search_index(self):
+        """
+        Indexes the whole account once, when the synchronization started
+        before the search index existed
+        """
+
+        log_debug(f"Building the search index of account {self._sync_account.account_name}")
+        search_index = self._sync_account.search_index
+        has_more = True
+        cursor = None
+
+        while has_more and not self.stopped():
+            data = self._sync_account._client.list_folder(DROPBOX_SEP, recursive=True, cursor=cursor)
+
+            if not data:
+                return
+
+            entries, cursor, has_more = data
+            search_index.update(entries)
+
+        if not self.stopped():
+            search_index.set_complete(DROPBOX_SEP)
+            search_index.save()
+
     def _synchronize(self):
         # Get the items to sync
-        sync_dirs, sync_items = self._sync_account.root.get_items_to_sync()
+        sync_dirs, sync_items = self._sync_account.root.get_items_to_sync(self._paths)
         # Always first sync (create) dirs, so that they will have the correct timestamps
 
         if len(sync_items) > 0 or len(sync_dirs) > 0:
+            new_dirs = [dir for dir in sync_dirs if dir.in_sync() == dir.OBJECT_TO_DOWNLOAD]
 
             for dir in sync_dirs:
 
                 if self.stopped():
                     break
 
+                state = dir.in_sync()
                 dir.sync()
 
+                if state == dir.OBJECT_TO_REMOVE:
+                    self._record_change(dir, state)
+
+            if not self.stopped():
+                sync_items = self._download_new_dirs(new_dirs, sync_items)
+
             items_total = len(sync_items)
 
             if items_total > 0 and not self.stopped():
@@ -121,16 +164,82 @@ class SynchronizeThread(threading.Thread):
                         break
                     else:
                         self.update_progress(item_number, items_total)
+                        state = item.in_sync()
                         synced = item.sync()
 
                         if synced:
                             item_number += 1
+                            self._record_change(item, state)
 
                 self.update_progress_finished(item_number, items_total)
 
             # Store the new data
             self._sync_account.store_sync_data()
 
+    def _download_new_dirs(self, new_dirs, sync_items):
+        """
+        Downloads new folders with many small files as one zip archive.
+        Returns the items which still have to be synced one by one.
+        """
+
+        handled_dirs = []
+
+        # Parents before children, a child of a downloaded folder is done already
+        for dir in sorted(new_dirs, key=lambda dir: len(dir.path)):
+
+            if self.stopped():
+                break
+
+            prefix = dir.path + DROPBOX_SEP
+
+            if any(dir.path.startswith(handled + DROPBOX_SEP) for handled in handled_dirs):
+                continue
+
+            items = [item for item in sync_items if item.path.startswith(prefix)]
+
+            # The archive would contain the media which is only linked to
+            if any(item.is_virtual() for item in items):
+                continue
+
+            entries_total = len(items) + len([child for child in new_dirs if child.path.startswith(prefix)])
+            sizes = [item.size for item in items] or [0]
+
+            if not use_zip_download(entries_total, sum(sizes), max(sizes)):
+                continue
+
+            # The archive contains the folder itself, so extract it in the parent folder
+            location = os.path.dirname(os.path.normpath(dir._local_path))
+            log_debug(f"Download folder as zip archive: {dir.path}")
+
+            if self._sync_account._client.save_folder_zip(dir.path, location):
+                handled_dirs.append(dir.path)
+                downloaded = [item for item in items if item.set_downloaded()]
+
+                for item in downloaded:
+                    self._record_change(item, item.OBJECT_TO_DOWNLOAD)
+
+                sync_items = [item for item in sync_items if item not in downloaded]
+
+        return sync_items
+
+    def _record_change(self, item, state):
+        """
+        Tells the library scanner about new, changed or removed media
+        """
+
+        scanner = self._sync_account.library_scanner
+
+        if not scanner or not item._local_path:
+            return
+
+        if item.is_dir:
+
+            if state == item.OBJECT_TO_REMOVE:
+                scanner.add_removed_folder(item._local_path)
+
+        elif state in (item.OBJECT_TO_DOWNLOAD, item.OBJECT_TO_REMOVE):
+            scanner.add(item._local_path, identify_file_type(item.path), removed=state == item.OBJECT_TO_REMOVE)
+
     def update_progress(self, handled, total):
         now = time.time()
 
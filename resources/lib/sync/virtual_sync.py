@@ -0,0 +1,60 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import urllib.parse
+
+from ..utils import *
+
+
+class VirtualSync:
+    """
+    Synchronizes files of the selected media types as .strm files which
+    play the file from Dropbox, instead of downloading their content.
+    Kodi can add these to its library like the real files.
+    """
+
+    def __init__(self, account_name, media_types):
+        self.account_name = account_name
+        self.media_types = tuple(media_types)
+
+    def is_virtual(self, name):
+        return identify_file_type(name) in self.media_types
+
+    @staticmethod
+    def get_location(location):
+        return replace_file_extension(location, "strm")
+
+    def get_url(self, path, name):
+        # The play action uses the streaming proxy of the service when it runs
+        return "{}?action=play&path={}&filename={}&account={}".format(
+            ADDON_URL,
+            urllib.parse.quote(path),
+            urllib.parse.quote(name),
+            urllib.parse.quote(self.account_name),
+        )
+
+    def write(self, path, name, location):
+
+        with open(location, "w", encoding="utf-8") as file_obj:
+            file_obj.write(self.get_url(path, name))
+
+        log_debug(f"Created stream link: {location}")
+        return True
@@ -1,8 +1,10 @@
 import os
 import sys
+import hashlib
 import urllib.parse
 
 import xbmc
+import xbmcgui
 import xbmcvfs
 import xbmcaddon
 
@@ -21,6 +23,8 @@ LANGUAGE_STRING = ADDON.getLocalizedString
 DATA_PATH       = xbmcvfs.translatePath(ADDON.getAddonInfo("profile"))
 DROPBOX_SEP     = "/"
 
+CONTENT_HASH_BLOCK_SIZE = 4 * 1024 * 1024
+
 
 def log(txt):
     message = f"{ADDON_ID} {txt}"
@@ -37,6 +41,11 @@ def log_debug(txt):
     xbmc.log(msg=message, level=xbmc.LOGDEBUG)
 
 
+def get_home_window():
+    # The properties of the home window are shared by the plugin and the service
+    return xbmcgui.Window(10000)
+
+
 def parse_argv():
     params = {}
     param_string = sys.argv[2]
@@ -57,7 +66,25 @@ def get_local_sync_path(local_sync_path, remote_sync_path, item_path):
     return os.path.normpath(local_sync_path + DROPBOX_SEP + item_path)
 
 
-def get_cache_path(account_name):
+def get_local_copy(account_settings, path):
+    """
+    Returns the location of a local copy of the file: the synchronized file or
+    the downloaded (shadow) file, None when there is none
+    """
+
+    if account_settings.synchronisation and account_settings.remote_path in path and identify_file_type(path) not in account_settings.virtual_types:
+        location = get_local_sync_path(account_settings.sync_path, account_settings.remote_path, path)
+
+        if xbmcvfs.exists(location):
+            return location
+
+    location = os.path.normpath(f"{get_cache_path(account_settings.account_name)}/shadow/{path}")
+
+    if xbmcvfs.exists(location):
+        return location
+
+
+def get_cache_root():
     data_path = ADDON_SETTINGS.getString("cache_path")
 
     # Use user defined location?
@@ -65,7 +92,11 @@ def get_cache_path(account_name):
         # Get the default path
         data_path = DATA_PATH
 
-    return os.path.normpath(f"{data_path}/{account_name}")
+    return data_path
+
+
+def get_cache_path(account_name):
+    return os.path.normpath(f"{get_cache_root()}/{account_name}")
 
 
 def replace_file_extension(path, file_extension):
@@ -92,6 +123,53 @@ def identify_file_type(filename):
         return "other"
 
 
+def get_content_hash(filename):
+    """
+    Returns the Dropbox content hash of a local file: the SHA-256 of the
+    concatenated SHA-256 hashes of every 4 MB block of the file
+    """
+
+    block_hashes = hashlib.sha256()
+
+    with open(filename, "rb") as file_obj:
+
+        while True:
+            block = file_obj.read(CONTENT_HASH_BLOCK_SIZE)
+
+            if not block:
+                break
+
+            block_hashes.update(hashlib.sha256(block).digest())
+
+    return block_hashes.hexdigest()
+
+
+def format_size(size):
+
+    for unit in ("B", "KB", "MB", "GB"):
+
+        if size < 1024:
+            return f"{size:.1f} {unit}"
+
+        size /= 1024
+
+    return f"{size:.1f} TB"
+
+
+def get_transfer_text(handled, total, speed):
+    """
+    Returns the progress text of a transfer: handled/total size, speed and ETA
+    """
+
+    text = f"{format_size(handled)} / {format_size(total)} - {format_size(speed)}/s"
+
+    if speed and total > handled:
+        eta = int((total - handled) / speed)
+        text += f" - ETA {eta // 3600}:{eta % 3600 // 60:02d}:{eta % 60:02d}"
+
+    return text
+
+
 def xor(w1, w2):
     from itertools import cycle
     # xor two strings together with the length of the first string limiting
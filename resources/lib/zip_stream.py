@@ -0,0 +1,295 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import io
+import os
+import zlib
+import struct
+
+import xbmcvfs
+
+from .utils import *
+
+
+# Limits of files_download_zip
+ZIP_MAX_SIZE = 20 * 1024 * 1024 * 1024
+ZIP_MAX_FILE_SIZE = 4 * 1024 * 1024 * 1024
+ZIP_MAX_ENTRIES = 10000
+# Only worth it for many small files
+ZIP_MIN_FILES = 20
+ZIP_MAX_AVERAGE_SIZE = 4 * 1024 * 1024
+
+LOCAL_FILE_HEADER = b"PK\x03\x04"
+DATA_DESCRIPTOR = b"PK\x07\x08"
+LOCAL_FILE_HEADER_FORMAT = "<4sHHHHHIIIHH"
+ZIP64_EXTRA_ID = 0x0001
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+READ_SIZE = 64 * 1024
+
+
+def use_zip_download(entries_total, bytes_total, max_file_size):
+    """
+    Decides if a folder is downloaded as one zip archive instead of file by file
+    """
+
+    return (
+        ZIP_MIN_FILES <= entries_total < ZIP_MAX_ENTRIES
+        and bytes_total < ZIP_MAX_SIZE
+        and max_file_size < ZIP_MAX_FILE_SIZE
+        and bytes_total / entries_total <= ZIP_MAX_AVERAGE_SIZE
+    )
+
+
+class ZipStreamExtractor:
+    """
+    Extracts a zip archive while it is read from a stream (e.g. a HTTP response),
+    so the archive doesn't have to be stored first.
+    The entries are read by their local file headers, the central directory at
+    the end of the archive isn't needed.
+    """
+
+    def __init__(self, stream, location, on_file=None):
+        self._stream = stream
+        self._location = os.path.normpath(location)
+        self._on_file = on_file
+        self._buffer = b""
+
+    def _read(self, size):
+        """
+        Returns up to size bytes, less only at the end of the stream
+        """
+
+        while len(self._buffer) < size:
+            data = self._stream.read(max(READ_SIZE, size - len(self._buffer)))
+
+            if not data:
+                break
+
+            self._buffer += data
+
+        data = self._buffer[:size]
+        self._buffer = self._buffer[size:]
+        return data
+
+    def _read_exact(self, size):
+        data = self._read(size)
+
+        if len(data) != size:
+            raise EOFError("Unexpected end of the zip stream")
+
+        return data
+
+    def _unread(self, data):
+        self._buffer = data + self._buffer
+
+    def extract(self):
+
+        while True:
+            signature = self._read(4)
+
+            if signature != LOCAL_FILE_HEADER:
+                # The central directory (or the end of the stream) is reached
+                return
+
+            self._unread(signature)
+            self._extract_entry()
+
+    def _extract_entry(self):
+        header = self._read_exact(struct.calcsize(LOCAL_FILE_HEADER_FORMAT))
+        (
+            signature, version, flags, method, mod_time, mod_date,
+            crc, compressed_size, size, name_length, extra_length,
+        ) = struct.unpack(LOCAL_FILE_HEADER_FORMAT, header)
+        name = self._read_exact(name_length)
+        extra = self._read_exact(extra_length)
+        name = name.decode("utf-8" if flags & FLAG_UTF8 else "cp437")
+        zip64 = False
+
+        for extra_id, extra_data in self._parse_extra(extra):
+
+            if extra_id == ZIP64_EXTRA_ID:
+                zip64 = True
+                values = list(struct.unpack(f"<{len(extra_data) // 8}Q", extra_data[:len(extra_data) // 8 * 8]))
+
+                if size == 0xFFFFFFFF and values:
+                    size = values.pop(0)
+
+                if compressed_size == 0xFFFFFFFF and values:
+                    compressed_size = values.pop(0)
+
+        location = self._get_location(name)
+        is_dir = name.endswith("/")
+
+        if is_dir:
+            self._make_dirs(location + os.sep)
+            written, checksum = self._read_data(io.BytesIO(), method, flags, compressed_size, zip64, name)
+        else:
+            self._make_dirs(os.path.dirname(location) + os.sep)
+
+            with open(location, "wb") as file_obj:
+                written, checksum = self._read_data(file_obj, method, flags, compressed_size, zip64, name)
+
+        if flags & FLAG_DATA_DESCRIPTOR:
+            crc = self._read_data_descriptor(zip64)
+
+        if checksum != crc:
+            raise ValueError(f"CRC mismatch for zip entry: {name}")
+
+        if not is_dir:
+            log_debug(f"Extracted file to: {location}")
+
+            if self._on_file:
+                self._on_file(location, written)
+
+    def _read_data(self, file_obj, method, flags, compressed_size, zip64, name):
+
+        if method == METHOD_DEFLATED:
+            return self._inflate(file_obj, None if flags & FLAG_DATA_DESCRIPTOR else compressed_size)
+        elif method == METHOD_STORED and not flags & FLAG_DATA_DESCRIPTOR:
+            return self._copy(file_obj, compressed_size)
+        elif method == METHOD_STORED:
+            return self._copy_to_descriptor(file_obj, zip64)
+        else:
+            raise ValueError(f"Unsupported zip entry (method {method}, flags {flags}): {name}")
+
+    @staticmethod
+    def _parse_extra(extra):
+
+        while len(extra) >= 4:
+            extra_id, length = struct.unpack("<HH", extra[:4])
+            yield extra_id, extra[4:4 + length]
+            extra = extra[4 + length:]
+
+    def _get_location(self, name):
+        # Never write outside the location
+        parts = [part for part in name.split("/") if part and part != "."]
+
+        if ".." in parts:
+            raise ValueError(f"Invalid zip entry name: {name}")
+
+        return os.path.normpath(os.path.join(self._location, *parts))
+
+    @staticmethod
+    def _make_dirs(path):
+
+        if not xbmcvfs.exists(path):
+            xbmcvfs.mkdirs(path)
+
+    def _copy(self, file_obj, size):
+        checksum = 0
+        remaining = size
+
+        while remaining > 0:
+            data = self._read_exact(min(READ_SIZE, remaining))
+            checksum = zlib.crc32(data, checksum)
+            file_obj.write(data)
+            remaining -= len(data)
+
+        return size, checksum
+
+    def _copy_to_descriptor(self, file_obj, zip64):
+        """
+        Copies a stored entry whose size is only in the data descriptor after it.
+        The data ends at a descriptor signature followed by the CRC and the size
+        of the data before it, the signature alone can be a part of the data.
+        """
+
+        descriptor_format = "<4sIQQ" if zip64 else "<4sIII"
+        descriptor_size = struct.calcsize(descriptor_format)
+        checksum = 0
+        written = 0
+        pending = b""
+        start = 0
+
+        while True:
+            position = pending.find(DATA_DESCRIPTOR, start)
+
+            if position < 0:
+                # Write all but what could be the start of a signature
+                flushed = max(0, len(pending) - len(DATA_DESCRIPTOR) + 1)
+                checksum = zlib.crc32(pending[:flushed], checksum)
+                file_obj.write(pending[:flushed])
+                written += flushed
+                pending = pending[flushed:]
+                start = 0
+            elif len(pending) >= position + descriptor_size:
+                signature, crc, compressed_size, size = struct.unpack(descriptor_format, pending[position:position + descriptor_size])
+
+                if compressed_size == size == written + position and crc == zlib.crc32(pending[:position], checksum):
+                    file_obj.write(pending[:position])
+                    # The descriptor is read after the entry data
+                    self._unread(pending[position:])
+                    return written + position, crc
+
+                start = position + 1
+                continue
+
+            data = self._read(READ_SIZE)
+
+            if not data:
+                raise EOFError("Unexpected end of the zip stream")
+
+            pending += data
+
+    def _inflate(self, file_obj, compressed_size):
+        """
+        Inflates the entry data. Without a compressed size (data descriptor)
+        the end of the deflate stream marks the end of the entry.
+        """
+
+        decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+        checksum = 0
+        written = 0
+        remaining = compressed_size
+
+        while not decompressor.eof:
+
+            if remaining is None:
+                data = self._read(READ_SIZE)
+            else:
+                data = self._read(min(READ_SIZE, remaining))
+                remaining -= len(data)
+
+            if not data:
+                raise EOFError("Unexpected end of the zip stream")
+
+            output = decompressor.decompress(data)
+            checksum = zlib.crc32(output, checksum)
+            file_obj.write(output)
+            written += len(output)
+
+        # Give back what belongs to the next part of the stream
+        self._unread(decompressor.unused_data)
+        return written, checksum
+
+    def _read_data_descriptor(self, zip64):
+        signature = self._read_exact(4)
+
+        # The signature of the data descriptor is optional
+        if signature != DATA_DESCRIPTOR:
+            self._unread(signature)
+
+        crc, = struct.unpack("<I", self._read_exact(4))
+        self._read_exact(16 if zip64 else 8) # Sizes
+        return crc
@@ -0,0 +1,257 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import time
+import threading
+import urllib.parse
+
+import xbmcgui
+import xbmcplugin
+
+import resources.lib.login as login
+from resources.lib.utils import *
+from resources.lib.dropbox_cache import DropboxCache, FolderMetadata
+from resources.lib.search_index import SearchIndex
+from resources.lib.account_settings import AccountSettings
+from resources.lib.dropbox_client import KodiDropboxClient
+
+
+HANDLE = int(sys.argv[1])
+
+
+class AccountSearch(threading.Thread):
+    """
+    Searches one account, in its local index when that covers the account
+    and otherwise on Dropbox until the time budget is used
+    """
+
+    def __init__(self, account_settings, search_text, content_type, deadline):
+        super().__init__()
+        self.daemon = True # A slow account is left behind
+        self.account_settings = account_settings
+        self._search_text = search_text
+        self._content_type = content_type
+        self._deadline = deadline
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._results = []
+        self.error = None # Shown by the main thread, not from this thread
+
+    def stop(self):
+        self._stop_event.set()
+
+    def stopped(self):
+        return self._stop_event.is_set()
+
+    def get_results(self):
+
+        with self._lock:
+            return list(self._results)
+
+    def run(self):
+
+        try:
+            self._search()
+        except Exception as e:
+            log_error(f"Search failed for account {self.account_settings.account_name}: {e!r}")
+            self.error = e
+
+    def _search(self):
+        account_name = self.account_settings.account_name
+        cache = DropboxCache(account_name)
+        index = SearchIndex(account_name)
+        index.add_cached_folders(cache)
+
+        if index.is_complete(DROPBOX_SEP):
+            log_debug(f"Searching the local index of account: {account_name}")
+            pages = [index.search(self._search_text, DROPBOX_SEP, SEARCH_MAX_RESULTS)]
+        else:
+            client = KodiDropboxClient(
+                self.account_settings.access_token,
+                self.account_settings.refresh_token,
+                self.account_settings.app_key,
+                self.account_settings.app_secret,
+                account_name,
+                cache,
+            )
+            pages = client.search_pages(self._search_text, DROPBOX_SEP, self._content_type, silent=True)
+
+        # The next page is only requested when the loop continues
+        for entries in pages:
+
+            if self._content_type in SEARCH_CATEGORIES:
+                entries = [
+                    metadata for metadata in entries
+                    if isinstance(metadata, FolderMetadata) or identify_file_type(metadata.name) == self._content_type
+                ]
+
+            with self._lock:
+                self._results += entries
+
+            # No further pages are requested once the results are shown
+            if self.stopped() or time.time() > self._deadline:
+                log_debug(f"Search time budget used for account: {account_name}")
+                break
+
+
+class GlobalSearch:
+    """
+    Searches all unlocked accounts at the same time and shows the merged
+    results, the best matches first
+    """
+
+    def __init__(self, params):
+        self._content_type = params.get("content_type", "executable")
+        self._search_text = params.get("search_text", "")
+        self._filter_files = ADDON_SETTINGS.getBool("file_filter")
+        self._results = [] # (score, account_name, metadata)
+
+    def get_accounts(self):
+        accounts_dir = f"{DATA_PATH}/accounts/"
+
+        if not xbmcvfs.exists(accounts_dir):
+            return []
+
+        accounts = [AccountSettings(account_name) for account_name in os.listdir(accounts_dir)]
+        # Asking for passcodes would defeat searching at the same time
+        return [account for account in accounts if account.access_token and login.is_unlocked(account)]
+
+    def build_list(self, dialog=None):
+        content_type = self._content_type if self._filter_files else None
+        deadline = time.time() + SEARCH_TIME_BUDGET
+        searches = [AccountSearch(account, self._search_text, content_type, deadline) for account in self.get_accounts()]
+        [search.start() for search in searches]
+
+        for search in searches:
+            # Don't wait for an account past the budget, use what it found so far
+            search.join(max(0, deadline - time.time()))
+
+            if dialog and dialog.iscanceled():
+                break
+
+        failed = []
+
+        for search in searches:
+            search.stop()
+            account_name = search.account_settings.account_name
+            self._results += [(self.get_score(metadata), account_name, metadata) for metadata in search.get_results()]
+
+            if search.error:
+                failed.append(account_name)
+
+        if failed:
+            # One message for all accounts, the results of the others are still shown
+            xbmcgui.Dialog().notification(ADDON_NAME, f"{LANGUAGE_STRING(30212)} {', '.join(failed)}", xbmcgui.NOTIFICATION_WARNING)
+
+        self._results.sort(key=lambda result: result[0], reverse=True)
+
+        for score, account_name, metadata in self._results:
+
+            if isinstance(metadata, FolderMetadata):
+                self.add_folder(account_name, metadata)
+            else:
+                self.add_file(account_name, metadata)
+
+    def get_score(self, metadata):
+        """
+        Ranks a result: whole name, start of the name, start of a word, anywhere;
+        then shallow paths and recent files first
+        """
+
+        query = self._search_text.lower()
+        name = os.path.splitext(metadata.name.lower())[0]
+
+        if name == query:
+            score = 4
+        elif name.startswith(query):
+            score = 3
+        elif f" {query}" in f" {name.replace('.', ' ').replace('_', ' ').replace('-', ' ')}":
+            score = 2
+        else:
+            score = 1
+
+        modified = getattr(metadata, "server_modified", None)
+        return (score, -metadata.path_lower.count(DROPBOX_SEP), modified.timestamp() if modified else 0)
+
+    def add_folder(self, account_name, metadata):
+        list_item = xbmcgui.ListItem(f"{metadata.name} ({account_name})")
+        list_item.setArt({"icon": "DefaultFolder.png", "thumb": "DefaultFolder.png"})
+        url = "{}?content_type={}&account={}&path={}&module=browse_folder".format(
+            ADDON_URL,
+            self._content_type,
+            urllib.parse.quote(account_name),
+            urllib.parse.quote(metadata.path_lower),
+        )
+        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=True)
+
+    def add_file(self, account_name, metadata):
+        media_type = identify_file_type(metadata.name)
+        list_item = xbmcgui.ListItem(f"{metadata.name} ({account_name})")
+        list_item.setArt({"icon": ICONS[media_type]})
+        list_item.setDateTime(metadata.server_modified.strftime("%Y-%m-%d %H:%M:%S"))
+        list_item.setInfo(TYPES[media_type], {"size": metadata.size})
+        path = urllib.parse.quote(metadata.path_lower)
+        account_name = urllib.parse.quote(account_name)
+
+        if media_type in ("video", "audio"):
+            list_item.setProperty("IsPlayable", "true")
+            url = f"{ADDON_URL}?action=play&path={path}&filename={urllib.parse.quote(metadata.name)}&account={account_name}"
+        elif media_type == "image":
+            # Shown by the action, the list has no folder for the slideshow
+            url = f"{ADDON_URL}?action=view_original&path={path}&size={metadata.size}&account={account_name}"
+        else:
+            list_item.setProperty("IsPlayable", "false")
+            url = "No action"
+
+        xbmcplugin.addDirectoryItem(HANDLE, url, list_item, isFolder=False)
+
+    def show(self):
+
+        if self._results:
+            xbmcplugin.endOfDirectory(HANDLE, cacheToDisc=False)
+        else:
+            xbmcgui.Dialog().ok(ADDON_NAME, LANGUAGE_STRING(30021))
+            xbmcplugin.endOfDirectory(HANDLE, succeeded=False)
+
+
+def run(params):
+    search_text = params.get("search_text", "")
+
+    if not search_text:
+        keyboard = xbmc.Keyboard("", LANGUAGE_STRING(30018))
+        keyboard.doModal()
+
+        if not keyboard.isConfirmed():
+            return
+
+        search_text = keyboard.getText()
+        params["search_text"] = search_text
+
+    if len(search_text) < 2:
+        # Search text has to be at least 2 chars
+        xbmcgui.Dialog().ok(ADDON_NAME, LANGUAGE_STRING(30019))
+    else:
+        search = GlobalSearch(params)
+        dialog = xbmcgui.DialogProgress()
+        dialog.create(ADDON_NAME, f"{LANGUAGE_STRING(30020)} {search_text}")
+        search.build_list(dialog)
+        dialog.close()
+        search.show()
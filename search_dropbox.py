@@ -25,6 +25,7 @@ import xbmcplugin
 import resources.lib.login as login
 from resources.lib.utils import *
 from resources.lib.dropbox_viewer import *
+from resources.lib.search_index import SearchIndex
 
 
 HANDLE = int(sys.argv[1])
@@ -35,16 +36,53 @@ class DropboxSearch(DropboxViewer):
     def __init__(self, params, account_settings):
         super().__init__(params, account_settings)
         self._search_text = params.get("search_text", "")
+        self._results_total = 0
 
-    def build_list(self):
-        search_result = self._client.search(self._search_text, self._current_path)
-        super().build_list(search_result)
+    def build_list(self, dialog=None):
+        """
+        Adds the results to the listing page by page as they arrive
+        """
+
+        self.create_loader()
+        content_type = self._content_type if self._filter_files else None
+
+        for entries in self.get_result_pages(content_type):
+            self._results_total += len(entries)
+            self.add_items(self._cache.sort_metadata(entries))
+
+            if dialog:
+
+                if dialog.iscanceled():
+                    break
+
+                dialog.update(min(100, self._results_total * 100 // SEARCH_MAX_RESULTS), f"{LANGUAGE_STRING(30020)} {self._search_text} ({self._results_total})")
+
+    def get_result_pages(self, content_type):
+        index = SearchIndex(self._account_name)
+        index.add_cached_folders(self._cache)
+
+        # Only ask Dropbox when the folder isn't indexed completely
+        if index.is_complete(self._current_path):
+            log_debug(f"Searching the local index: {self._current_path}")
+            entries = index.search(self._search_text, self._current_path, SEARCH_MAX_RESULTS)
+
+            if content_type in SEARCH_CATEGORIES:
+                entries = [
+                    metadata for metadata in entries
+                    if isinstance(metadata, FolderMetadata) or identify_file_type(metadata.name) == content_type
+                ]
+
+            return [entries]
+
+        return self._client.search_pages(self._search_text, self._current_path, content_type)
 
     def show(self):
 
-        if self._loader:
+        if self._results_total:
             super().show()
         else:
+            # Nothing to load
+            self._loader = None
             xbmcgui.Dialog().ok(ADDON_NAME, LANGUAGE_STRING(30021))
             super().show(succeeded=False)
 
@@ -81,6 +119,6 @@ def run(params):
             search = DropboxSearch(params, account_settings)
             dialog = xbmcgui.DialogProgress()
             dialog.create(ADDON_NAME, f"{LANGUAGE_STRING(30020)} {search_text}")
-            search.build_list()
+            search.build_list(dialog)
             dialog.close()
             search.show()
@@ -3,6 +3,8 @@ import threading
 from resources.lib.utils import *
 from resources.lib.oauth.register import *
 from resources.lib.sync.dropbox_sync import DropboxSynchronizer
+from resources.lib.cache_warmer import CacheWarmer
+from resources.lib.streaming_proxy import StreamingProxy
 
 
 if __name__ == "__main__":
@@ -18,6 +20,15 @@ if __name__ == "__main__":
 
     server_thread = threading.Thread(target=server.serve_forever)
     server_thread.start()
+    proxy = None
+
+    if ADDON_SETTINGS.getBool("streaming_proxy", True):
+        proxy = StreamingProxy()
+        proxy_thread = threading.Thread(target=proxy.serve_forever)
+        proxy_thread.start()
+
+    warmer = CacheWarmer()
+    warmer.start()
 
     while not monitor.abortRequested():
 
@@ -27,3 +38,9 @@ if __name__ == "__main__":
     server.shutdown()
     server.server_close()
     server.socket.close()
+
+    if proxy:
+        proxy.shutdown()
+        proxy.server_close()
+
+    warmer.stop()
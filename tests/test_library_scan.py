@@ -0,0 +1,132 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import json
+
+import pytest
+
+pytest.importorskip("xbmc")
+
+import resources.lib.sync.library_scan as library_scan
+from resources.lib.sync.library_scan import LibraryScanner
+
+
+class StubRpc:
+    """
+    Stands in for xbmc.executeJSONRPC, records the requests
+    """
+
+    def __init__(self, scanning=False):
+        self.scanning = scanning
+        self.requests = []
+
+    def __call__(self, request):
+        request = json.loads(request)
+
+        if request["method"] == "XBMC.GetInfoBooleans":
+            return json.dumps({"id": 1, "jsonrpc": "2.0", "result": {"Library.IsScanning": self.scanning}})
+
+        self.requests.append((request["method"], request["params"]))
+        return json.dumps({"id": 1, "jsonrpc": "2.0", "result": "OK"})
+
+
+class StubSettings:
+
+    def getBool(self, setting_id, default=None):
+        return default
+
+
+@pytest.fixture
+def scanner(monkeypatch):
+    monkeypatch.setattr(library_scan, "ADDON_SETTINGS", StubSettings())
+    scanner = LibraryScanner(StubRpc())
+    yield scanner
+    scanner.stop()
+
+
+def location(*parts):
+    return os.path.join(os.sep, "sync", *parts)
+
+
+def directory(*parts):
+    return os.path.join(location(*parts), "")
+
+
+def test_scan_merges_folders(scanner):
+    scanner.add(location("movies", "a.mkv"), "video")
+    scanner.add(location("movies", "b.mkv"), "video")
+    scanner.add(location("movies", "extras", "c.mkv"), "video")
+    scanner.add(location("music", "song.mp3"), "audio")
+    scanner.flush()
+
+    assert scanner._rpc.requests == [
+        ("VideoLibrary.Scan", {"directory": directory("movies"), "showdialogs": False}),
+        ("AudioLibrary.Scan", {"directory": directory("music"), "showdialogs": False}),
+    ]
+
+
+def test_clean_params(scanner):
+    scanner.add(location("movies", "a.mkv"), "video", removed=True)
+    scanner.add(location("music", "song.mp3"), "audio", removed=True)
+    scanner.add(location("music", "other", "song.mp3"), "audio", removed=True)
+    scanner.flush()
+
+    # AudioLibrary.Clean only accepts showdialogs
+    assert scanner._rpc.requests == [
+        ("VideoLibrary.Clean", {"directory": directory("movies"), "showdialogs": False}),
+        ("AudioLibrary.Clean", {"showdialogs": False}),
+    ]
+
+
+def test_removed_folder(scanner):
+    scanner.add_removed_folder(location("shows"))
+    scanner.flush()
+
+    assert scanner._rpc.requests == [
+        ("VideoLibrary.Clean", {"directory": location() + os.sep, "showdialogs": False}),
+        ("AudioLibrary.Clean", {"showdialogs": False}),
+    ]
+
+
+def test_busy_library_scans_later(scanner):
+    scanner._rpc.scanning = True
+    scanner.add(location("movies", "a.mkv"), "video")
+    scanner.flush()
+
+    assert scanner._rpc.requests == []
+    assert scanner._timer is not None
+
+    scanner._rpc.scanning = False
+    scanner.flush()
+
+    assert scanner._rpc.requests == [("VideoLibrary.Scan", {"directory": directory("movies"), "showdialogs": False})]
+
+
+def test_scan_disabled(monkeypatch):
+    settings = StubSettings()
+    settings.getBool = lambda setting_id, default=None: False
+    monkeypatch.setattr(library_scan, "ADDON_SETTINGS", settings)
+    scanner = LibraryScanner(StubRpc())
+    scanner.add(location("movies", "a.mkv"), "video")
+    scanner.flush()
+
+    assert scanner._rpc.requests == []
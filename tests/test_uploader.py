@@ -0,0 +1,152 @@
+#/*
+# *      Copyright (C) 2013 Joost Kop
+# *
+# *
+# *  This Program is free software; you can redistribute it and/or modify
+# *  it under the terms of the GNU General Public License as published by
+# *  the Free Software Foundation; either version 2, or (at your option)
+# *  any later version.
+# *
+# *  This Program is distributed in the hope that it will be useful,
+# *  but WITHOUT ANY WARRANTY; without even the implied warranty of
+# *  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# *  GNU General Public License for more details.
+# *
+# *  You should have received a copy of the GNU General Public License
+# *  along with this program; see the file COPYING.  If not, write to
+# *  the Free Software Foundation, 675 Mass Ave, Cambridge, MA 02139, USA.
+# *  http://www.gnu.org/copyleft/gpl.html
+# *
+# */
+
+import os
+import time
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip("xbmc")
+pytest.importorskip("dropbox")
+
+from resources.lib.dropbox_uploader import Uploader
+
+
+MB = 1024 * 1024
+
+
+class MockApi:
+    """
+    Upload session methods of dropbox.Dropbox with a simulated connection:
+    every call costs latency seconds and every connection sends bandwidth bytes per second
+    """
+
+    def __init__(self, latency, bandwidth):
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.calls = 0
+        self.ranges = [] # (offset, size) of the chunks in the order they were sent
+        self.max_active = 0 # Most calls in progress at the same time
+        self._active = 0
+        self._chunks = {}
+        self._lock = threading.Lock()
+
+    def _send(self, offset, data):
+
+        with self._lock:
+            self._active += 1
+            self.max_active = max(self.max_active, self._active)
+
+            if data:
+                self.ranges.append((offset, len(data)))
+
+        time.sleep(self.latency + len(data) / self.bandwidth)
+
+        with self._lock:
+            self._active -= 1
+            self.calls += 1
+
+            if data:
+                self._chunks[offset] = data
+
+    def files_upload_session_start(self, f, close=False, session_type=None):
+        self._send(0, f)
+        return SimpleNamespace(session_id="session")
+
+    def files_upload_session_append_v2(self, f, cursor, close=False):
+        self._send(cursor.offset, f)
+
+    def get_content(self):
+        return b"".join(self._chunks[offset] for offset in sorted(self._chunks))
+
+
+class TimedUploader(Uploader):
+    # Scaled down, so the mock reaches the limits of the chunk size in a few chunks
+    CHUNK_DURATION = 0.2
+
+
+@pytest.fixture
+def upload_file(tmp_path):
+    filename = tmp_path / "upload.bin"
+    # Not a multiple of the chunk alignment, the tail chunk is shorter
+    filename.write_bytes(os.urandom(24 * MB + 12345))
+    return str(filename)
+
+
+def upload(filename, connections, latency=0.05, bandwidth=100 * MB, uploader_class=Uploader):
+    api = MockApi(latency, bandwidth)
+    uploader = uploader_class(api, filename, "/upload.bin", connections=connections)
+    uploader.run()
+    return api, uploader
+
+
+@pytest.mark.parametrize("connections", [1, 2, 4])
+def test_upload_content(upload_file, connections):
+    api, uploader = upload(upload_file, connections)
+
+    assert uploader.error is None
+    assert uploader.completed
+    assert uploader.bytes_uploaded == os.path.getsize(upload_file)
+
+    with open(upload_file, "rb") as f:
+        assert api.get_content() == f.read()
+
+
+def test_single_connection_sends_in_order(upload_file):
+    api, uploader = upload(upload_file, 1)
+
+    assert uploader.completed
+    assert api.max_active == 1
+    assert api.ranges == sorted(api.ranges)
+
+
+def test_concurrent_upload_overlaps_calls(upload_file):
+    api, uploader = upload(upload_file, 4)
+
+    assert uploader.completed
+    assert 1 < api.max_active <= 4
+
+    # The ranges cover the file without gaps or overlaps
+    ranges = sorted(api.ranges)
+    assert ranges[0][0] == 0
+
+    for (offset, size), (next_offset, next_size) in zip(ranges, ranges[1:]):
+        assert next_offset == offset + size
+
+    assert ranges[-1][0] + ranges[-1][1] == os.path.getsize(upload_file)
+
+
+def test_chunk_size_grows_with_latency(upload_file):
+    # Each call costs more than a chunk takes to send, so larger chunks save calls
+    api, uploader = upload(upload_file, 1, latency=0.02, bandwidth=400 * MB, uploader_class=TimedUploader)
+
+    assert uploader.completed
+    assert uploader._chunk_size > Uploader.MIN_CHUNK_SIZE
+    assert api.calls < 24 * MB // Uploader.MIN_CHUNK_SIZE + 1
+
+
+def test_chunk_size_stays_small_on_slow_connection(upload_file):
+    api, uploader = upload(upload_file, 1, latency=0, bandwidth=8 * MB, uploader_class=TimedUploader)
+
+    assert uploader.completed
+    assert uploader._chunk_size == Uploader.MIN_CHUNK_SIZE